@@ -1,47 +1,68 @@
+import os
+import logging
 from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, status, Depends
-from app.utils.db import get_database
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import PlainTextResponse
+from app.utils.db import get_database, causal_session
 from app.utils.auth import get_current_admin
-from bson import ObjectId
-from typing import List, Dict
+from app.utils.policy_store import find_policy, delete_policy_document, LIST_PROJECTION, TITLE_PROJECTION
+from app.utils.db_metrics import db_metrics_snapshot
+from app.utils.request_metrics import CompactJSONResponse
+from app.services.llm_telemetry import telemetry_snapshot
+from app.services.policy_cleanup import start_cleanup_job, get_cleanup_job
+from app.utils.retention import run_archival, find_with_archives, count_with_archives, policy_rule
+from app.utils.profiler import profile_worker, profile_running, collapsed
+from app.utils.loop_monitor import loop_monitor_snapshot
+from app.utils.settings import get_settings
+from typing import List, Dict, Optional
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 @router.get("/analytics/summary")
 async def get_analytics_summary(admin: dict = Depends(get_current_admin)):
     """Get admin dashboard analytics summary"""
-    db = await get_database()
+    db = await get_database("analytics")
     
+    # One causal session so consecutive queries never go back in time when they
+    # land on different secondaries. Each query still reads the latest data its
+    # member has, so the counts are not a snapshot of a single point in time.
+    async with causal_session() as db_session:
+        return await _analytics_summary(db, db_session)
+
+
+async def _analytics_summary(db, db_session):
+    """Compute the dashboard summary, reading through the caller's session"""
     # Total users
-    total_users = await db.users.count_documents({"role": "user"})
+    total_users = await db.users.count_documents({"role": "user"}, session=db_session)
     
     # Total policies
-    total_policies = await db.policies.count_documents({})
+    total_policies = await db.policies.count_documents({}, session=db_session)
     
-    # Total game plays
-    total_game_plays = await db.game_sessions.count_documents({})
+    # Total game plays (archived sessions included, as in every query below)
+    total_game_plays = await count_with_archives(db, "game_sessions", {}, session=db_session)
     
     # Completed games
-    completed_games = await db.game_sessions.count_documents({"completed": True})
+    completed_games = await count_with_archives(db, "game_sessions", {"completed": True}, session=db_session)
     
     # Completion rate
     completion_rate = (completed_games / total_game_plays * 100) if total_game_plays > 0 else 0
     
     # Average score
-    completed_sessions = await db.game_sessions.find({"completed": True}).to_list(1000)
+    completed_sessions = await find_with_archives(db, "game_sessions", {"completed": True}, session=db_session)
     avg_score = sum(s.get("score", 0) for s in completed_sessions) / len(completed_sessions) if completed_sessions else 0
     
     # Most violated rules (from game results)
-    violation_data = await db.game_sessions.find({
+    violation_data = await find_with_archives(db, "game_sessions", {
         "completed": True,
         "correct": False
-    }).to_list(1000)
+    }, session=db_session)
     
     rule_violations = {}
     for session in violation_data:
-        if session.get("violation_scenario"):
-            rule = session["violation_scenario"].get("policy_rule_violated", "Unknown")
+        if session.get("violation_scenario") or session.get("game_type") == "violation":
+            rule = policy_rule(session) or "Unknown"
             rule_violations[rule] = rule_violations.get(rule, 0) + 1
     
     most_violated_rules = sorted(
@@ -51,15 +72,15 @@ async def get_analytics_summary(admin: dict = Depends(get_current_admin)):
     )[:5]
     
     # Most confusing policy sections (across all policies)
-    all_policies = await db.policies.find({}).to_list(100)
+    all_policies = await db.policies.find({}, TITLE_PROJECTION, session=db_session).to_list(100)
     policy_confusion = {}
     
     for policy in all_policies:
         policy_id = str(policy["_id"])
-        policy_sessions = await db.game_sessions.find({
+        policy_sessions = await find_with_archives(db, "game_sessions", {
             "policy_id": policy_id,
             "completed": True
-        }).to_list(1000)
+        }, session=db_session)
         
         if policy_sessions:
             low_score_count = sum(1 for s in policy_sessions if s.get("score", 0) < 50)
@@ -86,15 +107,10 @@ async def get_analytics_summary(admin: dict = Depends(get_current_admin)):
     
     # Most confusing sections across all policies
     confusing_sections_all = []
-    all_sessions = await db.game_sessions.find({"completed": True}).to_list(1000)
+    all_sessions = await find_with_archives(db, "game_sessions", {"completed": True}, session=db_session)
     for session in all_sessions:
         if session.get("score", 0) < 50:
-            if session.get("scenario"):
-                rule = session["scenario"].get("policy_rule_used", "Unknown")
-            elif session.get("violation_scenario"):
-                rule = session["violation_scenario"].get("policy_rule_violated", "Unknown")
-            else:
-                rule = "Unknown"
+            rule = policy_rule(session) or "Unknown"
             confusing_sections_all.append(rule)
     
     from collections import Counter
@@ -124,9 +140,9 @@ async def get_policy_analytics(
     admin: dict = Depends(get_current_admin)
 ):
     """Get analytics for a specific policy"""
-    db = await get_database()
+    db = await get_database("analytics")
     
-    policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
+    policy = await find_policy(db, policy_id, TITLE_PROJECTION)
     if not policy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -134,9 +150,7 @@ async def get_policy_analytics(
         )
     
     # Game sessions for this policy
-    game_sessions = await db.game_sessions.find({
-        "policy_id": policy_id
-    }).to_list(1000)
+    game_sessions = await find_with_archives(db, "game_sessions", {"policy_id": policy_id})
     
     total_plays = len(game_sessions)
     completed_plays = sum(1 for g in game_sessions if g.get("completed"))
@@ -146,12 +160,7 @@ async def get_policy_analytics(
     confusing_sections = []
     for session in game_sessions:
         if session.get("completed") and session.get("score", 0) < 50:
-            if session.get("scenario"):
-                rule = session["scenario"].get("policy_rule_used", "Unknown")
-            elif session.get("violation_scenario"):
-                rule = session["violation_scenario"].get("policy_rule_violated", "Unknown")
-            else:
-                rule = "Unknown"
+            rule = policy_rule(session) or "Unknown"
             confusing_sections.append(rule)
     
     from collections import Counter
@@ -170,67 +179,167 @@ async def get_policy_analytics(
     }
 
 
-@router.get("/policies")
+@router.get("/policies", response_class=CompactJSONResponse)
 async def get_all_policies(admin: dict = Depends(get_current_admin)):
     """Get all policies"""
     db = await get_database()
     
-    policies = await db.policies.find({}).sort("uploaded_at", -1).to_list(100)
+    policies = await db.policies.find({}, LIST_PROJECTION).sort("uploaded_at", -1).to_list(100)
     
-    return [
+    return CompactJSONResponse([
         {
             "policyId": str(policy["_id"]),
             "title": policy.get("title", "Untitled"),
             "filename": policy.get("filename", "Unknown"),
             "uploaded_by": policy.get("uploaded_by_name", "Unknown"),
             "uploaded_at": policy.get("uploaded_at"),
-            "rules_count": len(policy.get("rules", [])),
-            "clauses_count": len(policy.get("clauses", []))
+            "rules_count": policy.get("rules_count", 0),
+            "clauses_count": policy.get("clauses_count", 0)
         }
         for policy in policies
-    ]
+    ])
 
 
-@router.delete("/policies/{policy_id}")
+@router.delete("/policies/{policy_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_policy(
     policy_id: str,
     admin: dict = Depends(get_current_admin)
 ):
-    """Delete a policy and all related game sessions"""
+    """
+    Delete a policy and start removing everything that depends on it
+    
+    The policy disappears immediately; its game sessions, escape rooms,
+    Policy Tap sets, attempts and stored original are removed by a background
+    job whose progress is available from GET /cleanup-jobs/{job_id}.
+    """
     db = await get_database()
     
     # Check if policy exists
-    policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
+    policy = await find_policy(db, policy_id, {"title": 1, "blob_key": 1, "file_path": 1})
     if not policy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Policy not found"
         )
     
-    # Delete all game sessions related to this policy
-    game_sessions_result = await db.game_sessions.delete_many({"policy_id": policy_id})
-    deleted_games_count = game_sessions_result.deleted_count
-    
     # Delete the policy
-    delete_result = await db.policies.delete_one({"_id": ObjectId(policy_id)})
+    deleted_count = await delete_policy_document(db, policy_id)
     
-    if delete_result.deleted_count == 0:
+    if deleted_count == 0:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete policy"
         )
     
+    job = await start_cleanup_job(db, policy)
     return {
-        "message": "Policy deleted successfully",
+        "message": "Policy deleted successfully, related data is being removed",
         "policy_id": policy_id,
-        "deleted_game_sessions": deleted_games_count
+        "job_id": job["job_id"],
+        "status": job["status"]
+    }
+
+
+@router.get("/cleanup-jobs/{job_id}")
+async def get_policy_cleanup_job(
+    job_id: str,
+    admin: dict = Depends(get_current_admin)
+):
+    """Status and per-collection progress of a policy cleanup job"""
+    db = await get_database()
+    job = await get_cleanup_job(db, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cleanup job not found"
+        )
+    return job
+
+
+@router.post("/maintenance/archive")
+async def run_session_archival(admin: dict = Depends(get_current_admin)):
+    """Archive old completed sessions and attempts now instead of waiting for the daily run"""
+    db = await get_database()
+    return {
+        "archive_after_days": get_settings().archive_after_days,
+        "collections": await run_archival(db)
     }
 
 
+@router.get("/db/pool")
+async def get_db_pool_metrics(admin: dict = Depends(get_current_admin)):
+    """MongoDB pool gauges, checkout wait times and command latencies of the worker serving this request"""
+    settings = get_settings()
+    return {
+        "worker_pid": os.getpid(),
+        "pool_settings": {
+            "max_pool_size": settings.mongo_max_pool_size,
+            "min_pool_size": settings.mongo_min_pool_size,
+            "max_idle_time_ms": settings.mongo_max_idle_time_ms,
+            "wait_queue_timeout_ms": settings.mongo_wait_queue_timeout_ms,
+            "max_connecting": settings.mongo_max_connecting
+        },
+        **db_metrics_snapshot()
+    }
+
+
+@router.get("/llm/telemetry")
+async def get_llm_telemetry(admin: dict = Depends(get_current_admin)):
+    """Tokens, estimated cost, latency and failures per LLM call site and level (recent window of this worker)"""
+    return telemetry_snapshot()
+
+
+@router.get("/loop")
+async def get_event_loop_health(admin: dict = Depends(get_current_admin)):
+    """Event loop lag percentiles, blocks per route and the latest blocking stacks of the worker serving this request"""
+    return loop_monitor_snapshot()
+
+
+@router.post("/profile")
+async def profile_live_worker(
+    seconds: float = Query(10, gt=0, description="How long to sample"),
+    interval_ms: Optional[float] = Query(None, ge=1, le=1000, description="Sampling interval"),
+    format: str = Query("collapsed", pattern="^(collapsed|tasks|json)$"),
+    admin: dict = Depends(get_current_admin)
+):
+    """
+    Sample the stacks of the worker serving this request for `seconds`
+
+    - collapsed: thread stacks as a folded file for flamegraph.pl/speedscope
+    - tasks: await chains of pending asyncio tasks, folded the same way
+    - json: both, plus event loop lag percentiles
+    """
+    settings = get_settings()
+    if seconds > settings.profile_max_seconds:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds must be at most {settings.profile_max_seconds:g}"
+        )
+    if profile_running():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A profile is already running on this worker"
+        )
+    
+    logger.info("Profiling worker %d for %gs (requested by %s)", os.getpid(), seconds, admin.get("email"))
+    profile = await profile_worker(seconds, (interval_ms or settings.profile_default_interval_ms) / 1000)
+    if format == "json":
+        return profile
+    
+    stacks = profile["stacks"] if format == "collapsed" else profile["task_stacks"]
+    filename = f"profile-{profile['worker_pid']}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{format}.folded"
+    return PlainTextResponse(collapsed(stacks), headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Worker-Pid": str(profile["worker_pid"]),
+        "X-Profile-Samples": str(profile["samples"]),
+        "X-Loop-Lag-P99-Ms": str(profile["loop_lag_ms"].get("p99", 0))
+    })
+
+
 @router.get("/users/scores")
 async def get_all_users_scores(admin: dict = Depends(get_current_admin)):
     """Get scores for all users"""
-    db = await get_database()
+    db = await get_database("analytics")
     
     # Get all users
     users = await db.users.find({"role": "user"}).to_list(1000)
@@ -241,7 +350,7 @@ async def get_all_users_scores(admin: dict = Depends(get_current_admin)):
         user_id = str(user["_id"])
         
         # Get all games for this user
-        all_games = await db.game_sessions.find({"user_id": user_id}).to_list(1000)
+        all_games = await find_with_archives(db, "game_sessions", {"user_id": user_id})
         completed_games = [g for g in all_games if g.get("completed", False)]
         
         # Calculate statistics
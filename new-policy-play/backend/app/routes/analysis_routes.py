@@ -3,18 +3,12 @@ from pydantic import BaseModel
 from typing import List, Dict
 from app.utils.db import get_database
 from app.utils.auth import get_current_admin
-from groq import Groq
-from dotenv import load_dotenv
+from app.services.llm_service import chat_json
+from app.services.llm_telemetry import record_parse_failure
+from app.services.prompt_builder import PromptBuilder, prompt_budget
 import json
-import os
 
-load_dotenv()
 router = APIRouter()
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY environment variable is required. Please set it in your .env file or environment.")
-groq_client = Groq(api_key=GROQ_API_KEY)
-MODEL_NAME = "llama-3.3-70b-versatile"
 
 
 class PolicyAnalysisRequest(BaseModel):
@@ -39,22 +33,26 @@ async def analyze_policy_draft(
     db = await get_database()
     
     # Get existing policies for comparison
-    existing_policies = await db.policies.find({}).to_list(50)
+    existing_policies = await db.policies.find({}, {"title": 1, "rules": 1}).to_list(50)
     existing_titles = [p.get("title", "") for p in existing_policies]
     existing_rules = []
     for policy in existing_policies:
         existing_rules.extend(policy.get("rules", []))
     
+    # Draft text first, existing titles fill the rest of the budget
+    context = (
+        PromptBuilder(prompt_budget("analyze"))
+        .add_text("Draft Policy Text", request.draft_text, priority=0)
+        .add_list("Existing Policy Titles (for overlap detection)", existing_titles, priority=1, max_items=10)
+        .build()
+    )
+    
     # Create analysis prompt
     prompt = f"""Analyze this draft policy document and identify issues.
 
 Draft Policy Title: {request.draft_title}
 
-Draft Policy Text:
-{request.draft_text}
-
-Existing Policy Titles (for overlap detection):
-{', '.join(existing_titles[:10])}
+{context}
 
 Analyze and return JSON with:
 1. contradictions: List of contradictory statements found
@@ -73,7 +71,7 @@ Return ONLY valid JSON in this format:
 }}"""
 
     try:
-        chat_completion = groq_client.chat.completions.create(
+        response_text = await chat_json(
             messages=[
                 {
                     "role": "system",
@@ -84,18 +82,16 @@ Return ONLY valid JSON in this format:
                     "content": prompt
                 }
             ],
-            model=MODEL_NAME,
+            call_site="analyze",
             temperature=0.3,
-            max_tokens=2048,
-            response_format={"type": "json_object"}
+            max_tokens=2048
         )
         
-        response_text = chat_completion.choices[0].message.content
-        
         # Parse JSON response
         try:
             analysis_data = json.loads(response_text)
         except json.JSONDecodeError as e:
+            record_parse_failure("analyze")
             import re
             json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
             if json_match:
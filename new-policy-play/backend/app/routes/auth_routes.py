@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import HTTPAuthorizationCredentials
@@ -14,6 +15,8 @@ from app.utils.auth import (
 from app.utils.db import get_database
 from bson import ObjectId
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -63,9 +66,7 @@ async def signup(user_data: UserCreate):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Signup error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Signup error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Signup failed: {str(e)}"
@@ -155,9 +156,7 @@ async def admin_login(credentials: AdminLogin):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Admin login error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Admin login error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Admin login failed: {str(e)}"
@@ -1,6 +1,7 @@
+import logging
 from datetime import datetime
-from typing import Optional
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import Any, Optional, Tuple
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Header
 from app.models.escape_model import (
     EscapeRoomResponse,
     EscapeAttemptResponse,
@@ -10,11 +11,21 @@ from app.models.escape_model import (
 )
 from app.utils.db import get_database
 from app.utils.auth import get_current_user
+from app.utils.attempt_store import escape_attempt_store
+from app.utils.policy_store import find_policy, STRUCTURE_PROJECTION
+from app.utils.retention import find_with_archives
 from app.services.escape_service import generate_escape_rooms
+from app.services.policy_index import ensure_policy_index
+from app.utils.structured_logging import SampledLogger
+from app.utils.request_metrics import CompactJSONResponse
+from app.utils.http_cache import make_etag, generation_stamp, state_digest, etag_matches, cache_headers, not_modified
 from bson import ObjectId
 import json
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+# Per-answer details: sampled debug records only
+answer_log = SampledLogger(__name__)
 
 
 @router.post("/escape/generate/{policy_id}")
@@ -22,23 +33,29 @@ async def generate_escape_room(
     policy_id: str,
     level: str = Query(..., pattern="^(beginner|intermediate|expert)$"),
     force: bool = Query(False, description="Force regeneration even if escape room exists"),
+    instant: bool = Query(False, description="Build puzzles locally without calling the LLM"),
     current_user: dict = Depends(get_current_user)
 ):
     """Generate escape room puzzles for a policy"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     # Get policy
-    policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
+    policy = await find_policy(db, policy_id, STRUCTURE_PROJECTION, large_fields=("lexical_index",))
     if not policy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Policy not found"
         )
+    await ensure_policy_index(db, policy)
     
     # Check if escape room already exists for this policy and level
+    # Instant (locally generated) rooms are cached separately from LLM-generated ones
+    generator = "local" if instant else "groq"
     existing = await db.escape_rooms.find_one({
         "policy_id": policy_id,
-        "level": level
+        "level": level,
+        "generator": "local" if instant else {"$ne": "local"},
+        "stale": {"$ne": True}
     })
     
     if existing and not force:
@@ -58,19 +75,21 @@ async def generate_escape_room(
                 created_at=existing.get("created_at", datetime.utcnow())
             )
         else:
-            print(f"Existing escape room found but Room 1 is empty, regenerating...")
+            logger.info("Existing escape room has an empty Room 1, regenerating",
+                        extra={"policy_id": policy_id, "level": level})
             # Delete the empty escape room
             await db.escape_rooms.delete_one({"_id": existing["_id"]})
     
     # Generate escape rooms
     try:
-        print(f"Starting escape room generation for policy {policy_id}, level {level}")
-        print(f"Policy data keys: {list(policy.keys())}")
-        print(f"Policy structuredData keys: {list(policy.get('structuredData', {}).keys())}")
-        rooms = await generate_escape_rooms(policy, level)
-        print(f"Successfully generated {len(rooms)} rooms")
-        print(f"Room1 has {len(rooms.get('room1', []))} puzzles")
-        print(f"Room1 data: {rooms.get('room1', [])[:1] if rooms.get('room1') else 'EMPTY'}")
+        logger.debug("Generating escape rooms", extra={"policy_id": policy_id, "level": level})
+        rooms = await generate_escape_rooms(policy, level, instant=instant)
+        logger.info("Generated escape rooms", extra={
+            "policy_id": policy_id,
+            "level": level,
+            "rooms": len(rooms),
+            "room1_puzzles": len(rooms.get("room1", []))
+        })
         
         # Ensure all rooms have data
         if not rooms or not any(rooms.values()):
@@ -81,9 +100,7 @@ async def generate_escape_room(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error generating escape rooms: {error_details}")
+        logger.exception("Error generating escape rooms", extra={"policy_id": policy_id, "level": level})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate escape rooms: {str(e)}"
@@ -94,6 +111,7 @@ async def generate_escape_room(
         "policy_id": policy_id,
         "level": level,
         "rooms": rooms,
+        "generator": generator,
         "created_at": datetime.utcnow()
     }
     
@@ -114,11 +132,9 @@ async def start_escape_attempt(
     current_user: dict = Depends(get_current_user)
 ):
     """Start a new escape room attempt"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     try:
-        print(f"Starting escape room attempt for escape_room_id: {request.escape_room_id}")
-        
         # Get escape room
         escape_room = await db.escape_rooms.find_one({"_id": ObjectId(request.escape_room_id)})
         if not escape_room:
@@ -127,8 +143,6 @@ async def start_escape_attempt(
                 detail="Escape room not found"
             )
         
-        print(f"Found escape room: {escape_room.get('level')} level for policy {escape_room.get('policy_id')}")
-        
         # Create attempt
         attempt_doc = {
             "user_id": str(current_user["_id"]),
@@ -149,11 +163,16 @@ async def start_escape_attempt(
             "completed_at": None
         }
         
-        result = await db.escape_attempts.insert_one(attempt_doc)
-        print(f"Created attempt: {result.inserted_id}")
+        attempt_id = await escape_attempt_store.create(db, attempt_doc)
+        logger.debug("Started escape room attempt", extra={
+            "attempt_id": attempt_id,
+            "escape_room_id": request.escape_room_id,
+            "policy_id": escape_room["policy_id"],
+            "level": escape_room["level"]
+        })
         
         return {
-            "attempt_id": str(result.inserted_id),
+            "attempt_id": attempt_id,
             "escape_room_id": request.escape_room_id,
             "policy_id": escape_room["policy_id"],
             "level": escape_room["level"],
@@ -162,9 +181,7 @@ async def start_escape_attempt(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in start_escape_attempt: {error_details}")
+        logger.exception("Error starting escape room attempt", extra={"escape_room_id": request.escape_room_id})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to start escape room: {str(e)}"
@@ -179,186 +196,91 @@ async def submit_room_answer(
 ):
     """Submit answer for a room"""
     try:
-        print(f"Submitting answer for attempt {attempt_id}, room {room_answer.room_number}")
-        print(f"Answer data: {room_answer.answer}")
-        
-        db = await get_database()
-        
-        # Get attempt
-        attempt = await db.escape_attempts.find_one({
-            "_id": ObjectId(attempt_id),
-            "user_id": str(current_user["_id"])
-        })
-        
-        if not attempt:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Attempt not found"
-            )
-        
-        if attempt.get("completed_at"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Attempt already completed"
-            )
-        
-        # Get escape room
-        escape_room = await db.escape_rooms.find_one({
-            "_id": ObjectId(attempt["escape_room_id"])
-        })
-        
-        if not escape_room:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Escape room not found"
-            )
-        
-        # Validate answer based on room number
-        room_key = f"room{room_answer.room_number}"
-        room_puzzles = escape_room["rooms"].get(room_key, [])
-        
-        print(f"Room key: {room_key}, Puzzles found: {len(room_puzzles) if isinstance(room_puzzles, list) else 'dict'}")
-        
-        if not room_puzzles:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Room {room_answer.room_number} not found or empty"
-            )
-        
-        # Check answer (simplified - you may want more sophisticated checking)
-        is_correct = False
-        points_earned = 0
-        
-        # Room-specific answer checking
-        if room_answer.room_number == 1:
-            # Definition matching
-            puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
-            user_answer = room_answer.answer.get("selected_definition", "")
-            correct_def = puzzle.get("definition", "")
-            is_correct = user_answer == correct_def
-            print(f"Room 1: User answer='{user_answer}', Correct='{correct_def}', Match={is_correct}")
-        
-        elif room_answer.room_number == 2:
-            # Exception identification
-            puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
-            user_answer = room_answer.answer.get("selected_exception", "")
-            correct_exc = puzzle.get("correct_exception", "")
-            is_correct = user_answer == correct_exc
-            print(f"Room 2: User answer='{user_answer}', Correct='{correct_exc}', Match={is_correct}")
+        db = await get_database("gameplay")
         
-        elif room_answer.room_number == 3:
-            # Rule selection
-            puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
-            user_answer = room_answer.answer.get("selected_rule", "")
-            correct_rule = puzzle.get("correct_rule", "")
-            is_correct = user_answer == correct_rule
-            print(f"Room 3: User answer='{user_answer}', Correct='{correct_rule}', Match={is_correct}")
-        
-        elif room_answer.room_number == 4:
-            # Violation fix
-            puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
-            user_fix = room_answer.answer.get("fix", "").strip().lower()
-            correct_fix = puzzle.get("fix", "").strip().lower()
-            # Simple similarity check (you may want more sophisticated matching)
-            is_correct = user_fix == correct_fix or user_fix in correct_fix or correct_fix in user_fix
-            print(f"Room 4: User fix='{user_fix}', Correct='{correct_fix}', Match={is_correct}")
-        
-        elif room_answer.room_number == 5:
-            # Master puzzle - check all parts
-            puzzle = room_puzzles if isinstance(room_puzzles, dict) else {}
-            def_answer = room_answer.answer.get("definition_answer", "")
-            def_correct = def_answer == puzzle.get("definition_question", {}).get("definition", "")
-            
-            rule_answer = room_answer.answer.get("rule_answer", "")
-            rule_correct = rule_answer == puzzle.get("rule_question", {}).get("correct_rule", "")
-            
-            exc_answer = room_answer.answer.get("exception_answer", "")
-            exc_correct = exc_answer == puzzle.get("exception_question", {}).get("correct_exception", "")
-            
-            viol_fix = room_answer.answer.get("violation_fix", "").strip().lower()
-            viol_correct = viol_fix == puzzle.get("violation_question", {}).get("fix", "").strip().lower()
-            
-            is_correct = def_correct and rule_correct and exc_correct and viol_correct
-            print(f"Room 5: Def={def_correct}, Rule={rule_correct}, Exc={exc_correct}, Viol={viol_correct}, Overall={is_correct}")
-        
-        # Calculate score
-        if is_correct:
-            points_earned = 10
-            # Fast answer bonus (if time is provided)
-            time_taken = room_answer.answer.get("time_taken", 0)
-            if time_taken > 0 and time_taken < 60:  # Less than 60 seconds
-                points_earned += 5
-        else:
-            points_earned = -5
-        
-        # Update attempt
-        new_score = attempt.get("score", 0) + points_earned
-        room_status = attempt.get("room_status", {})
-        room_status[f"room{room_answer.room_number}"] = "done" if is_correct else "failed"
-        
-        rooms_completed = attempt.get("rooms_completed", [])
-        if is_correct and f"room{room_answer.room_number}" not in rooms_completed:
-            rooms_completed.append(f"room{room_answer.room_number}")
-        
-        await db.escape_attempts.update_one(
-            {"_id": ObjectId(attempt_id)},
-            {
-                "$set": {
-                    "score": new_score,
-                    "room_status": room_status,
-                    "rooms_completed": rooms_completed
-                }
-            }
-        )
-        
-        # Get explanation based on room type
-        explanation = ""
-        if room_answer.room_number == 5:
-            explanation = puzzle.get("violation_question", {}).get("explanation", "")
-        elif isinstance(room_puzzles, list) and len(room_puzzles) > 0:
-            explanation = room_puzzles[0].get("explanation", "")
-        
-        return {
-            "correct": is_correct,
-            "points_earned": points_earned,
-            "new_score": new_score,
-            "explanation": explanation
-        }
+        async with escape_attempt_store.lock(attempt_id):
+            return await _submit_room_answer(db, attempt_id, room_answer, current_user)
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in submit_room_answer: {error_details}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to submit answer: {str(e)}"
-        )
-    except HTTPException:
-        raise
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in submit_room_answer: {error_details}")
+        logger.exception("Escape room answer submission failed",
+                         extra={"attempt_id": attempt_id, "room": room_answer.room_number})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to submit answer: {str(e)}"
         )
 
 
-@router.post("/escape/finish/{attempt_id}")
-async def finish_escape_attempt(
-    attempt_id: str,
-    time_taken: int,
-    current_user: dict = Depends(get_current_user)
-):
-    """Finish an escape room attempt"""
-    db = await get_database()
+def check_room_answer(room_number: int, room_puzzles, answer: dict) -> Tuple[bool, Any, dict]:
+    """
+    Check an answer against a room's puzzles (simplified - you may want more sophisticated checking)
     
-    attempt = await db.escape_attempts.find_one({
-        "_id": ObjectId(attempt_id),
-        "user_id": str(current_user["_id"])
-    })
+    Returns:
+        Whether the answer is correct, the expected answer (per-part results
+        for room 5) and the puzzle that was checked
+    """
+    is_correct = False
+    expected = None
+    puzzle = {}
+    
+    if room_number == 1:
+        # Definition matching
+        puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
+        user_answer = answer.get("selected_definition", "")
+        correct_def = puzzle.get("definition", "")
+        is_correct = user_answer == correct_def
+        expected = correct_def
+    
+    elif room_number == 2:
+        # Exception identification
+        puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
+        user_answer = answer.get("selected_exception", "")
+        correct_exc = puzzle.get("correct_exception", "")
+        is_correct = user_answer == correct_exc
+        expected = correct_exc
+    
+    elif room_number == 3:
+        # Rule selection
+        puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
+        user_answer = answer.get("selected_rule", "")
+        correct_rule = puzzle.get("correct_rule", "")
+        is_correct = user_answer == correct_rule
+        expected = correct_rule
+    
+    elif room_number == 4:
+        # Violation fix
+        puzzle = room_puzzles[0] if isinstance(room_puzzles, list) and len(room_puzzles) > 0 else {}
+        user_fix = answer.get("fix", "").strip().lower()
+        correct_fix = puzzle.get("fix", "").strip().lower()
+        # Simple similarity check (you may want more sophisticated matching)
+        is_correct = user_fix == correct_fix or user_fix in correct_fix or correct_fix in user_fix
+        expected = correct_fix
+    
+    elif room_number == 5:
+        # Master puzzle - check all parts
+        puzzle = room_puzzles if isinstance(room_puzzles, dict) else {}
+        def_answer = answer.get("definition_answer", "")
+        def_correct = def_answer == puzzle.get("definition_question", {}).get("definition", "")
+        
+        rule_answer = answer.get("rule_answer", "")
+        rule_correct = rule_answer == puzzle.get("rule_question", {}).get("correct_rule", "")
+        
+        exc_answer = answer.get("exception_answer", "")
+        exc_correct = exc_answer == puzzle.get("exception_question", {}).get("correct_exception", "")
+        
+        viol_fix = answer.get("violation_fix", "").strip().lower()
+        viol_correct = viol_fix == puzzle.get("violation_question", {}).get("fix", "").strip().lower()
+        
+        is_correct = def_correct and rule_correct and exc_correct and viol_correct
+        expected = {"definition": def_correct, "rule": rule_correct, "exception": exc_correct, "violation": viol_correct}
+    
+    return is_correct, expected, puzzle
+
+
+async def _submit_room_answer(db, attempt_id: str, room_answer: RoomAnswer, current_user: dict):
+    """Check a room answer and update the live attempt (caller holds the attempt lock)"""
+    # Get attempt from the in-progress store
+    attempt = await escape_attempt_store.load(db, attempt_id, str(current_user["_id"]))
     
     if not attempt:
         raise HTTPException(
@@ -366,22 +288,114 @@ async def finish_escape_attempt(
             detail="Attempt not found"
         )
     
-    # Calculate final score with time bonus
-    base_score = attempt.get("score", 0)
-    time_bonus = max(0, 100 - (time_taken // 10))  # Bonus decreases with time
-    final_score = base_score + time_bonus
+    if attempt.get("completed_at"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Attempt already completed"
+        )
+    
+    # Get escape room
+    escape_room = await db.escape_rooms.find_one({
+        "_id": ObjectId(attempt["escape_room_id"])
+    })
+    
+    if not escape_room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Escape room not found"
+        )
+    
+    # Validate answer based on room number
+    room_key = f"room{room_answer.room_number}"
+    room_puzzles = escape_room["rooms"].get(room_key, [])
+    
+    if not room_puzzles:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Room {room_answer.room_number} not found or empty"
+        )
+    
+    # Check answer
+    points_earned = 0
+    is_correct, expected, puzzle = check_room_answer(room_answer.room_number, room_puzzles, room_answer.answer)
+    
+    answer_log.debug("Escape room answer checked", lambda: {
+        "attempt_id": attempt_id,
+        "room": room_answer.room_number,
+        "answer": room_answer.answer,
+        "expected": expected,
+        "correct": is_correct
+    })
+    
+    # Calculate score
+    if is_correct:
+        points_earned = 10
+        # Fast answer bonus (if time is provided)
+        time_taken = room_answer.answer.get("time_taken", 0)
+        if time_taken > 0 and time_taken < 60:  # Less than 60 seconds
+            points_earned += 5
+    else:
+        points_earned = -5
     
     # Update attempt
-    await db.escape_attempts.update_one(
-        {"_id": ObjectId(attempt_id)},
-        {
-            "$set": {
-                "score": final_score,
-                "time_taken": time_taken,
-                "completed_at": datetime.utcnow()
-            }
-        }
-    )
+    new_score = attempt.get("score", 0) + points_earned
+    room_status = attempt.get("room_status", {})
+    room_status[f"room{room_answer.room_number}"] = "done" if is_correct else "failed"
+    
+    rooms_completed = attempt.get("rooms_completed", [])
+    if is_correct and f"room{room_answer.room_number}" not in rooms_completed:
+        rooms_completed.append(f"room{room_answer.room_number}")
+    
+    await escape_attempt_store.update(db, attempt_id, {
+        "score": new_score,
+        "room_status": room_status,
+        "rooms_completed": rooms_completed
+    })
+    
+    # Get explanation based on room type
+    explanation = ""
+    if room_answer.room_number == 5:
+        explanation = puzzle.get("violation_question", {}).get("explanation", "")
+    elif isinstance(room_puzzles, list) and len(room_puzzles) > 0:
+        explanation = room_puzzles[0].get("explanation", "")
+    
+    return {
+        "correct": is_correct,
+        "points_earned": points_earned,
+        "new_score": new_score,
+        "explanation": explanation
+    }
+
+
+@router.post("/escape/finish/{attempt_id}")
+async def finish_escape_attempt(
+    attempt_id: str,
+    time_taken: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """Finish an escape room attempt"""
+    db = await get_database("gameplay")
+    
+    async with escape_attempt_store.lock(attempt_id):
+        attempt = await escape_attempt_store.load(db, attempt_id, str(current_user["_id"]))
+        
+        if not attempt:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Attempt not found"
+            )
+        
+        # Calculate final score with time bonus
+        base_score = attempt.get("score", 0)
+        time_bonus = max(0, 100 - (time_taken // 10))  # Bonus decreases with time
+        final_score = base_score + time_bonus
+        
+        # Persist the final attempt state (flushes any pending answers too)
+        await escape_attempt_store.finish(db, attempt_id, {
+            "score": final_score,
+            "time_taken": time_taken,
+            "completed_at": datetime.utcnow()
+        })
     
     return {
         "attempt_id": attempt_id,
@@ -397,17 +411,17 @@ async def get_escape_leaderboard(
     current_user: dict = Depends(get_current_user)
 ):
     """Get escape room leaderboard"""
-    db = await get_database()
+    db = await get_database("analytics")
     
     query = {}
     if level:
         query["level"] = level
     
     # Get completed attempts
-    attempts = await db.escape_attempts.find({
+    attempts = await find_with_archives(db, "escape_attempts", {
         **query,
         "completed_at": {"$ne": None}
-    }).sort("score", -1).limit(100).to_list(100)
+    }, sort=[("score", -1)], limit=100)
     
     leaderboard = []
     for attempt in attempts:
@@ -430,18 +444,22 @@ async def get_escape_leaderboard(
     }
 
 
-@router.get("/escape/rooms/{attempt_id}")
+@router.get("/escape/rooms/{attempt_id}", response_class=CompactJSONResponse)
 async def get_escape_rooms_by_attempt(
     attempt_id: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get escape rooms data for an attempt"""
-    db = await get_database()
+    """
+    Get escape rooms data for an attempt
     
-    attempt = await db.escape_attempts.find_one({
-        "_id": ObjectId(attempt_id),
-        "user_id": str(current_user["_id"])
-    })
+    The rooms never change; the score and room status do, so they are part of
+    the version. Both come from the live attempt, so a matching If-None-Match is
+    answered without reading the escape room.
+    """
+    db = await get_database("gameplay")
+    
+    attempt = await escape_attempt_store.load(db, attempt_id, str(current_user["_id"]))
     
     if not attempt:
         raise HTTPException(
@@ -449,6 +467,13 @@ async def get_escape_rooms_by_attempt(
             detail="Attempt not found"
         )
     
+    etag = make_etag("escape-attempt", attempt_id, "-".join([
+        str(attempt["escape_room_id"]),
+        state_digest(attempt.get("score", 0), attempt.get("room_status", {}))
+    ]))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
     escape_room = await db.escape_rooms.find_one({
         "_id": ObjectId(attempt["escape_room_id"])
     })
@@ -460,30 +485,39 @@ async def get_escape_rooms_by_attempt(
         )
     
     rooms_data = escape_room.get("rooms", {})
-    print(f"Returning rooms data for attempt {attempt_id}:")
-    print(f"  Room1 type: {type(rooms_data.get('room1'))}, length: {len(rooms_data.get('room1', [])) if isinstance(rooms_data.get('room1'), list) else 'N/A'}")
-    print(f"  Room1 data: {rooms_data.get('room1')}")
+    answer_log.debug("Returning escape rooms", lambda: {
+        "attempt_id": attempt_id,
+        "puzzles": {key: len(room) if isinstance(room, list) else 1 for key, room in rooms_data.items()}
+    })
     
-    return {
+    return CompactJSONResponse({
         "rooms": rooms_data,
         "score": attempt.get("score", 0),
         "room_status": attempt.get("room_status", {})
-    }
+    }, headers=cache_headers(etag))
 
 
-@router.get("/escape/rooms/{policy_id}/{level}")
+@router.get("/escape/rooms/{policy_id}/{level}", response_class=CompactJSONResponse)
 async def get_escape_rooms(
     policy_id: str,
     level: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get escape rooms for a policy and level"""
-    db = await get_database()
+    """
+    Get escape rooms for a policy and level
+    
+    An escape room is never updated, but regeneration can put a different one
+    behind this URL, so clients revalidate on every view.
+    """
+    db = await get_database("gameplay")
     
+    # Check the version before loading the rooms
     escape_room = await db.escape_rooms.find_one({
         "policy_id": policy_id,
-        "level": level
-    })
+        "level": level,
+        "stale": {"$ne": True}
+    }, {"created_at": 1})
     
     if not escape_room:
         raise HTTPException(
@@ -491,10 +525,21 @@ async def get_escape_rooms(
             detail="Escape room not found. Generate it first."
         )
     
-    return {
+    etag = make_etag("escape-room", escape_room["_id"], generation_stamp(escape_room.get("created_at")))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    rooms = await db.escape_rooms.find_one({"_id": escape_room["_id"]}, {"rooms": 1})
+    if not rooms:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Escape room not found. Generate it first."
+        )
+    
+    return CompactJSONResponse({
         "escape_room_id": str(escape_room["_id"]),
         "policy_id": policy_id,
         "level": level,
-        "rooms": escape_room["rooms"]
-    }
+        "rooms": rooms["rooms"]
+    }, headers=cache_headers(etag))
 
@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, HTTPException, status, Depends, Query
@@ -14,6 +15,8 @@ from app.utils.db import get_database
 from app.utils.auth import get_current_user
 from app.services.falling_balls_generator import generate_falling_ball_questions
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -82,9 +85,7 @@ async def generate_policy_tap_game(
             "created_at": game_set_doc["created_at"]
         }
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error generating falling ball game: {error_details}")
+        logger.exception("Error generating falling ball game")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate game: {str(e)}"
@@ -202,8 +203,8 @@ async def submit_policy_tap_answer(
     correct_answer = question.get("correct", "")
     is_correct = answer.selected_option == correct_answer
     
-    # Debug logging
-    print(f"Question {answer.question_index}: Selected='{answer.selected_option}', Correct='{correct_answer}', is_correct={is_correct}, was_missed={answer.was_missed}")
+    logger.debug("Question %d: selected=%r, correct=%r, is_correct=%s, was_missed=%s",
+                 answer.question_index, answer.selected_option, correct_answer, is_correct, answer.was_missed)
     
     # Calculate points - check was_missed first, then correctness
     points = 0
@@ -217,13 +218,11 @@ async def submit_policy_tap_answer(
         # Speed bonus (answered quickly)
         if answer.time_taken < 2.0:
             points += 2
-        print(f"✅ Correct answer! Points: {points}")
     else:
         # Wrong answer was selected
         points = -5
-        print(f"❌ Wrong answer. Points: {points}")
     
-    print(f"Points calculated: {points}, Current score: {attempt.get('score', 0)}, New score: {attempt.get('score', 0) + points}")
+    logger.debug("Points calculated: %d, current score: %d", points, attempt.get("score", 0))
     
     # Check if this question has already been answered
     existing_answers = attempt.get("answers", [])
@@ -234,7 +233,7 @@ async def submit_policy_tap_answer(
     
     if already_answered:
         # Return existing answer data without updating
-        print(f"⚠️ Question {answer.question_index} already answered, skipping duplicate submission")
+        logger.debug("Question %d already answered, skipping duplicate submission", answer.question_index)
         existing_answer = next(
             (ans for ans in existing_answers if ans.get("question_index") == answer.question_index),
             None
@@ -336,7 +335,8 @@ async def finish_policy_tap_game(
     wrong_answers = updated_attempt.get("wrong_answers", 0)
     missed_answers = updated_attempt.get("missed_answers", 0)
     
-    print(f"Finish game - Final scores: score={final_score}, correct={correct_answers}, wrong={wrong_answers}, missed={missed_answers}")
+    logger.debug("Finish game: score=%s, correct=%d, wrong=%d, missed=%d",
+                 final_score, correct_answers, wrong_answers, missed_answers)
     
     return {
         "attempt_id": str(request.attempt_id),
@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Depends, Query
 from app.models.game_model import (
@@ -9,23 +10,33 @@ from app.models.game_model import (
     SpotViolationScenario
 )
 from app.utils.db import get_database
+from app.utils.retention import abandon_deadline, find_with_archives
 from app.utils.auth import get_current_user
-from groq import Groq
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY environment variable is required. Please set it in your .env file or environment.")
-groq_client = Groq(api_key=GROQ_API_KEY)
-MODEL_NAME = "llama-3.3-70b-versatile"
+from app.utils.policy_store import find_policy, STRUCTURE_PROJECTION, TITLE_PROJECTION
+from app.services.llm_service import chat_json, LLMUnavailableError
+from app.services.llm_telemetry import record_parse_failure, record_fallback
+from app.services.prompt_builder import PromptBuilder, prompt_budget
+from app.services.policy_index import ensure_policy_index, rank_items, spread_order
 from bson import ObjectId
 import json
+import random
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def build_game_context(policy_data: dict, rule_to_use: str, call_site: str) -> str:
+    """Policy summary plus the rules and clauses most relevant to the focus rule, within the token budget"""
+    return (
+        PromptBuilder(prompt_budget(call_site))
+        .add_text("Policy Summary", policy_data.get("summary"), priority=0)
+        .add_list("Other related rules", rank_items(policy_data, "rules", rule_to_use, exclude=[rule_to_use]), priority=1, max_items=3)
+        .add_list("Related clauses", rank_items(policy_data, "clauses", rule_to_use), priority=2, max_items=2)
+        .build()
+    )
+
+
 async def generate_scenario_game(policy_data: dict, rule_index: int = 0) -> GameScenario:
     """Generate scenario simulation game using Groq AI"""
     rules = policy_data.get("rules", [])
@@ -40,21 +51,7 @@ async def generate_scenario_game(policy_data: dict, rule_index: int = 0) -> Game
     
     # Get policy context for better understanding
     policy_title = policy_data.get("title", "Policy")
-    policy_summary = policy_data.get("summary", "")
-    all_rules = policy_data.get("rules", [])
-    clauses = policy_data.get("clauses", [])
-    definitions = policy_data.get("definitions", [])
-    
-    # Build context string
-    context_parts = []
-    if policy_summary:
-        context_parts.append(f"Policy Summary: {policy_summary}")
-    if len(all_rules) > 1:
-        context_parts.append(f"Other related rules: {', '.join(all_rules[:3])}")
-    if clauses:
-        context_parts.append(f"Related clauses: {', '.join(clauses[:2])}")
-    
-    context = "\n".join(context_parts) if context_parts else ""
+    context = build_game_context(policy_data, rule_to_use, "scenario")
     
     prompt = f"""You are creating an educational compliance game scenario. Your task is to create a realistic workplace scenario where ONE action correctly follows the policy rule, and THREE actions violate or ignore the rule.
 
@@ -93,7 +90,7 @@ Return JSON format:
 IMPORTANT: Ensure the correct answer strictly adheres to the policy rule. The correct option must be the action that complies with "{rule_to_use}"."""
 
     try:
-        chat_completion = groq_client.chat.completions.create(
+        response_text = await chat_json(
             messages=[
                 {
                     "role": "system",
@@ -108,13 +105,10 @@ Always return valid JSON only."""
                     "content": prompt
                 }
             ],
-            model=MODEL_NAME,
+            call_site="scenario",
             temperature=0.5,  # Lower temperature for more consistent, rule-following answers
-            max_tokens=1500,  # Increased for better explanations
-            response_format={"type": "json_object"}
+            max_tokens=1500  # Increased for better explanations
         )
-        
-        response_text = chat_completion.choices[0].message.content
         scenario_data = json.loads(response_text)
         
         # Validate that correct_answer index is valid
@@ -134,7 +128,11 @@ Always return valid JSON only."""
             raise ValueError("Explanation must be detailed and reference the policy rule")
         
         return GameScenario(**scenario_data)
+    except LLMUnavailableError:
+        raise
     except Exception as e:
+        if isinstance(e, json.JSONDecodeError):
+            record_parse_failure("scenario")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate scenario: {str(e)}"
@@ -155,20 +153,7 @@ async def generate_violation_game(policy_data: dict, rule_index: int = 0) -> Spo
     
     # Get policy context for better understanding
     policy_title = policy_data.get("title", "Policy")
-    policy_summary = policy_data.get("summary", "")
-    all_rules = policy_data.get("rules", [])
-    clauses = policy_data.get("clauses", [])
-    
-    # Build context string
-    context_parts = []
-    if policy_summary:
-        context_parts.append(f"Policy Summary: {policy_summary}")
-    if len(all_rules) > 1:
-        context_parts.append(f"Other related rules: {', '.join(all_rules[:3])}")
-    if clauses:
-        context_parts.append(f"Related clauses: {', '.join(clauses[:2])}")
-    
-    context = "\n".join(context_parts) if context_parts else ""
+    context = build_game_context(policy_data, rule_to_use, "violation")
     
     prompt = f"""You are creating an educational compliance game. Your task is to create a realistic workplace scenario that contains EXACTLY ONE clear violation of the policy rule.
 
@@ -210,7 +195,7 @@ IMPORTANT:
 - The violation must clearly contradict "{rule_to_use}" """
 
     try:
-        chat_completion = groq_client.chat.completions.create(
+        response_text = await chat_json(
             messages=[
                 {
                     "role": "system",
@@ -225,13 +210,10 @@ Always return valid JSON only."""
                     "content": prompt
                 }
             ],
-            model=MODEL_NAME,
+            call_site="violation",
             temperature=0.5,  # Lower temperature for more consistent, accurate violations
-            max_tokens=1500,  # Increased for better explanations
-            response_format={"type": "json_object"}
+            max_tokens=1500  # Increased for better explanations
         )
-        
-        response_text = chat_completion.choices[0].message.content
         violation_data = json.loads(response_text)
         
         # Validate violation positions
@@ -266,13 +248,41 @@ Always return valid JSON only."""
             raise ValueError("Explanation must be detailed and explain why this violates the policy rule")
         
         return SpotViolationScenario(**violation_data)
+    except LLMUnavailableError:
+        raise
     except Exception as e:
+        if isinstance(e, json.JSONDecodeError):
+            record_parse_failure("violation")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate violation scenario: {str(e)}"
         )
 
 
+async def generate_or_reuse_game(db, policy: dict, game_type: str, rule_index: int = 0):
+    """Generate a game, reusing a stored game for the same policy while the LLM circuit is open"""
+    try:
+        if game_type == "scenario":
+            return await generate_scenario_game(policy, rule_index=rule_index)
+        return await generate_violation_game(policy, rule_index=rule_index)
+    except LLMUnavailableError:
+        field = "scenario" if game_type == "scenario" else "violation_scenario"
+        cached = await db.game_sessions.aggregate([
+            {"$match": {"policy_id": str(policy["_id"]), "game_type": game_type, field: {"$ne": None}, "stale": {"$ne": True}}},
+            {"$sample": {"size": 1}}
+        ]).to_list(1)
+        if not cached:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Game generation is temporarily unavailable, please try again shortly"
+            )
+        logger.info("LLM unavailable, reusing stored %s game %s", game_type, cached[0]["_id"])
+        record_fallback(game_type, reason="stored_game")
+        if game_type == "scenario":
+            return GameScenario(**cached[0][field])
+        return SpotViolationScenario(**cached[0][field])
+
+
 @router.post("/game/generate/{policy_id}", response_model=GameSessionResponse)
 async def generate_game(
     policy_id: str,
@@ -280,22 +290,26 @@ async def generate_game(
     current_user: dict = Depends(get_current_user)
 ):
     """Generate a game session for a policy"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     # Get policy
-    policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
+    policy = await find_policy(db, policy_id, STRUCTURE_PROJECTION, large_fields=("lexical_index",))
     if not policy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Policy not found"
         )
+    await ensure_policy_index(db, policy)
+    
+    # Focus on a random rule so single games cover the whole policy, not just its first rule
+    rule_index = random.randrange(max(1, len(policy.get("rules", []))))
     
     # Generate game based on type
     if game_type == "scenario":
-        scenario = await generate_scenario_game(policy, rule_index=0)
+        scenario = await generate_or_reuse_game(db, policy, "scenario", rule_index=rule_index)
         game_data = {"scenario": scenario.dict()}
     elif game_type == "violation":
-        violation_scenario = await generate_violation_game(policy, rule_index=0)
+        violation_scenario = await generate_or_reuse_game(db, policy, "violation", rule_index=rule_index)
         game_data = {"violation_scenario": violation_scenario.dict()}
     else:
         raise HTTPException(
@@ -310,7 +324,8 @@ async def generate_game(
         "game_type": game_type,
         **game_data,
         "created_at": datetime.utcnow(),
-        "completed": False
+        "completed": False,
+        "expire_at": abandon_deadline()
     }
     
     result = await db.game_sessions.insert_one(session_doc)
@@ -332,7 +347,7 @@ async def get_game_session(
     current_user: dict = Depends(get_current_user)
 ):
     """Get game session details"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     session = await db.game_sessions.find_one({
         "_id": ObjectId(session_id),
@@ -361,7 +376,7 @@ async def submit_game_answer(
     current_user: dict = Depends(get_current_user)
 ):
     """Submit game answer and get result"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     session = await db.game_sessions.find_one({
         "_id": ObjectId(answer.session_id),
@@ -422,20 +437,21 @@ async def submit_game_answer(
                     "correct": correct,
                     "score": score,
                     "answered_at": datetime.utcnow()
-                }
+                },
+                # Answered sessions are kept (and archived later) instead of expiring
+                "$unset": {"expire_at": ""}
             }
         )
     except Exception as write_error:
         # If write fails due to no primary, log the error but still return the result
         # The game logic has already been processed correctly
         error_msg = str(write_error)
-        print(f"⚠️ Warning: Failed to update session in database: {error_msg}")
+        logger.warning("Failed to update session in database: %s", error_msg)
         
         # Check if it's a primary server issue
         if "No primary available" in error_msg or "primary" in error_msg.lower():
-            print("⚠️ MongoDB cluster has no primary server available. Please check MongoDB Atlas dashboard.")
-            print("⚠️ Game result calculated successfully, but database update failed.")
-            print("⚠️ The game will still work for reading, but scores may not be saved until primary is restored.")
+            logger.warning("MongoDB cluster has no primary server available; the game result was "
+                           "calculated but its score may not be saved until the primary is restored")
         
         # Continue and return the result anyway - the game logic is correct
     
@@ -456,15 +472,16 @@ async def generate_batch_games(
     current_user: dict = Depends(get_current_user)
 ):
     """Generate multiple games (at least 5) for a policy"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     # Get policy
-    policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
+    policy = await find_policy(db, policy_id, STRUCTURE_PROJECTION, large_fields=("lexical_index",))
     if not policy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Policy not found"
         )
+    await ensure_policy_index(db, policy)
     
     rules = policy.get("rules", [])
     if not rules:
@@ -481,11 +498,14 @@ async def generate_batch_games(
     
     generated_sessions = []
     
+    # Spread the batch evenly across the policy's rules, starting at a random point
+    rule_order = spread_order(len(rules), offset=random.randrange(len(rules)))
+    
     # Generate scenario games
     for i in range(scenario_count):
         try:
-            rule_idx = i % len(rules)  # Cycle through rules
-            scenario = await generate_scenario_game(policy, rule_index=rule_idx)
+            rule_idx = rule_order[i % len(rules)]  # Cycle through rules
+            scenario = await generate_or_reuse_game(db, policy, "scenario", rule_index=rule_idx)
             
             session_doc = {
                 "policy_id": policy_id,
@@ -493,7 +513,8 @@ async def generate_batch_games(
                 "game_type": "scenario",
                 "scenario": scenario.dict(),
                 "created_at": datetime.utcnow(),
-                "completed": False
+                "completed": False,
+                "expire_at": abandon_deadline()
             }
             
             result = await db.game_sessions.insert_one(session_doc)
@@ -506,13 +527,13 @@ async def generate_batch_games(
             })
         except Exception as e:
             # Continue with other games even if one fails
-            print(f"Failed to generate scenario game {i+1}: {str(e)}")
+            logger.warning("Failed to generate scenario game %d: %s", i + 1, e)
     
     # Generate violation games
     for i in range(violation_count):
         try:
-            rule_idx = (scenario_count + i) % len(rules)  # Cycle through rules
-            violation_scenario = await generate_violation_game(policy, rule_index=rule_idx)
+            rule_idx = rule_order[(scenario_count + i) % len(rules)]  # Cycle through rules
+            violation_scenario = await generate_or_reuse_game(db, policy, "violation", rule_index=rule_idx)
             
             session_doc = {
                 "policy_id": policy_id,
@@ -520,7 +541,8 @@ async def generate_batch_games(
                 "game_type": "violation",
                 "violation_scenario": violation_scenario.dict(),
                 "created_at": datetime.utcnow(),
-                "completed": False
+                "completed": False,
+                "expire_at": abandon_deadline()
             }
             
             result = await db.game_sessions.insert_one(session_doc)
@@ -533,7 +555,7 @@ async def generate_batch_games(
             })
         except Exception as e:
             # Continue with other games even if one fails
-            print(f"Failed to generate violation game {i+1}: {str(e)}")
+            logger.warning("Failed to generate violation game %d: %s", i + 1, e)
     
     if not generated_sessions:
         raise HTTPException(
@@ -554,7 +576,7 @@ async def get_policy_games(
     current_user: dict = Depends(get_current_user)
 ):
     """Get all games for a specific policy"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     games = await db.game_sessions.find({
         "policy_id": policy_id,
@@ -584,7 +606,7 @@ async def get_policy_games(
 @router.get("/games")
 async def get_user_games(current_user: dict = Depends(get_current_user)):
     """Get all games for current user"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     games = await db.game_sessions.find(
         {"user_id": str(current_user["_id"])}
@@ -606,11 +628,11 @@ async def get_user_games(current_user: dict = Depends(get_current_user)):
 @router.get("/user/scores")
 async def get_user_scores(current_user: dict = Depends(get_current_user)):
     """Get current user's score statistics"""
-    db = await get_database()
+    db = await get_database("gameplay")
     user_id = str(current_user["_id"])
     
     # Get all games for this user
-    all_games = await db.game_sessions.find({"user_id": user_id}).to_list(1000)
+    all_games = await find_with_archives(db, "game_sessions", {"user_id": user_id})
     completed_games = [g for g in all_games if g.get("completed", False)]
     
     # Calculate statistics
@@ -625,10 +647,8 @@ async def get_user_scores(current_user: dict = Depends(get_current_user)):
     # Get policy names for completed games
     policy_ids = list(set(g.get("policy_id") for g in completed_games if g.get("policy_id")))
     policies = {}
-    for policy_id in policy_ids:
-        policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
-        if policy:
-            policies[policy_id] = policy.get("title", "Untitled")
+    async for policy in db.policies.find({"_id": {"$in": [ObjectId(policy_id) for policy_id in policy_ids]}}, TITLE_PROJECTION):
+        policies[str(policy["_id"])] = policy.get("title", "Untitled")
     
     # Recent games with scores
     recent_games = [
@@ -664,7 +684,7 @@ async def get_user_scores(current_user: dict = Depends(get_current_user)):
 @router.get("/leaderboard")
 async def get_leaderboard(current_user: dict = Depends(get_current_user)):
     """Get public leaderboard - all users ranked by performance"""
-    db = await get_database()
+    db = await get_database("analytics")
     
     # Get all users
     users = await db.users.find({"role": "user"}).to_list(1000)
@@ -676,7 +696,7 @@ async def get_leaderboard(current_user: dict = Depends(get_current_user)):
         user_id = str(user["_id"])
         
         # Get all games for this user
-        all_games = await db.game_sessions.find({"user_id": user_id}).to_list(1000)
+        all_games = await find_with_archives(db, "game_sessions", {"user_id": user_id})
         completed_games = [g for g in all_games if g.get("completed", False)]
         
         # Only include users who have completed at least one game
@@ -1,20 +1,64 @@
 import os
+import re
+import logging
 from datetime import datetime
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends, Header
+from fastapi.responses import StreamingResponse
 from app.services.parser_service import extract_text
 from app.services.groq_service import structure_policy
+from app.services.policy_ingest import (
+    build_policy_document, ingest_documents, read_zip, discard_blob, IngestLimitError
+)
+from app.services.policy_revision import LIST_FIELDS, revise_structure, invalidate_games
 from app.models.policy_model import PolicyResponse
-from app.utils.db import get_collection, get_database
+from app.utils.db import get_database
+from app.utils.policy_store import insert_policy, update_policy, find_policy, load_large_fields, LIST_PROJECTION, STRUCTURE_PROJECTION
+from app.utils.blob_store import get_blob_store, iter_upload, BlobNotFoundError
 from app.utils.auth import get_current_admin, get_current_user
+from app.utils.settings import get_settings
+from app.utils.request_metrics import CompactJSONResponse
+from app.utils.http_cache import make_etag, etag_matches, cache_headers, not_modified
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 
 def get_file_extension(filename: str) -> str:
     """Get file extension from filename"""
     return os.path.splitext(filename)[1].lower().lstrip('.')
 
 
+async def _discard_replaced_blob(blob_store, old_key: Optional[str], new_key: str):
+    """Remove a revised policy's previous original unless another policy uses the same content"""
+    if not old_key or old_key == new_key:
+        return
+    try:
+        # Gameplay profile (primary): a lagging secondary could miss a policy that shares the content
+        db = await get_database("gameplay")
+        if await db.policies.count_documents({"blob_key": old_key}, limit=1) == 0:
+            await blob_store.delete(old_key)
+    except Exception as e:
+        logger.warning("Failed to remove replaced original %s: %s", old_key, e)
+
+
+def _parse_range(range_header: Optional[str], size: int):
+    """Parse a single `bytes=start-end` range into [start, end); None if absent or invalid"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(match.group(2))), size
+    else:
+        start = int(match.group(1))
+        end = min(size, int(match.group(2)) + 1) if match.group(2) else size
+    if start >= size or start >= end:
+        return None
+    return start, end
+
+
 def validate_file_type(filename: str) -> bool:
     """Validate that file is PDF or DOCX"""
     allowed_extensions = ['pdf', 'docx', 'doc']
@@ -27,20 +71,70 @@ async def get_policies(current_user: dict = Depends(get_current_user)):
     """Get all policies for authenticated users (to play games)"""
     db = await get_database()
     
-    policies = await db.policies.find({}).sort("uploaded_at", -1).to_list(100)
+    policies = await db.policies.find({}, LIST_PROJECTION).sort("uploaded_at", -1).to_list(100)
     
     return [
         {
             "policyId": str(policy["_id"]),
             "title": policy.get("title", "Untitled"),
             "filename": policy.get("filename", "Unknown"),
-            "rules_count": len(policy.get("rules", [])),
-            "clauses_count": len(policy.get("clauses", []))
+            "rules_count": policy.get("rules_count", 0),
+            "clauses_count": policy.get("clauses_count", 0)
         }
         for policy in policies
     ]
 
 
+@router.get("/policies/{policy_id}", response_class=CompactJSONResponse)
+async def get_policy(
+    policy_id: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get a policy's structured content (without its raw text)
+    
+    Revising a policy keeps its id and bumps its revision, which is the
+    version in the ETag.
+    """
+    db = await get_database()
+    
+    # Check the version before loading the structured lists
+    version = await find_policy(db, policy_id, {"revision": 1})
+    if not version:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Policy not found"
+        )
+    etag = make_etag("policy", policy_id, version.get("revision", 1))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    policy = await find_policy(db, policy_id, {
+        **STRUCTURE_PROJECTION, "filename": 1, "uploaded_at": 1, "uploaded_by_name": 1, "revision": 1, "revised_at": 1
+    })
+    if not policy:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Policy not found"
+        )
+    etag = make_etag("policy", policy_id, policy.get("revision", 1))
+    # Older policies nest their content under structuredData
+    content = policy["structuredData"] if isinstance(policy.get("structuredData"), dict) else policy
+    
+    return CompactJSONResponse({
+        "policyId": policy_id,
+        "title": content.get("title") or policy.get("title", "Untitled"),
+        "summary": content.get("summary"),
+        **{field: content.get(field) or [] for field in LIST_FIELDS},
+        "filename": policy.get("filename", "Unknown"),
+        "uploaded_by": policy.get("uploaded_by_name", "Unknown"),
+        "uploaded_at": policy.get("uploaded_at"),
+        "revision": policy.get("revision", 1),
+        "revised_at": policy.get("revised_at")
+    }, headers=cache_headers(etag))
+
+
 @router.post("/policy/upload", response_model=PolicyResponse, status_code=status.HTTP_200_OK)
 async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_current_admin)):
     """
@@ -51,7 +145,7 @@ async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_
     Returns structured policy data extracted using Groq AI
     """
     try:
-        print(f"Upload request received from admin: {admin.get('email', 'unknown')}")
+        logger.info("Upload request received from admin: %s", admin.get("email", "unknown"))
         # Validate file type
         if not file.filename:
             raise HTTPException(
@@ -65,22 +159,10 @@ async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_
                 detail=f"Unsupported file type. Only PDF and DOCX files are allowed. Received: {get_file_extension(file.filename)}"
             )
         
-        # Get uploads directory path
-        app_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        uploads_dir = os.path.join(app_dir, "uploads")
-        os.makedirs(uploads_dir, exist_ok=True)
-        
-        # Generate unique filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_ext = get_file_extension(file.filename)
-        saved_filename = f"{timestamp}_{file.filename}"
-        file_path = os.path.join(uploads_dir, saved_filename)
-        
-        # Save uploaded file
+        # Store the original in the blob store, keyed by content hash
+        blob_store = await get_blob_store()
         try:
-            with open(file_path, "wb") as saved_file:
-                content = await file.read()
-                saved_file.write(content)
+            blob = await blob_store.put(iter_upload(file), filename=file.filename, content_type=file.content_type or "")
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -94,9 +176,8 @@ async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_
         try:
             raw_text = await extract_text(file)
         except Exception as e:
-            # Clean up saved file on error
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # Clean up stored original on error
+            await discard_blob(blob_store, blob)
             raise HTTPException(
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                 detail=f"Failed to extract text from document: {str(e)}"
@@ -106,9 +187,8 @@ async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_
         try:
             structured_data = await structure_policy(raw_text)
         except Exception as e:
-            # Clean up saved file on error
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # Clean up stored original on error
+            await discard_blob(blob_store, blob)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to structure policy document: {str(e)}"
@@ -116,33 +196,15 @@ async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_
         
         # Prepare document for MongoDB
         db = await get_database()
-        policy_document = {
-            "filename": file.filename,
-            "saved_filename": saved_filename,
-            "file_path": file_path,
-            "uploaded_at": datetime.utcnow(),
-            "uploaded_by": str(admin["_id"]),
-            "uploaded_by_name": admin.get("name", "Admin"),
-            "title": structured_data.get("title"),
-            "summary": structured_data.get("summary"),
-            "rules": structured_data.get("rules", []),
-            "roles": structured_data.get("roles", []),
-            "clauses": structured_data.get("clauses", []),
-            "definitions": structured_data.get("definitions", []),
-            "exceptions": structured_data.get("exceptions", []),
-            "risks": structured_data.get("risks", []),
-            "policy_sections": structured_data.get("policy_sections", []),
-            "raw_text": raw_text
-        }
+        policy_document = build_policy_document(file.filename, file.content_type, blob, admin, structured_data, raw_text)
         
-        # Save to MongoDB
+        # Save to MongoDB (raw text and index go to the side collection)
         try:
-            collection = await get_collection()
-            result = await collection.insert_one(policy_document)
-            policy_document["policyId"] = str(result.inserted_id)
+            inserted_id = await insert_policy(db, policy_document)
+            policy_document["policyId"] = str(inserted_id)
         except Exception as e:
             # Log error but don't fail the request if MongoDB save fails
-            print(f"Warning: Failed to save to MongoDB: {str(e)}")
+            logger.warning("Failed to save policy to MongoDB: %s", e)
         
         # Prepare response - ensure list fields are never None
         list_fields = ["rules", "roles", "clauses", "definitions", "exceptions", "risks", "policy_sections"]
@@ -169,13 +231,206 @@ async def upload_policy(file: UploadFile = File(...), admin: dict = Depends(get_
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
-        # Clean up saved file on unexpected error
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
-        import traceback
-        print(f"Upload error: {e}")
-        traceback.print_exc()
+        # Clean up stored original on unexpected error
+        if 'blob' in locals():
+            await discard_blob(blob_store, blob)
+        logger.exception("Upload error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Unexpected error processing policy document: {str(e)}"
         )
+
+
+@router.post("/policy/upload/bulk")
+async def upload_policies_bulk(files: List[UploadFile] = File(...), admin: dict = Depends(get_current_admin)):
+    """
+    Upload and process many policy documents at once
+    
+    - **files**: PDF/DOCX documents and/or zip archives of them
+    
+    Returns a per-file status report and the throughput in documents per minute
+    """
+    settings = get_settings()
+    max_files = settings.ingest_max_files
+    documents = []
+    total_bytes = 0
+    for file in files:
+        data = await file.read()
+        if get_file_extension(file.filename or "") == "zip":
+            try:
+                # The archive may only expand into what is left of the upload's limits
+                extracted = read_zip(data, max_files=max_files - len(documents),
+                                     max_total_bytes=settings.ingest_max_total_bytes - total_bytes)
+            except IngestLimitError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"{file.filename}: {str(e)}"
+                )
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid zip archive {file.filename}: {str(e)}"
+                )
+            documents.extend(extracted)
+            total_bytes += sum(len(content) for _, content in extracted)
+        elif file.filename and validate_file_type(file.filename):
+            documents.append((file.filename, data))
+            total_bytes += len(data)
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported file type. Only PDF, DOCX and zip files are allowed. Received: {file.filename}"
+            )
+        if len(documents) > max_files:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Too many documents ({len(documents)}); at most {max_files} per upload"
+            )
+        if total_bytes > settings.ingest_max_total_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Documents exceed {settings.ingest_max_total_bytes} bytes in total"
+            )
+    
+    if not documents:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No PDF or DOCX documents found in the upload"
+        )
+    
+    logger.info("Bulk upload of %d documents from admin: %s", len(documents), admin.get("email", "unknown"))
+    db = await get_database()
+    return await ingest_documents(db, documents, admin)
+
+
+@router.post("/policy/{policy_id}/revise")
+async def revise_policy(policy_id: str, file: UploadFile = File(...), admin: dict = Depends(get_current_admin)):
+    """
+    Replace a policy's document with a revised version, keeping its id
+    
+    - **file**: Revised policy document (PDF or DOCX format)
+    
+    Only the sections that changed are re-structured. Generated games built
+    from rules that were removed or rewritten are marked stale and regenerated
+    on next request; all other games stay valid.
+    """
+    if not file.filename or not validate_file_type(file.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unsupported file type. Only PDF and DOCX files are allowed."
+        )
+    
+    db = await get_database("gameplay")
+    policy = await find_policy(db, policy_id, {**STRUCTURE_PROJECTION, "blob_key": 1, "revision": 1})
+    if not policy:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Policy not found"
+        )
+    old_text = (await load_large_fields(db, policy_id, ["raw_text"])).get("raw_text") or ""
+    
+    blob_store = await get_blob_store()
+    try:
+        blob = await blob_store.put(iter_upload(file), filename=file.filename, content_type=file.content_type or "")
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to save file: {str(e)}"
+        )
+    await file.seek(0)
+    
+    try:
+        new_text = await extract_text(file)
+        revision = await revise_structure(policy, old_text, new_text)
+    except Exception as e:
+        await discard_blob(blob_store, blob)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Failed to process revised document: {str(e)}"
+        )
+    
+    invalidated = {}
+    if revision["mode"] != "unchanged" or blob["key"] != policy.get("blob_key"):
+        policy_document = build_policy_document(file.filename, file.content_type, blob, admin, revision["structured"], new_text)
+        # The policy keeps its original uploader; record who revised it
+        for field in ("uploaded_at", "uploaded_by", "uploaded_by_name"):
+            policy_document.pop(field)
+        policy_document.update(
+            revised_at=datetime.utcnow(),
+            revised_by=str(admin["_id"]),
+            revised_by_name=admin.get("name", "Admin"),
+            revision=policy.get("revision", 1) + 1
+        )
+        await update_policy(db, policy_id, policy_document)
+        invalidated = await invalidate_games(db, policy_id, revision["removed"]["rules"])
+        await _discard_replaced_blob(blob_store, policy.get("blob_key"), blob["key"])
+    
+    logger.info("Revised policy %s (%s): re-structured %d/%d chars, invalidated %s", policy_id, revision["mode"],
+                revision["restructured_chars"], revision["total_chars"], invalidated)
+    return {
+        "policy_id": policy_id,
+        "mode": revision["mode"],
+        "changed_sections": revision["changed_sections"],
+        "restructured_chars": revision["restructured_chars"],
+        "total_chars": revision["total_chars"],
+        "added": {field: len(revision["added"][field]) for field in LIST_FIELDS},
+        "removed": {field: len(revision["removed"][field]) for field in LIST_FIELDS},
+        "invalidated_games": invalidated
+    }
+
+
+@router.get("/policy/{policy_id}/original")
+async def download_policy_original(
+    policy_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    admin: dict = Depends(get_current_admin)
+):
+    """
+    Download the uploaded original of a policy
+    
+    Supports a single HTTP byte range (`Range: bytes=start-end`), e.g. to
+    re-extract part of a large document without transferring all of it.
+    """
+    db = await get_database()
+    policy = await find_policy(db, policy_id, {"filename": 1, "content_type": 1, "blob_key": 1})
+    if not policy or not policy.get("blob_key"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Policy original not found"
+        )
+    
+    blob_store = await get_blob_store()
+    try:
+        size = await blob_store.size(policy["blob_key"])
+    except BlobNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Policy original not found"
+        )
+    
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{policy.get("filename", "policy")}"'
+    }
+    media_type = policy.get("content_type") or "application/octet-stream"
+    byte_range = _parse_range(range_header, size)
+    if range_header and byte_range is None:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Invalid byte range",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(blob_store.read(policy["blob_key"]), media_type=media_type, headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        blob_store.read(policy["blob_key"], start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers
+    )
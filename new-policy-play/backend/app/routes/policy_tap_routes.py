@@ -1,6 +1,10 @@
+import json
+import asyncio
+import logging
 from datetime import datetime
-from typing import Optional
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Header
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
 from app.models.policy_tap_model import (
     FallingBallGameSet,
@@ -12,32 +16,53 @@ from app.models.policy_tap_model import (
 )
 from app.utils.db import get_database
 from app.utils.auth import get_current_user
-from app.services.policy_tap_generator import generate_falling_ball_questions
+from app.utils.attempt_store import policy_tap_attempt_store
+from app.utils.policy_store import find_policy, STRUCTURE_PROJECTION, LARGE_FIELDS
+from app.utils.retention import find_with_archives
+from app.services.policy_tap_generator import generate_falling_ball_questions, stream_falling_ball_questions
+from app.services.policy_index import ensure_policy_index
+from app.utils.structured_logging import SampledLogger
+from app.utils.request_metrics import CompactJSONResponse
+from app.utils.http_cache import make_etag, etag_matches, cache_headers, not_modified
+from app.utils.settings import get_settings
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+# Per-answer details: sampled debug records only
+answer_log = SampledLogger(__name__)
+
+# Background generation tasks of streamed game sets (kept referenced until they finish)
+_generation_tasks = set()
 
 
 @router.post("/policy-tap/generate/{policy_id}")
 async def generate_policy_tap_game(
     policy_id: str,
     level: str = Query(..., pattern="^(beginner|intermediate|expert)$"),
+    instant: bool = Query(False, description="Build questions locally without calling the LLM"),
     current_user: dict = Depends(get_current_user)
 ):
     """Generate Policy Tap game questions for a policy"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     # Get policy
-    policy = await db.policies.find_one({"_id": ObjectId(policy_id)})
+    policy = await find_policy(db, policy_id, STRUCTURE_PROJECTION, large_fields=LARGE_FIELDS)
     if not policy:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Policy not found"
         )
+    await ensure_policy_index(db, policy)
     
     # Check if game set already exists
+    # Instant (locally generated) sets are cached separately from LLM-generated ones
+    generator = "local" if instant else "groq"
     existing = await db.falling_ball_games.find_one({
         "policy_id": policy_id,
-        "level": level
+        "level": level,
+        "generator": "local" if instant else {"$ne": "local"},
+        "status": {"$nin": ["generating", "failed"]},
+        "stale": {"$ne": True}
     })
     
     if existing:
@@ -51,16 +76,17 @@ async def generate_policy_tap_game(
     
     # Generate questions
     try:
-        num_questions = 10
+        num_questions = get_settings().policy_tap_questions
         
-        # Log policy data for debugging
-        print(f"Generating questions for policy ID: {policy_id}")
-        print(f"Policy title: {policy.get('title', 'Unknown')}")
-        print(f"Policy has {len(policy.get('rules', []))} rules")
-        print(f"Policy has {len(policy.get('raw_text', ''))} characters of raw text")
+        logger.debug("Generating Policy Tap questions", extra={
+            "policy_id": policy_id,
+            "level": level,
+            "rules": len(policy.get("rules", [])),
+            "raw_text_chars": policy.get("raw_text_chars", len(policy.get("raw_text", "")))
+        })
         
         # Ensure we're passing the full policy document
-        questions = await generate_falling_ball_questions(policy, level, num_questions)
+        questions = await generate_falling_ball_questions(policy, level, num_questions, instant=instant)
         
         # Convert to dict for storage
         questions_dict = [
@@ -77,6 +103,7 @@ async def generate_policy_tap_game(
             "policy_id": policy_id,
             "level": level,
             "questions": questions_dict,
+            "generator": generator,
             "created_at": datetime.utcnow()
         }
         
@@ -90,22 +117,162 @@ async def generate_policy_tap_game(
             "created_at": game_set_doc["created_at"]
         }
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error generating falling ball game: {error_details}")
+        logger.exception("Error generating falling ball game", extra={"policy_id": policy_id, "level": level})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate game: {str(e)}"
         )
 
 
-@router.get("/policy-tap/game-set/{game_set_id}")
+def _stream_event(event: dict, fmt: str) -> str:
+    data = json.dumps(event, default=str)
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+async def _generate_game_set_streamed(db, policy: dict, policy_id: str, level: str, instant: bool, queue: asyncio.Queue):
+    """
+    Generate a game set question by question, storing and publishing each one as it arrives
+
+    The game set is inserted up front with status "generating" and questions are
+    pushed onto it as they are generated, so an attempt can be started (and the
+    first questions answered) before generation is complete. Runs as its own
+    task so a client disconnect does not leave a half-built set behind.
+    """
+    game_set_doc = {
+        "policy_id": policy_id,
+        "level": level,
+        "questions": [],
+        "generator": "local" if instant else "groq",
+        "status": "generating",
+        "created_at": datetime.utcnow()
+    }
+    result = None
+    try:
+        result = await db.falling_ball_games.insert_one(game_set_doc)
+        game_set_id = str(result.inserted_id)
+        await queue.put({"type": "game_set", "game_set_id": game_set_id, "policy_id": policy_id, "level": level,
+                         "created_at": game_set_doc["created_at"]})
+        
+        index = 0
+        num_questions = get_settings().policy_tap_questions
+        async for question in stream_falling_ball_questions(policy, level, num_questions, instant=instant):
+            question_dict = {
+                "question": question.question,
+                "correct": question.correct,
+                "wrong_options": question.wrong_options
+            }
+            await db.falling_ball_games.update_one({"_id": result.inserted_id}, {"$push": {"questions": question_dict}})
+            await queue.put({"type": "question", "index": index, "question": question_dict})
+            index += 1
+        
+        await db.falling_ball_games.update_one({"_id": result.inserted_id}, {"$set": {"status": "ready"}})
+        await queue.put({"type": "done", "game_set_id": game_set_id, "count": index})
+    except Exception as e:
+        logger.exception("Error generating falling ball game (streamed) for policy %s", policy_id)
+        if result is not None:
+            # Keep the set (attempts may already reference it) but never serve it from the cache
+            try:
+                await db.falling_ball_games.update_one({"_id": result.inserted_id}, {"$set": {"status": "failed"}})
+            except Exception:
+                logger.exception("Could not mark game set %s as failed", result.inserted_id)
+        await queue.put({"type": "error", "detail": f"Failed to generate game: {str(e)}"})
+    finally:
+        await queue.put(None)
+
+
+@router.post("/policy-tap/generate/{policy_id}/stream")
+async def stream_policy_tap_game(
+    policy_id: str,
+    level: str = Query(..., pattern="^(beginner|intermediate|expert)$"),
+    instant: bool = Query(False, description="Build questions locally without calling the LLM"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Generate Policy Tap questions and stream each one as soon as it is ready
+
+    Emits a `game_set` event first (with the id to start an attempt against),
+    then one `question` event per question, then `done` (or `error`). Cached
+    game sets are streamed straight from the database.
+    """
+    db = await get_database("gameplay")
+    
+    policy = await find_policy(db, policy_id, STRUCTURE_PROJECTION, large_fields=LARGE_FIELDS)
+    if not policy:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Policy not found"
+        )
+    await ensure_policy_index(db, policy)
+    
+    existing = await db.falling_ball_games.find_one({
+        "policy_id": policy_id,
+        "level": level,
+        "generator": "local" if instant else {"$ne": "local"},
+        "status": {"$nin": ["generating", "failed"]},
+        "stale": {"$ne": True}
+    })
+    
+    if existing:
+        async def cached_events():
+            yield _stream_event({"type": "game_set", "game_set_id": str(existing["_id"]), "policy_id": policy_id,
+                                 "level": level, "created_at": existing.get("created_at")}, format)
+            questions = existing.get("questions", [])
+            for index, question in enumerate(questions):
+                yield _stream_event({"type": "question", "index": index, "question": question}, format)
+            yield _stream_event({"type": "done", "game_set_id": str(existing["_id"]), "count": len(questions)}, format)
+        
+        events = cached_events()
+    else:
+        queue = asyncio.Queue()
+        task = asyncio.create_task(_generate_game_set_streamed(db, policy, policy_id, level, instant, queue))
+        _generation_tasks.add(task)
+        task.add_done_callback(_generation_tasks.discard)
+        
+        async def generated_events():
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield _stream_event(event, format)
+        
+        events = generated_events()
+    
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events, media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/policy-tap/game-set/{game_set_id}", response_class=CompactJSONResponse)
 async def get_policy_tap_game_set(
     game_set_id: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get Policy Tap game set data without creating an attempt"""
-    db = await get_database()
+    """
+    Get Policy Tap game set data without creating an attempt
+    
+    A set still being generated (streamed) gains questions, so its version is
+    its status and question count; a finished set never changes.
+    """
+    db = await get_database("gameplay")
+    
+    # Check the version before loading the questions
+    version = await db.falling_ball_games.find_one(
+        {"_id": ObjectId(game_set_id)},
+        {"status": 1, "question_count": {"$size": {"$ifNull": ["$questions", []]}}}
+    )
+    if not version:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game set not found"
+        )
+    game_status = version.get("status", "ready")
+    finished = game_status == "ready"
+    etag = make_etag("game-set", game_set_id, f"{game_status}-{version['question_count']}")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, immutable=finished)
     
     # Get game set
     game_set = await db.falling_ball_games.find_one({"_id": ObjectId(game_set_id)})
@@ -114,22 +281,27 @@ async def get_policy_tap_game_set(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Game set not found"
         )
+    # Generation may have moved on between the two reads
+    game_status = game_set.get("status", "ready")
+    finished = game_status == "ready"
+    etag = make_etag("game-set", game_set_id, f"{game_status}-{len(game_set.get('questions', []))}")
     
-    return {
+    return CompactJSONResponse({
         "game_set_id": game_set_id,
         "questions": game_set.get("questions", []),
         "level": game_set["level"],
-        "policy_id": game_set.get("policy_id")
-    }
+        "policy_id": game_set.get("policy_id"),
+        "status": game_status
+    }, headers=cache_headers(etag, immutable=finished))
 
 
-@router.post("/policy-tap/start")
+@router.post("/policy-tap/start", response_class=CompactJSONResponse)
 async def start_policy_tap_game(
     request: StartFallingBallRequest,
     current_user: dict = Depends(get_current_user)
 ):
     """Start a new Policy Tap game attempt"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
     # Get game set
     game_set = await db.falling_ball_games.find_one({"_id": ObjectId(request.game_set_id)})
@@ -155,14 +327,36 @@ async def start_policy_tap_game(
         "completed_at": None
     }
     
-    result = await db.falling_ball_attempts.insert_one(attempt_doc)
+    attempt_id = await policy_tap_attempt_store.create(db, attempt_doc)
     
-    return {
-        "attempt_id": str(result.inserted_id),
+    return CompactJSONResponse({
+        "attempt_id": attempt_id,
         "game_set_id": request.game_set_id,
         "questions": game_set.get("questions", []),
         "level": game_set["level"]
-    }
+    })
+
+
+def score_answer(question: dict, selected_option: str, time_taken: float, was_missed: bool) -> Tuple[bool, int]:
+    """Whether a Policy Tap answer is correct and the points it earns"""
+    is_correct = selected_option == question.get("correct", "")
+    
+    # Calculate points - check was_missed first, then correctness
+    points = 0
+    if was_missed:
+        # User missed the question (ball fell without being clicked)
+        # This happens when no ball was selected before all balls fell
+        points = -5  # Penalty for missing
+    elif is_correct:
+        # Correct answer was selected
+        points = 10
+        # Speed bonus (answered quickly)
+        if time_taken < 2.0:
+            points += 2
+    else:
+        # Wrong answer was selected
+        points = -5
+    return is_correct, points
 
 
 @router.post("/policy-tap/submit")
@@ -171,13 +365,16 @@ async def submit_policy_tap_answer(
     current_user: dict = Depends(get_current_user)
 ):
     """Submit an answer for a Policy Tap question"""
-    db = await get_database()
+    db = await get_database("gameplay")
     
-    # Get attempt
-    attempt = await db.falling_ball_attempts.find_one({
-        "_id": ObjectId(answer.attempt_id),
-        "user_id": str(current_user["_id"])
-    })
+    async with policy_tap_attempt_store.lock(answer.attempt_id):
+        return await _submit_policy_tap_answer(db, answer, current_user)
+
+
+async def _submit_policy_tap_answer(db, answer: SubmitFallingBallAnswer, current_user: dict):
+    """Score an answer and update the live attempt (caller holds the attempt lock)"""
+    # Get attempt from the in-progress store
+    attempt = await policy_tap_attempt_store.load(db, answer.attempt_id, str(current_user["_id"]))
     
     if not attempt:
         raise HTTPException(
@@ -208,30 +405,18 @@ async def submit_policy_tap_answer(
     
     question = questions[answer.question_index]
     correct_answer = question.get("correct", "")
-    is_correct = answer.selected_option == correct_answer
-    
-    # Debug logging
-    print(f"Question {answer.question_index}: Selected='{answer.selected_option}', Correct='{correct_answer}', is_correct={is_correct}, was_missed={answer.was_missed}")
+    is_correct, points = score_answer(question, answer.selected_option, answer.time_taken, answer.was_missed)
     
-    # Calculate points - check was_missed first, then correctness
-    points = 0
-    if answer.was_missed:
-        # User missed the question (ball fell without being clicked)
-        # This happens when no ball was selected before all balls fell
-        points = -5  # Penalty for missing
-    elif is_correct:
-        # Correct answer was selected
-        points = 10
-        # Speed bonus (answered quickly)
-        if answer.time_taken < 2.0:
-            points += 2
-        print(f"✅ Correct answer! Points: {points}")
-    else:
-        # Wrong answer was selected
-        points = -5
-        print(f"❌ Wrong answer. Points: {points}")
-    
-    print(f"Points calculated: {points}, Current score: {attempt.get('score', 0)}, New score: {attempt.get('score', 0) + points}")
+    answer_log.debug("Policy Tap answer checked", lambda: {
+        "attempt_id": answer.attempt_id,
+        "question_index": answer.question_index,
+        "selected": answer.selected_option,
+        "expected": correct_answer,
+        "correct": is_correct,
+        "missed": answer.was_missed,
+        "points": points,
+        "score": attempt.get("score", 0) + points
+    })
     
     # Check if this question has already been answered
     existing_answers = attempt.get("answers", [])
@@ -242,7 +427,8 @@ async def submit_policy_tap_answer(
     
     if already_answered:
         # Return existing answer data without updating
-        print(f"⚠️ Question {answer.question_index} already answered, skipping duplicate submission")
+        logger.info("Duplicate Policy Tap answer ignored",
+                    extra={"attempt_id": answer.attempt_id, "question_index": answer.question_index})
         existing_answer = next(
             (ans for ans in existing_answers if ans.get("question_index") == answer.question_index),
             None
@@ -278,18 +464,13 @@ async def submit_policy_tap_answer(
     else:
         wrong_count += 1
     
-    await db.falling_ball_attempts.update_one(
-        {"_id": ObjectId(answer.attempt_id)},
-        {
-            "$set": {
-                "score": new_score,
-                "correct_answers": correct_count,
-                "wrong_answers": wrong_count,
-                "missed_answers": missed_count,
-                "answers": answers
-            }
-        }
-    )
+    await policy_tap_attempt_store.update(db, answer.attempt_id, {
+        "score": new_score,
+        "correct_answers": correct_count,
+        "wrong_answers": wrong_count,
+        "missed_answers": missed_count,
+        "answers": answers
+    })
     
     return {
         "correct": is_correct,
@@ -305,46 +486,36 @@ async def finish_policy_tap_game(
     current_user: dict = Depends(get_current_user)
 ):
     """Finish a Policy Tap game attempt"""
-    db = await get_database()
-    
-    attempt = await db.falling_ball_attempts.find_one({
-        "_id": ObjectId(request.attempt_id),
-        "user_id": str(current_user["_id"])
-    })
-    
-    if not attempt:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Attempt not found"
-        )
-    
-    # Update attempt with final time
-    await db.falling_ball_attempts.update_one(
-        {"_id": ObjectId(request.attempt_id)},
-        {
-            "$set": {
-                "time_taken": request.final_time_taken,
-                "completed_at": datetime.utcnow()
-            }
-        }
-    )
-    
-    # Fetch updated attempt to get latest scores
-    updated_attempt = await db.falling_ball_attempts.find_one({"_id": ObjectId(request.attempt_id)})
-    
-    if not updated_attempt:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Attempt not found after update"
-        )
+    db = await get_database("gameplay")
     
-    # Get final scores from updated attempt
-    final_score = updated_attempt.get("score", 0)
-    correct_answers = updated_attempt.get("correct_answers", 0)
-    wrong_answers = updated_attempt.get("wrong_answers", 0)
-    missed_answers = updated_attempt.get("missed_answers", 0)
+    async with policy_tap_attempt_store.lock(request.attempt_id):
+        attempt = await policy_tap_attempt_store.load(db, request.attempt_id, str(current_user["_id"]))
+        
+        if not attempt:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Attempt not found"
+            )
+        
+        # Persist the final attempt state (flushes any pending answers too)
+        await policy_tap_attempt_store.finish(db, request.attempt_id, {
+            "time_taken": request.final_time_taken,
+            "completed_at": datetime.utcnow()
+        })
     
-    print(f"Finish game - Final scores: score={final_score}, correct={correct_answers}, wrong={wrong_answers}, missed={missed_answers}")
+    # Get final scores from the live attempt
+    final_score = attempt.get("score", 0)
+    correct_answers = attempt.get("correct_answers", 0)
+    wrong_answers = attempt.get("wrong_answers", 0)
+    missed_answers = attempt.get("missed_answers", 0)
+    
+    answer_log.debug("Policy Tap game finished", lambda: {
+        "attempt_id": request.attempt_id,
+        "score": final_score,
+        "correct": correct_answers,
+        "wrong": wrong_answers,
+        "missed": missed_answers
+    })
     
     return {
         "attempt_id": str(request.attempt_id),
@@ -363,7 +534,7 @@ async def get_policy_tap_leaderboard(
     current_user: dict = Depends(get_current_user)
 ):
     """Get Policy Tap game leaderboard"""
-    db = await get_database()
+    db = await get_database("analytics")
     
     query = {}
     if policy_id:
@@ -372,10 +543,10 @@ async def get_policy_tap_leaderboard(
         query["level"] = level
     
     # Get completed attempts
-    attempts = await db.falling_ball_attempts.find({
+    attempts = await find_with_archives(db, "falling_ball_attempts", {
         **query,
         "completed_at": {"$ne": None}
-    }).sort("score", -1).limit(100).to_list(100)
+    }, sort=[("score", -1)], limit=100)
     
     leaderboard = []
     for idx, attempt in enumerate(attempts):
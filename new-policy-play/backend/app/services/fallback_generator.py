@@ -0,0 +1,257 @@
+"""
+Deterministic puzzle generator that needs no LLM
+
+Builds escape room puzzles and Policy Tap questions straight from a policy's
+structured `rules`, `definitions` and `exceptions` arrays using fixed templates.
+Distractors are sampled from sibling items of the same policy, and the random
+source is seeded from the policy and level so the same input always produces
+the same puzzles. Runs in milliseconds, so it is used both as the fallback when
+Groq fails and as the "instant play" mode.
+"""
+import re
+import random
+import zlib
+from typing import Dict, List, Optional, Tuple
+from app.models.policy_tap_model import FallingBallQuestion
+
+# Words that make poor cloze blanks
+STOPWORDS = {
+    "about", "above", "after", "again", "against", "all", "also", "and", "any", "are", "because",
+    "been", "before", "being", "below", "between", "both", "but", "can", "could", "does", "doing",
+    "down", "during", "each", "either", "every", "few", "for", "from", "further", "had", "has",
+    "have", "having", "here", "how", "into", "its", "itself", "more", "most", "must", "need",
+    "not", "only", "other", "otherwise", "our", "out", "over", "own", "policy", "same", "shall",
+    "should", "some", "such", "than", "that", "the", "their", "them", "then", "there", "these",
+    "they", "this", "those", "through", "under", "until", "upon", "very", "was", "were", "what",
+    "when", "where", "which", "while", "who", "whom", "will", "with", "within", "without",
+    "would", "your"
+}
+
+DEFINITION_SEPARATORS = [":", " - ", " – ", " — ", " means ", " refers to ", " is defined as "]
+
+
+def _rng(policy_data: dict, level: str, salt: str = "") -> random.Random:
+    """Seed a private RNG from the policy identity so output is reproducible"""
+    identity = str(policy_data.get("_id") or policy_data.get("title") or "policy")
+    seed = zlib.crc32(f"{identity}|{level}|{salt}".encode("utf-8"))
+    return random.Random(seed)
+
+
+def _clean(items) -> List[str]:
+    """Keep non-empty string items, de-duplicated in order"""
+    seen = set()
+    cleaned = []
+    for item in items or []:
+        if not isinstance(item, str):
+            continue
+        text = item.strip()
+        if text and text.lower() not in seen:
+            seen.add(text.lower())
+            cleaned.append(text)
+    return cleaned
+
+
+def _split_definition(item: str) -> Optional[Tuple[str, str]]:
+    """Split "Term: definition" style entries into (term, definition)"""
+    for separator in DEFINITION_SEPARATORS:
+        if separator in item:
+            term, definition = item.split(separator, 1)
+            term, definition = term.strip(" \"'*"), definition.strip()
+            if term and definition and len(term) <= 80:
+                return term, definition
+    return None
+
+
+def _definition_pairs(policy_data: dict) -> List[Tuple[str, str]]:
+    pairs = []
+    for item in _clean(policy_data.get("definitions")):
+        pair = _split_definition(item)
+        if pair:
+            pairs.append(pair)
+    return pairs
+
+
+def _sample_distractors(rng: random.Random, correct: str, pools: List[List[str]], count: int) -> List[str]:
+    """Pick up to `count` distractors, drawing from each pool in turn until filled"""
+    chosen = []
+    excluded = {correct.strip().lower()}
+    for pool in pools:
+        candidates = [item for item in pool if item.strip().lower() not in excluded]
+        rng.shuffle(candidates)
+        for candidate in candidates:
+            if len(chosen) >= count:
+                return chosen
+            chosen.append(candidate)
+            excluded.add(candidate.strip().lower())
+    return chosen
+
+
+def _cloze(rule: str) -> Optional[Tuple[str, str]]:
+    """Blank out the most informative word of a rule; returns (masked_rule, answer)"""
+    words = re.findall(r"[A-Za-z][A-Za-z\-]{4,}", rule)
+    candidates = [word for word in words if word.lower() not in STOPWORDS]
+    if not candidates:
+        return None
+    answer = max(candidates, key=len)
+    masked = re.sub(rf"\b{re.escape(answer)}\b", "_____", rule, count=1)
+    return masked, answer
+
+
+def _cloze_words(rules: List[str]) -> List[str]:
+    words = []
+    for rule in rules:
+        cloze = _cloze(rule)
+        if cloze:
+            words.append(cloze[1])
+    return words
+
+
+def _puzzle_count(level: str, beginner: int, intermediate: int, expert: int) -> int:
+    return beginner if level == "beginner" else intermediate if level == "intermediate" else expert
+
+
+def build_room1_definitions(policy_data: dict, level: str) -> List[Dict]:
+    """Room 1: match a term to its definition, distractors are sibling definitions"""
+    rng = _rng(policy_data, level, "room1")
+    pairs = _definition_pairs(policy_data)
+    rules = _clean(policy_data.get("rules"))
+    all_definitions = [definition for _, definition in pairs]
+
+    puzzles = []
+    selected = rng.sample(pairs, min(len(pairs), _puzzle_count(level, 3, 5, 7)))
+    for term, definition in selected:
+        wrong_options = _sample_distractors(rng, definition, [all_definitions, rules], 3)
+        if wrong_options:
+            puzzles.append({"term": term, "definition": definition, "wrong_options": wrong_options})
+    return puzzles
+
+
+def build_room2_exceptions(policy_data: dict, level: str) -> List[Dict]:
+    """Room 2: pick the exception that applies to a rule, distractors are other exceptions and rules"""
+    rng = _rng(policy_data, level, "room2")
+    exceptions = _clean(policy_data.get("exceptions"))
+    rules = _clean(policy_data.get("rules"))
+    if not exceptions or not rules:
+        return []
+
+    puzzles = []
+    selected = rng.sample(exceptions, min(len(exceptions), _puzzle_count(level, 2, 3, 4)))
+    for exception in selected:
+        rule = rng.choice(rules)
+        wrong_exceptions = _sample_distractors(rng, exception, [exceptions, rules], 3)
+        if not wrong_exceptions:
+            continue
+        puzzles.append({
+            "rule": rule,
+            "scenario": f"A colleague points to the rule \"{rule}\" but the situation is covered by a documented exception. Which exception does the policy allow?",
+            "correct_exception": exception,
+            "wrong_exceptions": wrong_exceptions
+        })
+    return puzzles
+
+
+def build_room3_rules(policy_data: dict, level: str) -> List[Dict]:
+    """Room 3: choose the rule hidden behind a cloze prompt, distractors are sibling rules"""
+    rng = _rng(policy_data, level, "room3")
+    rules = _clean(policy_data.get("rules"))
+    if len(rules) < 2:
+        return []
+
+    puzzles = []
+    selected = rng.sample(rules, min(len(rules), _puzzle_count(level, 3, 4, 5)))
+    for rule in selected:
+        cloze = _cloze(rule)
+        prompt = f"\"{cloze[0]}\"" if cloze else f"a situation involving {rule.split()[0].lower()}"
+        puzzles.append({
+            "scenario": f"During an audit you are asked which policy rule covers {prompt}. Which rule applies?",
+            "correct_rule": rule,
+            "wrong_rules": _sample_distractors(rng, rule, [rules], 3)
+        })
+    return puzzles
+
+
+def build_room4_violations(policy_data: dict, level: str) -> List[Dict]:
+    """Room 4: repair a statement that ignores a rule; the fix is the rule itself"""
+    rng = _rng(policy_data, level, "room4")
+    rules = _clean(policy_data.get("rules"))
+    if not rules:
+        return []
+
+    title = policy_data.get("title") or "the policy"
+    puzzles = []
+    selected = rng.sample(rules, min(len(rules), _puzzle_count(level, 2, 3, 4)))
+    for rule in selected:
+        puzzles.append({
+            "scenario": f"A team member is reviewing their work against {title}.",
+            "violation": f"\"I don't think this applies to my work: {rule}\"",
+            "fix": rule,
+            "explanation": f"The rule applies to everyone covered by {title}: {rule}"
+        })
+    return puzzles
+
+
+def build_room5_master(policy_data: dict, level: str) -> Dict:
+    """Room 5: combine one puzzle of each kind into a master puzzle"""
+    room1 = build_room1_definitions(policy_data, level)
+    room2 = build_room2_exceptions(policy_data, level)
+    room3 = build_room3_rules(policy_data, level)
+    room4 = build_room4_violations(policy_data, level)
+    if not (room1 and room2 and room3 and room4):
+        return {}
+
+    title = policy_data.get("title") or "the policy"
+    return {
+        "scenario": f"You are leading a compliance review for {title}. Resolve each part of the review to escape.",
+        "definition_question": room1[-1],
+        "rule_question": room3[-1],
+        "exception_question": room2[-1],
+        "violation_question": room4[-1]
+    }
+
+
+def build_escape_rooms(policy_data: dict, level: str) -> Dict:
+    """Build all five rooms locally; rooms without enough source data are empty"""
+    return {
+        "room1": build_room1_definitions(policy_data, level),
+        "room2": build_room2_exceptions(policy_data, level),
+        "room3": build_room3_rules(policy_data, level),
+        "room4": build_room4_violations(policy_data, level),
+        "room5": build_room5_master(policy_data, level)
+    }
+
+
+def build_policy_tap_questions(policy_data: dict, level: str, num_questions: int, num_wrong_options: int) -> List[FallingBallQuestion]:
+    """Policy Tap questions from definitions, exceptions and rule cloze prompts"""
+    rng = _rng(policy_data, level, "policy_tap")
+    title = policy_data.get("title") or "the policy"
+    pairs = _definition_pairs(policy_data)
+    rules = _clean(policy_data.get("rules"))
+    exceptions = _clean(policy_data.get("exceptions"))
+    risks = _clean(policy_data.get("risks"))
+    terms = [term for term, _ in pairs]
+    cloze_words = _cloze_words(rules)
+
+    candidates = []
+    for term, definition in pairs:
+        candidates.append((f"In {title}, which term is defined as: \"{definition}\"?", term, [terms]))
+    for exception in exceptions:
+        candidates.append((f"Which of the following is an exception allowed by {title}?", exception, [risks, rules]))
+    for rule in rules:
+        cloze = _cloze(rule)
+        if cloze:
+            candidates.append((f"Complete the rule from {title}: \"{cloze[0]}\"", cloze[1], [cloze_words]))
+    rng.shuffle(candidates)
+
+    questions = []
+    for question_text, correct, pools in candidates:
+        if len(questions) >= num_questions:
+            break
+        wrong_options = _sample_distractors(rng, correct, pools, num_wrong_options)
+        if not wrong_options or len(question_text) < 10 or len(correct) < 3:
+            continue
+        questions.append(FallingBallQuestion(
+            question=question_text,
+            correct=correct,
+            wrong_options=wrong_options
+        ))
+    return questions
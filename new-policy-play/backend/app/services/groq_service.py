@@ -1,19 +1,6 @@
-import os
 import json
-from groq import Groq
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Groq API configuration
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY environment variable is required. Please set it in your .env file or environment.")
-MODEL_NAME = "llama-3.3-70b-versatile"  # Current supported model (replaces decommissioned llama3-70b-8192)
-
-# Initialize Groq client
-client = Groq(api_key=GROQ_API_KEY)
+from app.services.llm_service import chat_json
+from app.services.llm_telemetry import record_parse_failure
 
 
 async def structure_policy(text: str) -> dict:
@@ -65,7 +52,7 @@ Policy Document Text:
     
     try:
         # Call Groq API
-        chat_completion = client.chat.completions.create(
+        response_text = await chat_json(
             messages=[
                 {
                     "role": "system",
@@ -76,59 +63,71 @@ Policy Document Text:
                     "content": prompt
                 }
             ],
-            model=MODEL_NAME,
+            call_site="structure",
             temperature=0.3,
-            max_tokens=4096,
-            response_format={"type": "json_object"}
+            max_tokens=4096
         )
         
-        # Extract response content
-        response_text = chat_completion.choices[0].message.content
-        
         if not response_text:
             raise Exception("Empty response from Groq API")
         
-        # Parse JSON response
-        try:
-            structured_data = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            # Try to extract JSON from response if it's wrapped in markdown or other text
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                structured_data = json.loads(json_match.group())
-            else:
-                raise Exception(f"Failed to parse JSON from Groq response: {str(e)}")
-        
-        # Ensure all expected fields exist with default values
-        default_structure = {
-            "title": None,
-            "summary": None,
-            "rules": [],
-            "roles": [],
-            "clauses": [],
-            "definitions": [],
-            "exceptions": [],
-            "risks": [],
-            "policy_sections": []
-        }
-        
-        # List fields that should never be None
-        list_fields = ["rules", "roles", "clauses", "definitions", "exceptions", "risks", "policy_sections"]
-        
-        # Merge with defaults and ensure list fields are never None
-        for key, default_value in default_structure.items():
-            if key not in structured_data:
-                structured_data[key] = default_value
-            elif key in list_fields and structured_data[key] is None:
-                # Replace None with empty list for list fields
-                structured_data[key] = []
-            elif key in list_fields and not isinstance(structured_data[key], list):
-                # Ensure list fields are actually lists
-                structured_data[key] = []
-        
-        return structured_data
+        return parse_structure_response(response_text)
         
     except Exception as e:
         raise Exception(f"Error structuring policy with Groq API: {str(e)}")
 
+
+def parse_structure_response(response_text: str) -> dict:
+    """
+    Parse a structuring response into a dict with every expected field
+    
+    Args:
+        response_text: JSON returned by the model, possibly wrapped in other text
+        
+    Returns:
+        Structured policy data; missing fields are filled with None or []
+        
+    Raises:
+        Exception: If no JSON object can be parsed from the response
+    """
+    # Parse JSON response
+    try:
+        structured_data = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        record_parse_failure("structure")
+        # Try to extract JSON from response if it's wrapped in markdown or other text
+        import re
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if json_match:
+            structured_data = json.loads(json_match.group())
+        else:
+            raise Exception(f"Failed to parse JSON from Groq response: {str(e)}")
+    
+    # Ensure all expected fields exist with default values
+    default_structure = {
+        "title": None,
+        "summary": None,
+        "rules": [],
+        "roles": [],
+        "clauses": [],
+        "definitions": [],
+        "exceptions": [],
+        "risks": [],
+        "policy_sections": []
+    }
+    
+    # List fields that should never be None
+    list_fields = ["rules", "roles", "clauses", "definitions", "exceptions", "risks", "policy_sections"]
+    
+    # Merge with defaults and ensure list fields are never None
+    for key, default_value in default_structure.items():
+        if key not in structured_data:
+            structured_data[key] = default_value
+        elif key in list_fields and structured_data[key] is None:
+            # Replace None with empty list for list fields
+            structured_data[key] = []
+        elif key in list_fields and not isinstance(structured_data[key], list):
+            # Ensure list fields are actually lists
+            structured_data[key] = []
+    
+    return structured_data
@@ -0,0 +1,369 @@
+"""
+Shared gateway for all Groq chat completions
+
+Every generator goes through `chat_json`, which adds:
+- a circuit breaker that opens on a high failure rate or too many slow calls,
+  fails fast while open, and lets a single probe through when half-open
+- optional hedging: if the first request has not answered after the recent p95
+  latency of its call site, a second identical request is sent and whichever
+  succeeds first wins
+
+`chat_stream` is the streaming variant (breaker only, no hedging) for callers
+that can use partial output as it arrives.
+
+Both record every call (tokens, time to first token, latency, retries) in the
+rolling window of `llm_telemetry`, labelled by call site and game level.
+
+Callers treat `LLMUnavailableError` like any other failure and go straight to
+their fallback or cached content.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import TYPE_CHECKING, AsyncIterator, Deque, Dict, List, NamedTuple, Optional, Tuple
+from app.services.prompt_builder import estimate_tokens, CHARS_PER_TOKEN
+from app.services.llm_telemetry import record_call
+from app.utils.settings import get_settings
+from app.utils.request_metrics import add_phase
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from groq import AsyncGroq
+
+settings = get_settings()
+MODEL_NAME = "llama-3.3-70b-versatile"  # Current supported model (replaces decommissioned llama3-70b-8192)
+
+# Per-request timeout and SDK retries - kept low, the breaker and fallbacks handle outages
+LLM_TIMEOUT_SECONDS = settings.llm_timeout_seconds
+LLM_MAX_RETRIES = settings.llm_max_retries
+
+# Circuit breaker thresholds
+LLM_BREAKER_WINDOW_SECONDS = settings.llm_breaker_window_seconds
+LLM_BREAKER_MIN_CALLS = settings.llm_breaker_min_calls
+LLM_BREAKER_FAILURE_RATE = settings.llm_breaker_failure_rate
+LLM_BREAKER_SLOW_CALL_SECONDS = settings.llm_breaker_slow_call_seconds
+LLM_BREAKER_SLOW_CALL_RATE = settings.llm_breaker_slow_call_rate
+LLM_BREAKER_OPEN_SECONDS = settings.llm_breaker_open_seconds
+
+# Hedged requests (off by default - they can double upstream spend)
+LLM_HEDGE_ENABLED = settings.llm_hedge_enabled
+LLM_HEDGE_MIN_DELAY_SECONDS = settings.llm_hedge_min_delay_seconds
+LLM_HEDGE_MIN_SAMPLES = settings.llm_hedge_min_samples
+
+# Created per worker process in the app lifespan (or lazily on first use outside the app)
+client: Optional["AsyncGroq"] = None
+
+
+def init_llm_client() -> "AsyncGroq":
+    """Create this process's Groq client if it does not exist yet"""
+    global client
+    if client is None:
+        if not settings.groq_api_key:
+            raise ValueError("GROQ_API_KEY environment variable is required. Please set it in your .env file or environment.")
+        # Imported here so that importing the app does not pay for the SDK
+        from groq import AsyncGroq
+        client = AsyncGroq(api_key=settings.groq_api_key, timeout=LLM_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES)
+    return client
+
+
+async def close_llm_client():
+    """Close the Groq client's HTTP connections"""
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+
+class LLMUnavailableError(Exception):
+    """Raised without calling Groq while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Failure-rate and slow-call circuit breaker over a sliding time window"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        # (timestamp, succeeded, latency_seconds)
+        self._calls: Deque[Tuple[float, bool, float]] = deque()
+
+    def _trim(self, now: float):
+        while self._calls and self._calls[0][0] < now - LLM_BREAKER_WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def before_call(self) -> bool:
+        """Return True if the call may proceed; True marks a half-open probe"""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < LLM_BREAKER_OPEN_SECONDS:
+                raise LLMUnavailableError("LLM circuit breaker is open")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                raise LLMUnavailableError("LLM circuit breaker is half-open, probe in flight")
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record(self, succeeded: bool, latency: float, probe: bool = False):
+        now = time.monotonic()
+        if probe:
+            self._probe_in_flight = False
+            if succeeded and latency < LLM_BREAKER_SLOW_CALL_SECONDS:
+                logger.info("LLM circuit breaker closed after successful probe")
+                self.state = self.CLOSED
+                self._calls.clear()
+            else:
+                self._open(now)
+            return
+
+        self._calls.append((now, succeeded, latency))
+        self._trim(now)
+        if self.state != self.CLOSED or len(self._calls) < LLM_BREAKER_MIN_CALLS:
+            return
+
+        total = len(self._calls)
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, ok, elapsed in self._calls if ok and elapsed >= LLM_BREAKER_SLOW_CALL_SECONDS)
+        if failures / total >= LLM_BREAKER_FAILURE_RATE or slow / total >= LLM_BREAKER_SLOW_CALL_RATE:
+            self._open(now)
+
+    def cancel_probe(self):
+        self._probe_in_flight = False
+
+    def _open(self, now: float):
+        if self.state != self.OPEN:
+            logger.warning("LLM circuit breaker opened for %.0fs", LLM_BREAKER_OPEN_SECONDS)
+        self.state = self.OPEN
+        self.opened_at = now
+
+
+breaker = CircuitBreaker()
+
+# Recent successful latencies per call site, used for the hedge delay
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def _hedge_delay(call_site: str) -> Optional[float]:
+    """p95 of recent latencies for a call site, or None if hedging should not apply"""
+    samples = _latencies.get(call_site)
+    if not LLM_HEDGE_ENABLED or not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return max(LLM_HEDGE_MIN_DELAY_SECONDS, p95)
+
+
+class LLMResponse(NamedTuple):
+    text: str
+    usage: object
+    retries: int
+    hedged: bool = False
+
+
+async def _request(messages: List[dict], temperature: float, max_tokens: int, json_mode: bool) -> LLMResponse:
+    kwargs = {}
+    if json_mode:
+        kwargs["response_format"] = {"type": "json_object"}
+    # The raw response also reports how many times the SDK retried the request
+    raw = await init_llm_client().chat.completions.with_raw_response.create(
+        messages=messages,
+        model=MODEL_NAME,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        **kwargs
+    )
+    # parse() of the async client's raw response is a coroutine
+    completion = await raw.parse()
+    return LLMResponse(completion.choices[0].message.content, completion.usage, getattr(raw, "retries_taken", 0))
+
+
+async def _hedged_request(call_site: str, messages: List[dict], temperature: float, max_tokens: int, json_mode: bool) -> LLMResponse:
+    """Send the request, and a second copy if the first is slower than the call site's p95"""
+    first = asyncio.create_task(_request(messages, temperature, max_tokens, json_mode))
+    delay = _hedge_delay(call_site)
+    if delay is None:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    logger.info("Hedging %s LLM request after %.1fs", call_site, delay)
+    pending = {first, asyncio.create_task(_request(messages, temperature, max_tokens, json_mode))}
+    last_error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()._replace(hedged=True)
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _before_call(call_site: str, level: Optional[str]) -> bool:
+    """`breaker.before_call`, recording refused calls in the telemetry"""
+    try:
+        return breaker.before_call()
+    except LLMUnavailableError:
+        record_call(call_site, level, "unavailable", 0.0)
+        raise
+
+
+async def chat_json(
+    messages: List[dict],
+    call_site: str,
+    temperature: float = 0.7,
+    max_tokens: int = 2000,
+    json_mode: bool = True,
+    level: Optional[str] = None
+) -> str:
+    """
+    Run a chat completion through the circuit breaker and return the response text
+
+    Args:
+        messages: Chat messages (system + user)
+        call_site: Short name of the generator making the call (e.g. "room1", "structure")
+        level: Game level the content is generated for, if any (telemetry label)
+        temperature: Sampling temperature
+        max_tokens: Completion token limit
+        json_mode: Request a JSON object response
+
+    Raises:
+        LLMUnavailableError: If the breaker is open and the call was not attempted
+        Exception: If the Groq request fails
+    """
+    probe = _before_call(call_site, level)
+    prompt_tokens = sum(estimate_tokens(message.get("content", "")) for message in messages)
+    logger.debug("%s prompt ≈ %d tokens", call_site, prompt_tokens)
+    started = time.monotonic()
+    try:
+        response = await _hedged_request(call_site, messages, temperature, max_tokens, json_mode)
+    except asyncio.CancelledError:
+        if probe:
+            breaker.cancel_probe()
+        raise
+    except Exception:
+        latency = time.monotonic() - started
+        add_phase("groq", latency)
+        breaker.record(False, latency, probe=probe)
+        record_call(call_site, level, "error", latency, prompt_tokens=prompt_tokens, tokens_estimated=True)
+        raise
+
+    latency = time.monotonic() - started
+    add_phase("groq", latency)
+    breaker.record(True, latency, probe=probe)
+    _latencies.setdefault(call_site, deque(maxlen=200)).append(latency)
+
+    usage = response.usage
+    if usage is not None:
+        # Groq reports its own generation time; the rest of the latency is time to first token
+        completion_time = getattr(usage, "completion_time", None)
+        record_call(
+            call_site, level, "ok", latency,
+            prompt_tokens=usage.prompt_tokens or 0,
+            completion_tokens=usage.completion_tokens or 0,
+            ttft_seconds=max(0.0, latency - completion_time) if completion_time is not None else None,
+            retries=response.retries,
+            hedged=response.hedged
+        )
+    else:
+        record_call(
+            call_site, level, "ok", latency,
+            prompt_tokens=prompt_tokens, completion_tokens=estimate_tokens(response.text), tokens_estimated=True,
+            retries=response.retries, hedged=response.hedged
+        )
+    return response.text
+
+
+async def chat_stream(
+    messages: List[dict],
+    call_site: str,
+    temperature: float = 0.7,
+    max_tokens: int = 2000,
+    level: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream a chat completion through the circuit breaker, yielding text deltas
+
+    Streamed requests are not hedged, and Groq does not support JSON mode while
+    streaming, so the prompt itself must ask for JSON. The breaker records the
+    call once the stream is finished (latency is the full stream duration).
+    Token counts come from the usage Groq sends with the last chunk, or are
+    estimated from the text if the stream stopped before it.
+
+    Raises:
+        LLMUnavailableError: If the breaker is open and the call was not attempted
+        Exception: If the Groq request or the stream fails
+    """
+    probe = _before_call(call_site, level)
+    prompt_tokens = sum(estimate_tokens(message.get("content", "")) for message in messages)
+    logger.debug("%s prompt ≈ %d tokens (streaming)", call_site, prompt_tokens)
+    started = time.monotonic()
+    first_token_at = None
+    stream = None
+    streamed_chars = 0
+    usage = None
+    outcome = "ok"
+    try:
+        stream = await init_llm_client().chat.completions.create(
+            messages=messages,
+            model=MODEL_NAME,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                usage = x_groq.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                streamed_chars += len(delta)
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    logger.debug("%s first token after %.2fs", call_site, first_token_at - started)
+                yield delta
+    except GeneratorExit:
+        # Consumer stopped reading early; the stream itself was healthy if tokens were flowing
+        if first_token_at is not None:
+            breaker.record(True, time.monotonic() - started, probe=probe)
+        elif probe:
+            breaker.cancel_probe()
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        if probe:
+            breaker.cancel_probe()
+        raise
+    except Exception:
+        outcome = "error"
+        breaker.record(False, time.monotonic() - started, probe=probe)
+        raise
+    finally:
+        latency = time.monotonic() - started
+        add_phase("groq", latency)
+        record_call(
+            call_site, level, outcome, latency,
+            prompt_tokens=usage.prompt_tokens if usage is not None else prompt_tokens,
+            completion_tokens=usage.completion_tokens if usage is not None else round(streamed_chars / CHARS_PER_TOKEN),
+            tokens_estimated=usage is None,
+            ttft_seconds=first_token_at - started if first_token_at is not None else None,
+            streamed=True
+        )
+        if stream is not None:
+            # Release the HTTP connection even if the consumer stopped early
+            await stream.close()
+
+    breaker.record(True, time.monotonic() - started, probe=probe)
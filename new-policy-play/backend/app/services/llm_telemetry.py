@@ -0,0 +1,164 @@
+"""
+Rolling telemetry of LLM calls
+
+The gateway (`chat_json`/`chat_stream`) records every Groq call with its call
+site and game level: prompt and completion tokens, time to first token, total
+latency, SDK retries, hedged requests and the outcome (ok, error, or
+unavailable when the circuit breaker refused the call). Generators report JSON
+parse failures and fallback activations (local generator, cached game) for the
+same labels.
+
+Samples are kept in memory for LLM_TELEMETRY_WINDOW_SECONDS (at most
+LLM_TELEMETRY_MAX_SAMPLES per worker) and summarised per call site and level by
+`telemetry_snapshot`, including an estimated cost from the configured token
+prices. Each worker process keeps its own window.
+"""
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+from app.utils.db_metrics import summarize
+from app.utils.settings import get_settings
+
+NO_LEVEL = "-"
+
+
+class LLMCallSample(NamedTuple):
+    at: float
+    call_site: str
+    level: str
+    outcome: str
+    prompt_tokens: int
+    completion_tokens: int
+    tokens_estimated: bool
+    ttft_seconds: Optional[float]
+    latency_seconds: float
+    retries: int
+    hedged: bool
+    streamed: bool
+
+
+class LLMEvent(NamedTuple):
+    at: float
+    call_site: str
+    level: str
+    kind: str
+    reason: Optional[str]
+
+
+_calls: Deque[LLMCallSample] = deque(maxlen=get_settings().llm_telemetry_max_samples)
+_events: Deque[LLMEvent] = deque(maxlen=get_settings().llm_telemetry_max_samples)
+
+
+def _trim(now: float):
+    horizon = now - get_settings().llm_telemetry_window_seconds
+    while _calls and _calls[0].at < horizon:
+        _calls.popleft()
+    while _events and _events[0].at < horizon:
+        _events.popleft()
+
+
+def record_call(call_site: str, level: Optional[str], outcome: str, latency_seconds: float,
+                prompt_tokens: int = 0, completion_tokens: int = 0, tokens_estimated: bool = False,
+                ttft_seconds: Optional[float] = None, retries: int = 0, hedged: bool = False,
+                streamed: bool = False):
+    """Record one gateway call (outcome: ok, error or unavailable)"""
+    now = time.monotonic()
+    _calls.append(LLMCallSample(
+        now, call_site, level or NO_LEVEL, outcome, prompt_tokens, completion_tokens, tokens_estimated,
+        ttft_seconds, latency_seconds, retries, hedged, streamed
+    ))
+    _trim(now)
+
+
+def record_parse_failure(call_site: str, level: Optional[str] = None):
+    """The response of a call could not be parsed as the expected JSON"""
+    _events.append(LLMEvent(time.monotonic(), call_site, level or NO_LEVEL, "parse_failure", None))
+
+
+def record_fallback(call_site: str, level: Optional[str] = None, reason: Optional[str] = None):
+    """Content was built without the LLM (local generator, stored game) for this call site"""
+    _events.append(LLMEvent(time.monotonic(), call_site, level or NO_LEVEL, "fallback", reason))
+
+
+def _cost(prompt_tokens: int, completion_tokens: int) -> float:
+    settings = get_settings()
+    return (prompt_tokens * settings.llm_prompt_price_per_million
+            + completion_tokens * settings.llm_completion_price_per_million) / 1_000_000
+
+
+def telemetry_snapshot() -> dict:
+    """Per call site and level totals over the window, most expensive first"""
+    now = time.monotonic()
+    _trim(now)
+    groups: Dict[Tuple[str, str], dict] = {}
+
+    def group(call_site: str, level: str) -> dict:
+        return groups.setdefault((call_site, level), {
+            "call_site": call_site,
+            "level": level,
+            "calls": 0,
+            "outcomes": {"ok": 0, "error": 0, "unavailable": 0},
+            "streamed": 0,
+            "retries": 0,
+            "hedged": 0,
+            "parse_failures": 0,
+            "fallbacks": 0,
+            "fallback_reasons": {},
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "estimated_token_calls": 0,
+            "_latencies": [],
+            "_ttfts": []
+        })
+
+    for sample in _calls:
+        entry = group(sample.call_site, sample.level)
+        entry["calls"] += 1
+        entry["outcomes"][sample.outcome] = entry["outcomes"].get(sample.outcome, 0) + 1
+        entry["streamed"] += int(sample.streamed)
+        entry["retries"] += sample.retries
+        entry["hedged"] += int(sample.hedged)
+        entry["prompt_tokens"] += sample.prompt_tokens
+        entry["completion_tokens"] += sample.completion_tokens
+        entry["estimated_token_calls"] += int(sample.tokens_estimated)
+        if sample.outcome != "unavailable":
+            entry["_latencies"].append(sample.latency_seconds * 1000)
+        if sample.ttft_seconds is not None:
+            entry["_ttfts"].append(sample.ttft_seconds * 1000)
+
+    for event in _events:
+        entry = group(event.call_site, event.level)
+        if event.kind == "parse_failure":
+            entry["parse_failures"] += 1
+        else:
+            entry["fallbacks"] += 1
+            reason = event.reason or "unspecified"
+            entry["fallback_reasons"][reason] = entry["fallback_reasons"].get(reason, 0) + 1
+
+    call_sites = []
+    for entry in groups.values():
+        entry["estimated_cost_usd"] = round(_cost(entry["prompt_tokens"], entry["completion_tokens"]), 6)
+        entry["latency_ms"] = summarize(entry.pop("_latencies"))
+        entry["ttft_ms"] = summarize(entry.pop("_ttfts"))
+        call_sites.append(entry)
+    call_sites.sort(key=lambda entry: (entry["estimated_cost_usd"], entry["latency_ms"].get("mean", 0)), reverse=True)
+
+    settings = get_settings()
+    return {
+        "worker_pid": os.getpid(),
+        "window_seconds": settings.llm_telemetry_window_seconds,
+        "prices_per_million_tokens": {
+            "prompt": settings.llm_prompt_price_per_million,
+            "completion": settings.llm_completion_price_per_million
+        },
+        "totals": {
+            "calls": sum(entry["calls"] for entry in call_sites),
+            "prompt_tokens": sum(entry["prompt_tokens"] for entry in call_sites),
+            "completion_tokens": sum(entry["completion_tokens"] for entry in call_sites),
+            "estimated_cost_usd": round(sum(entry["estimated_cost_usd"] for entry in call_sites), 6),
+            "parse_failures": sum(entry["parse_failures"] for entry in call_sites),
+            "fallbacks": sum(entry["fallbacks"] for entry in call_sites)
+        },
+        "call_sites": call_sites
+    }
@@ -1,13 +1,12 @@
 import os
-import pdfplumber
-import mammoth
+import tempfile
 from typing import Union
 from fastapi import UploadFile
 
 
-async def extract_text_from_pdf(file_path: str) -> str:
+def read_pdf_text(file_path: str) -> str:
     """
-    Extract text from PDF file using pdfplumber
+    Extract text from PDF file using pdfplumber (blocking)
     
     Args:
         file_path: Path to the PDF file
@@ -18,6 +17,8 @@ async def extract_text_from_pdf(file_path: str) -> str:
     Raises:
         Exception: If PDF extraction fails
     """
+    # Imported on first use - pdfplumber pulls in pdfminer and Pillow
+    import pdfplumber
     try:
         text_content = []
         with pdfplumber.open(file_path) as pdf:
@@ -34,9 +35,14 @@ async def extract_text_from_pdf(file_path: str) -> str:
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
 
-async def extract_text_from_docx(file_path: str) -> str:
+async def extract_text_from_pdf(file_path: str) -> str:
+    """Extract text from PDF file using pdfplumber"""
+    return read_pdf_text(file_path)
+
+
+def read_docx_text(file_path: str) -> str:
     """
-    Extract text from DOCX file using mammoth
+    Extract text from DOCX file using mammoth (blocking)
     
     Args:
         file_path: Path to the DOCX file
@@ -47,6 +53,7 @@ async def extract_text_from_docx(file_path: str) -> str:
     Raises:
         Exception: If DOCX extraction fails
     """
+    import mammoth
     try:
         with open(file_path, "rb") as docx_file:
             result = mammoth.extract_raw_text(docx_file)
@@ -60,6 +67,11 @@ async def extract_text_from_docx(file_path: str) -> str:
         raise Exception(f"Error extracting text from DOCX: {str(e)}")
 
 
+async def extract_text_from_docx(file_path: str) -> str:
+    """Extract text from DOCX file using mammoth"""
+    return read_docx_text(file_path)
+
+
 def get_file_extension(filename: str) -> str:
     """
     Get file extension from filename
@@ -143,3 +155,55 @@ async def extract_text(file: Union[UploadFile, str]) -> str:
     else:
         raise TypeError(f"Unsupported file type: {type(file)}. Expected UploadFile or str.")
 
+
+async def extract_text_from_blob(blob_store, key: str, filename: str) -> str:
+    """
+    Extract text from an original stored in the blob store
+    
+    Args:
+        blob_store: BlobStore holding the original
+        key: Content hash the original is stored under
+        filename: Original filename (used for file type detection)
+        
+    Returns:
+        Extracted text as string
+    """
+    file_ext = get_file_extension(filename)
+    fd, temp_path = tempfile.mkstemp(suffix=f".{file_ext}")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            async for chunk in blob_store.read(key):
+                temp_file.write(chunk)
+        return await extract_text(temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def extract_text_from_bytes(data: bytes, filename: str) -> str:
+    """
+    Extract text from an in-memory document (blocking)
+    
+    A plain function of picklable arguments, so bulk ingestion can run it in a
+    process pool.
+    
+    Args:
+        data: File content
+        filename: Original filename (used for file type detection)
+        
+    Returns:
+        Extracted text as string
+    """
+    file_ext = get_file_extension(filename)
+    if file_ext not in ["pdf", "docx", "doc"]:
+        raise ValueError(f"Unsupported file type: {file_ext}. Only PDF and DOCX files are supported.")
+    fd, temp_path = tempfile.mkstemp(suffix=f".{file_ext}")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        if file_ext == "pdf":
+            return read_pdf_text(temp_path)
+        return read_docx_text(temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
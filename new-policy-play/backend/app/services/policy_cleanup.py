@@ -0,0 +1,169 @@
+"""
+Cascade cleanup of deleted policies
+
+Deleting a policy removes the policy document right away; everything that
+depends on it (game sessions, escape rooms and attempts, Policy Tap sets and
+attempts, the stored original) is removed afterwards by a background job, in
+batches of CLEANUP_BATCH_SIZE documents so a large policy never holds up the
+database.
+
+Jobs are recorded in the `policy_cleanup_jobs` collection with per-collection
+progress, so any worker can report on them. A running job refreshes its
+heartbeat after every batch; jobs whose worker died are picked up again at
+startup (deletes are idempotent, so resuming is safe).
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Set
+from bson import ObjectId
+from app.utils.db import get_database
+from app.utils.blob_store import get_blob_store
+from app.utils.settings import get_settings
+
+CLEANUP_JOBS_COLLECTION = "policy_cleanup_jobs"
+# Collections holding data generated for or played on a policy, keyed by policy_id
+DEPENDENT_COLLECTIONS = [
+    "game_sessions",
+    "escape_attempts",
+    "escape_rooms",
+    "falling_ball_attempts",
+    "falling_ball_games",
+]
+# Jobs without a heartbeat for this long are considered abandoned
+ABANDONED_AFTER = timedelta(minutes=2)
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
+
+logger = logging.getLogger(__name__)
+
+# Running jobs of this process (kept referenced so they are not garbage collected)
+_cleanup_tasks: Set[asyncio.Task] = set()
+
+
+def _public_job(job: dict) -> dict:
+    job = dict(job)
+    job["job_id"] = str(job.pop("_id"))
+    return job
+
+
+async def _delete_in_batches(db, job_id: ObjectId, collection_name: str, policy_id: str) -> int:
+    settings = get_settings()
+    deleted = 0
+    while True:
+        batch = await db[collection_name].find(
+            {"policy_id": policy_id}, {"_id": 1}
+        ).limit(settings.cleanup_batch_size).to_list(settings.cleanup_batch_size)
+        if not batch:
+            return deleted
+        result = await db[collection_name].delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+        deleted += result.deleted_count
+        await db[CLEANUP_JOBS_COLLECTION].update_one(
+            {"_id": job_id},
+            {"$inc": {f"progress.{collection_name}": result.deleted_count}, "$set": {"heartbeat_at": datetime.utcnow()}}
+        )
+        # Leave room for gameplay queries between batches
+        await asyncio.sleep(settings.cleanup_batch_pause_seconds)
+
+
+async def _delete_files(job: dict) -> dict:
+    """Remove the stored original unless another policy uses the same content"""
+    removed = {"blob": False, "legacy_file": False}
+    blob_key = job.get("blob_key")
+    # Checked on the primary (gameplay profile): a lagging secondary could miss a policy that shares the content
+    db = await get_database("gameplay")
+    if blob_key and await db.policies.count_documents({"blob_key": blob_key}, limit=1) == 0:
+        blob_store = await get_blob_store()
+        await blob_store.delete(blob_key)
+        removed["blob"] = True
+
+    # Policies uploaded before the blob store kept their file under uploads/
+    file_path = job.get("file_path")
+    if file_path and os.path.realpath(file_path).startswith(os.path.realpath(UPLOADS_DIR) + os.sep):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            removed["legacy_file"] = True
+    return removed
+
+
+async def run_cleanup_job(job_id: ObjectId):
+    """Delete everything that belongs to the job's policy and record the outcome"""
+    db = await get_database()
+    job = await db[CLEANUP_JOBS_COLLECTION].find_one({"_id": job_id})
+    if job is None:
+        return
+    policy_id = job["policy_id"]
+    try:
+        for collection_name in DEPENDENT_COLLECTIONS:
+            await _delete_in_batches(db, job_id, collection_name, policy_id)
+        files = await _delete_files(job)
+        await db[CLEANUP_JOBS_COLLECTION].update_one(
+            {"_id": job_id},
+            {"$set": {"status": "completed", "files": files, "finished_at": datetime.utcnow()}}
+        )
+        logger.info("Cleanup of policy %s completed", policy_id)
+    except asyncio.CancelledError:
+        # Shutdown: leave the job running so it is resumed after restart
+        raise
+    except Exception as e:
+        logger.exception("Cleanup of policy %s failed", policy_id)
+        await db[CLEANUP_JOBS_COLLECTION].update_one(
+            {"_id": job_id},
+            {"$set": {"status": "failed", "error": str(e)[:300], "finished_at": datetime.utcnow()}}
+        )
+
+
+def _start(job_id: ObjectId):
+    task = asyncio.create_task(run_cleanup_job(job_id))
+    _cleanup_tasks.add(task)
+    task.add_done_callback(_cleanup_tasks.discard)
+
+
+async def start_cleanup_job(db, policy: dict) -> dict:
+    """Record a cleanup job for an already deleted policy and start it in the background"""
+    now = datetime.utcnow()
+    job = {
+        "policy_id": str(policy["_id"]),
+        "policy_title": policy.get("title"),
+        "blob_key": policy.get("blob_key"),
+        "file_path": policy.get("file_path"),
+        "status": "running",
+        "progress": {collection_name: 0 for collection_name in DEPENDENT_COLLECTIONS},
+        "created_at": now,
+        "heartbeat_at": now,
+        "worker_pid": os.getpid()
+    }
+    result = await db[CLEANUP_JOBS_COLLECTION].insert_one(job)
+    _start(result.inserted_id)
+    return _public_job(job)
+
+
+async def get_cleanup_job(db, job_id: str) -> Optional[dict]:
+    job = await db[CLEANUP_JOBS_COLLECTION].find_one({"_id": ObjectId(job_id)})
+    return _public_job(job) if job else None
+
+
+async def resume_cleanup_jobs() -> int:
+    """Claim and restart jobs whose worker stopped before finishing them"""
+    db = await get_database()
+    resumed = 0
+    while True:
+        job = await db[CLEANUP_JOBS_COLLECTION].find_one_and_update(
+            {"status": "running", "heartbeat_at": {"$lt": datetime.utcnow() - ABANDONED_AFTER}},
+            {"$set": {"heartbeat_at": datetime.utcnow(), "worker_pid": os.getpid()}}
+        )
+        if job is None:
+            break
+        _start(job["_id"])
+        resumed += 1
+    if resumed:
+        logger.info("Resumed %d policy cleanup jobs", resumed)
+    return resumed
+
+
+async def stop_cleanup_jobs():
+    """Cancel this process's running jobs; they are resumed after restart"""
+    for task in list(_cleanup_tasks):
+        task.cancel()
+    if _cleanup_tasks:
+        await asyncio.gather(*_cleanup_tasks, return_exceptions=True)
@@ -0,0 +1,218 @@
+"""
+Local lexical (BM25) index over a policy's content
+
+Built once when a policy is stored and saved alongside it. Generators use it to
+send the rules, clauses, definitions and raw-text chunks most relevant to the
+rule or topic they are working on, instead of always the first N items.
+Policies stored before the index existed (or with an older INDEX_VERSION) get
+one built and saved by `ensure_policy_index` the first time a game loads them.
+"""
+import re
+import math
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from app.services.fallback_generator import STOPWORDS
+from app.utils.policy_store import load_large_fields, save_large_fields
+
+INDEX_VERSION = 1
+INDEXED_FIELDS = ["rules", "clauses", "definitions", "exceptions"]
+RAW_TEXT_CHUNK_CHARS = 800
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(token: str) -> str:
+    """Fold simple plurals so that e.g. passwords and password match"""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords and very short words removed"""
+    return [
+        _normalize(token) for token in re.findall(r"[a-z0-9]+", (text or "").lower())
+        if len(token) > 2 and token not in STOPWORDS
+    ]
+
+
+def chunk_raw_text(raw_text: str, chunk_chars: int = RAW_TEXT_CHUNK_CHARS) -> List[str]:
+    """Split raw text into paragraph-aligned chunks of roughly `chunk_chars` characters"""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", raw_text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+        while len(current) > chunk_chars * 2:
+            chunks.append(current[:chunk_chars])
+            current = current[chunk_chars:]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_policy_index(policy_data: dict) -> dict:
+    """Build a serializable BM25 index over the policy's list fields and raw-text chunks"""
+    entries = []
+    for field in INDEXED_FIELDS:
+        for position, item in enumerate(policy_data.get(field) or []):
+            if isinstance(item, str) and item.strip():
+                entries.append({"field": field, "position": position, "text": item})
+    for position, chunk in enumerate(chunk_raw_text(policy_data.get("raw_text", ""))):
+        entries.append({"field": "raw_text", "position": position, "text": chunk})
+
+    term_frequencies = []
+    document_frequency = Counter()
+    lengths = []
+    for entry in entries:
+        tokens = tokenize(entry["text"])
+        counts = Counter(tokens)
+        term_frequencies.append(dict(counts))
+        document_frequency.update(counts.keys())
+        lengths.append(len(tokens))
+
+    return {
+        "version": INDEX_VERSION,
+        # List items are referenced by position; only raw-text chunks keep their text
+        "docs": [
+            {"field": entry["field"], "position": entry["position"], **({"text": entry["text"]} if entry["field"] == "raw_text" else {})}
+            for entry in entries
+        ],
+        "tf": term_frequencies,
+        "df": dict(document_frequency),
+        "lengths": lengths,
+        "avgdl": (sum(lengths) / len(lengths)) if lengths else 0.0
+    }
+
+
+def get_policy_index(policy_data: dict) -> dict:
+    """Stored index for the policy, or one built on the fly for older documents"""
+    index = policy_data.get("lexical_index")
+    if not index or index.get("version") != INDEX_VERSION:
+        index = build_policy_index(policy_data)
+        policy_data["lexical_index"] = index
+    return index
+
+
+def _content(policy: dict) -> dict:
+    """Policies may nest their content under structuredData"""
+    return policy["structuredData"] if isinstance(policy.get("structuredData"), dict) else policy
+
+
+async def ensure_policy_index(db, policy: dict) -> dict:
+    """
+    Current index for a policy loaded with its stored `lexical_index`, built and saved if missing
+
+    The index is also attached to nested structuredData content, where the
+    generators look for it, so each policy is indexed once rather than per game.
+    """
+    index = policy.get("lexical_index")
+    content = _content(policy)
+    if not index or index.get("version") != INDEX_VERSION:
+        raw_text = policy.get("raw_text") or content.get("raw_text")
+        if raw_text is None:
+            raw_text = (await load_large_fields(db, policy["_id"], ["raw_text"])).get("raw_text", "")
+        index = build_policy_index({**content, "raw_text": raw_text})
+        try:
+            await save_large_fields(db, policy["_id"], {"lexical_index": index})
+            logger.info("Built lexical index for policy %s", policy["_id"])
+        except Exception as e:
+            logger.warning("Failed to save lexical index of policy %s: %s", policy["_id"], e)
+        policy["lexical_index"] = index
+    content["lexical_index"] = index
+    return index
+
+
+def _scores(index: dict, query: str, field: str) -> Dict[int, float]:
+    """BM25 score per document position for one field"""
+    query_terms = set(tokenize(query))
+    total_docs = len(index["docs"])
+    avgdl = index["avgdl"] or 1.0
+    scores = {}
+    for doc_id, doc in enumerate(index["docs"]):
+        if doc["field"] != field:
+            continue
+        tf = index["tf"][doc_id]
+        score = 0.0
+        for term in query_terms:
+            frequency = tf.get(term)
+            if not frequency:
+                continue
+            df = index["df"].get(term, 0)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * index["lengths"][doc_id] / avgdl)
+            score += idf * frequency * (BM25_K1 + 1) / norm
+        if score > 0:
+            scores[doc["position"]] = score
+    return scores
+
+
+def spread_order(count: int, offset: int = 0) -> List[int]:
+    """
+    Positions 0..count-1 ordered so that every prefix is spread evenly across
+    the range (0, 1/2, 1/4, 3/4, ... of the way through, rotated by `offset`)
+    """
+    order = []
+    seen = set()
+    j = 0
+    while len(order) < count and j < count * 4:
+        # Van der Corput sequence in base 2
+        fraction, denominator, n = 0.0, 1.0, j
+        while n:
+            denominator *= 2
+            fraction += (n % 2) / denominator
+            n //= 2
+        position = (int(fraction * count) + offset) % count
+        if position not in seen:
+            seen.add(position)
+            order.append(position)
+        j += 1
+    order.extend(position for position in range(count) if position not in seen)
+    return order
+
+
+def rank_items(policy_data: dict, field: str, query: Optional[str] = None, offset: int = 0,
+               exclude: Iterable[str] = ()) -> List[str]:
+    """
+    All items of a list field, most relevant to `query` first
+
+    Items with no lexical overlap (or every item, without a query) follow in
+    spread order so that trimming the list still covers the whole document.
+    """
+    items = policy_data.get(field) or []
+    excluded = set(exclude)
+    spread = [
+        items[position] for position in spread_order(len(items), offset)
+        if isinstance(items[position], str) and items[position] not in excluded
+    ]
+    if not query or not items:
+        return spread
+
+    scores = _scores(get_policy_index(policy_data), query, field)
+    ranked = [
+        items[position] for position in sorted(scores, key=scores.get, reverse=True)
+        if position < len(items) and items[position] not in excluded
+    ]
+    ranked_set = set(ranked)
+    return ranked + [item for item in spread if item not in ranked_set]
+
+
+def relevant_text_chunks(policy_data: dict, query: str, k: int = 3) -> List[str]:
+    """Top-k raw-text chunks for a query, in document order"""
+    index = get_policy_index(policy_data)
+    scores = _scores(index, query, "raw_text")
+    top = sorted(sorted(scores, key=scores.get, reverse=True)[:k])
+    chunks = {doc["position"]: doc["text"] for doc in index["docs"] if doc["field"] == "raw_text"}
+    return [chunks[position] for position in top if position in chunks]
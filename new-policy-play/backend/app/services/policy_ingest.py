@@ -0,0 +1,263 @@
+"""
+Policy ingestion
+
+Turns uploaded documents into stored policies. Single uploads go through
+`build_policy_document`; bulk imports (the `ingest_policies.py` CLI and
+`POST /policy/upload/bulk`) run a pipeline over many files at once:
+- zip archives are read within INGEST_MAX_FILES members, INGEST_MAX_FILE_BYTES
+  per document and INGEST_MAX_TOTAL_BYTES uncompressed in total, so a zip bomb
+  is rejected before it is expanded
+- originals go to the blob store, and files whose content is already stored
+  as a policy are reported as duplicates and skipped
+- text extraction runs in a process pool (pdfplumber is CPU-bound)
+- structuring runs with at most INGEST_LLM_CONCURRENCY LLM calls in flight
+- finished policies are written with insert_many in INGEST_INSERT_BATCH_SIZE batches
+
+Every file gets a status entry, and the report ends with throughput in
+documents per minute.
+"""
+import io
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import zipfile
+import mimetypes
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from app.services.parser_service import extract_text_from_bytes, get_file_extension
+from app.services.groq_service import structure_policy
+from app.services.policy_index import build_policy_index
+from app.utils.blob_store import get_blob_store, iter_bytes
+from app.utils.policy_store import insert_policies
+from app.utils.settings import get_settings
+
+SUPPORTED_EXTENSIONS = ["pdf", "docx", "doc"]
+
+logger = logging.getLogger(__name__)
+
+
+class IngestLimitError(ValueError):
+    """Raised when an import exceeds the file count or size limits"""
+
+
+def build_policy_document(filename: str, content_type: Optional[str], blob: dict, uploader: dict,
+                          structured_data: dict, raw_text: str) -> dict:
+    """Policy document for MongoDB from an uploaded original and its structured data"""
+    policy_document = {
+        "filename": filename,
+        "content_type": content_type,
+        "blob_key": blob["key"],
+        "blob_backend": blob["backend"],
+        "file_size": blob["size"],
+        "uploaded_at": datetime.utcnow(),
+        "uploaded_by": str(uploader["_id"]),
+        "uploaded_by_name": uploader.get("name", "Admin"),
+        "title": structured_data.get("title"),
+        "summary": structured_data.get("summary"),
+        "rules": structured_data.get("rules", []),
+        "roles": structured_data.get("roles", []),
+        "clauses": structured_data.get("clauses", []),
+        "definitions": structured_data.get("definitions", []),
+        "exceptions": structured_data.get("exceptions", []),
+        "risks": structured_data.get("risks", []),
+        "policy_sections": structured_data.get("policy_sections", []),
+        "raw_text": raw_text
+    }
+    # Lexical index used by the generators to pick relevant context
+    policy_document["lexical_index"] = build_policy_index(policy_document)
+    return policy_document
+
+
+def is_supported(filename: str) -> bool:
+    return get_file_extension(filename) in SUPPORTED_EXTENSIONS
+
+
+def read_zip(data: bytes, max_files: Optional[int] = None, max_total_bytes: Optional[int] = None) -> List[Tuple[str, bytes]]:
+    """
+    Supported documents inside a zip archive, as (name, content) pairs
+
+    Sizes are checked against the archive's directory before anything is
+    decompressed, and reads are capped in case the directory lies.
+
+    Args:
+        max_files: Most documents to accept (default INGEST_MAX_FILES)
+        max_total_bytes: Uncompressed budget for all documents (default INGEST_MAX_TOTAL_BYTES)
+
+    Raises:
+        IngestLimitError: If the archive exceeds a limit
+    """
+    settings = get_settings()
+    max_files = settings.ingest_max_files if max_files is None else max_files
+    max_total_bytes = settings.ingest_max_total_bytes if max_total_bytes is None else max_total_bytes
+    max_file_bytes = settings.ingest_max_file_bytes
+    documents = []
+    total_bytes = 0
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                continue
+            if not is_supported(name):
+                continue
+            if len(documents) >= max_files:
+                raise IngestLimitError(f"Archive holds more than {max_files} documents")
+            if info.file_size > max_file_bytes:
+                raise IngestLimitError(f"{name} is {info.file_size} bytes uncompressed; at most {max_file_bytes} per document")
+            if total_bytes + info.file_size > max_total_bytes:
+                raise IngestLimitError(f"Documents in the archive exceed {max_total_bytes} bytes uncompressed")
+            with archive.open(info) as member:
+                content = member.read(max_file_bytes + 1)
+            if len(content) > max_file_bytes:
+                raise IngestLimitError(f"{name} is larger than {max_file_bytes} bytes uncompressed")
+            total_bytes += len(content)
+            documents.append((name, content))
+    return documents
+
+
+def collect_documents(source: str) -> List[Tuple[str, bytes]]:
+    """Supported documents in a directory (recursively) or a zip file"""
+    if os.path.isdir(source):
+        documents = []
+        for root, _, filenames in os.walk(source):
+            for filename in sorted(filenames):
+                if is_supported(filename) and not filename.startswith("."):
+                    path = os.path.join(root, filename)
+                    with open(path, "rb") as document_file:
+                        documents.append((os.path.relpath(path, source), document_file.read()))
+        return sorted(documents)
+    if zipfile.is_zipfile(source):
+        with open(source, "rb") as archive_file:
+            return read_zip(archive_file.read())
+    raise ValueError(f"{source} is neither a directory nor a zip file")
+
+
+async def discard_blob(blob_store, blob: Optional[dict]):
+    """Remove an original stored by a failed upload or import (only if it created it)"""
+    if not blob or not blob.get("created"):
+        return
+    try:
+        await blob_store.delete(blob["key"])
+    except Exception as e:
+        logger.warning("Failed to remove stored original %s: %s", blob["key"], e)
+
+
+async def ingest_documents(db, documents: List[Tuple[str, bytes]], uploader: dict,
+                           extract_workers: Optional[int] = None, llm_concurrency: Optional[int] = None,
+                           on_result: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Store, extract, structure and insert many policy documents
+
+    Args:
+        documents: (filename, content) pairs
+        uploader: User document recorded as the uploader
+        extract_workers: Extraction processes (default INGEST_EXTRACT_WORKERS)
+        llm_concurrency: Structuring calls in flight (default INGEST_LLM_CONCURRENCY)
+        on_result: Called with each file's status entry as soon as it is final
+
+    Returns:
+        Report with per-file `files` entries (`status` is inserted, duplicate or
+        failed) plus totals and `docs_per_minute`
+    """
+    settings = get_settings()
+    extract_workers = extract_workers or settings.ingest_extract_workers
+    llm_concurrency = llm_concurrency or settings.ingest_llm_concurrency
+    started = time.perf_counter()
+    blob_store = await get_blob_store()
+    llm_slots = asyncio.Semaphore(llm_concurrency)
+    loop = asyncio.get_running_loop()
+
+    entries = [{"filename": filename, "status": "pending"} for filename, _ in documents]
+    file_started = [started] * len(documents)
+
+    def finish(index: int, status: str, **fields):
+        entries[index].update(status=status, seconds=round(time.perf_counter() - file_started[index], 2), **fields)
+        if on_result:
+            on_result(entries[index])
+
+    # Skip content that is already stored as a policy (or repeated within this import)
+    keys = [hashlib.sha256(data).hexdigest() for _, data in documents]
+    existing = {
+        policy["blob_key"]: str(policy["_id"])
+        async for policy in db.policies.find({"blob_key": {"$in": list(set(keys))}}, {"blob_key": 1})
+    }
+    seen = {}
+    pending = []
+    for index, key in enumerate(keys):
+        if key in existing:
+            finish(index, "duplicate", policy_id=existing[key])
+        elif key in seen:
+            finish(index, "duplicate", duplicate_of=documents[seen[key]][0])
+        else:
+            seen[key] = index
+            pending.append(index)
+
+    async def prepare(pool, index: int):
+        """Blob, text and structure of one file; returns (index, document, blob) or None"""
+        filename, data = documents[index]
+        file_started[index] = time.perf_counter()
+        blob = None
+        stage = "store"
+        try:
+            content_type = mimetypes.guess_type(filename)[0]
+            blob = await blob_store.put(iter_bytes(data), filename=filename, content_type=content_type or "")
+            stage = "extract"
+            raw_text = await loop.run_in_executor(pool, extract_text_from_bytes, data, filename)
+            stage = "structure"
+            async with llm_slots:
+                structured_data = await structure_policy(raw_text)
+            document = build_policy_document(os.path.basename(filename), content_type, blob, uploader,
+                                              structured_data, raw_text)
+            return index, document, blob
+        except Exception as e:
+            await discard_blob(blob_store, blob)
+            finish(index, "failed", stage=stage, error=str(e)[:300])
+            return None
+
+    async def insert_batch(batch: list):
+        try:
+            inserted_ids = await insert_policies(db, [document for _, document, _ in batch])
+        except Exception as e:
+            inserted_ids = [None] * len(batch)
+            logger.warning("Bulk insert of %d policies failed: %s", len(batch), e)
+        for (index, _, blob), inserted_id in zip(batch, inserted_ids):
+            if inserted_id is None:
+                await discard_blob(blob_store, blob)
+                finish(index, "failed", stage="insert", error="Failed to save policy to MongoDB")
+            else:
+                finish(index, "inserted", policy_id=str(inserted_id))
+
+    # spawn: forking a process that already runs driver threads is unsafe
+    pool = ProcessPoolExecutor(max_workers=extract_workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        batch = []
+        for prepared in asyncio.as_completed([prepare(pool, index) for index in pending]):
+            result = await prepared
+            if result is None:
+                continue
+            batch.append(result)
+            if len(batch) >= settings.ingest_insert_batch_size:
+                await insert_batch(batch)
+                batch = []
+        if batch:
+            await insert_batch(batch)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    counts = {status: sum(1 for entry in entries if entry["status"] == status)
+              for status in ("inserted", "duplicate", "failed")}
+    logger.info("Bulk ingestion: %d inserted, %d duplicates, %d failed in %.1fs",
+                counts["inserted"], counts["duplicate"], counts["failed"], elapsed)
+    return {
+        "total": len(documents),
+        **counts,
+        "elapsed_seconds": round(elapsed, 2),
+        "docs_per_minute": round(counts["inserted"] / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "extract_workers": extract_workers,
+        "llm_concurrency": llm_concurrency,
+        "files": entries
+    }
@@ -0,0 +1,233 @@
+"""
+Incremental re-structuring of revised policies
+
+A revised document is compared with the stored text paragraph by paragraph.
+Only the changed paragraphs are sent to `structure_policy`; items extracted
+from unchanged paragraphs are kept as they are, items that came from removed
+or rewritten paragraphs are dropped, and the items extracted from the changed
+text are merged in. A revision that rewrites most of the document is simply
+re-structured in full.
+
+PDF text has no blank lines between paragraphs (pdfplumber returns each page
+as wrapped lines), so blocks of wrapped lines are split into paragraphs where a
+line falls short of the block's width or the next line starts a list item.
+
+Items are matched to paragraphs by token coverage (the share of an item's
+words found in a paragraph), since the LLM paraphrases rather than quotes.
+"""
+import re
+import json
+import asyncio
+import difflib
+from datetime import datetime
+from typing import Dict, List, Set
+from app.services.groq_service import structure_policy
+from app.services.policy_index import tokenize
+
+LIST_FIELDS = ["rules", "roles", "clauses", "definitions", "exceptions", "risks", "policy_sections"]
+# Above this share of changed text the whole document is re-structured
+FULL_RESTRUCTURE_RATIO = 0.5
+# Share of an item's tokens a paragraph must contain for the item to come from it
+ITEM_MATCH_THRESHOLD = 0.6
+# Share of a removed rule's tokens a generated game must contain to be invalidated
+GAME_MATCH_THRESHOLD = 0.8
+# Changed text is sent to structure_policy in chunks of about this size
+RESTRUCTURE_CHUNK_CHARS = 12000
+# A wrapped line shorter than this share of the block's longest line ends a paragraph
+PARAGRAPH_END_LINE_RATIO = 0.75
+# Bullets, numbered clauses (1. / 2.3) / 4)) and lettered items ((a) / b) / (iv)) start a paragraph
+LIST_ITEM_START = re.compile(r"^(?:[•▪◦●*\-–]\s|\d+(?:\.\d+)*[.)]\s|\(?[a-z]\)\s|\([ivx]+\)\s)", re.IGNORECASE)
+
+# Generated content per collection whose text is checked against removed rules
+GAME_COLLECTIONS = {
+    "game_sessions": ["scenario", "violation_scenario"],
+    "escape_rooms": ["rooms"],
+    "falling_ball_games": ["questions"],
+}
+
+
+def _split_wrapped_lines(block: str) -> List[str]:
+    """Paragraphs of a block of wrapped lines (a PDF page)"""
+    lines = [line.strip() for line in block.split("\n") if line.strip()]
+    if len(lines) < 2:
+        return lines
+    full_width = max(len(line) for line in lines)
+    paragraphs = [[lines[0]]]
+    for previous, line in zip(lines, lines[1:]):
+        if len(previous) < full_width * PARAGRAPH_END_LINE_RATIO or LIST_ITEM_START.match(line):
+            paragraphs.append([line])
+        else:
+            paragraphs[-1].append(line)
+    return ["\n".join(paragraph) for paragraph in paragraphs]
+
+
+def split_paragraphs(text: str) -> List[str]:
+    return [
+        paragraph
+        for block in re.split(r"\n\s*\n", text or "")
+        for paragraph in _split_wrapped_lines(block)
+    ]
+
+
+def _paragraph_key(paragraph: str) -> str:
+    # Re-extraction can reflow whitespace without changing the content
+    return " ".join(paragraph.split()).lower()
+
+
+def _coverage(item_tokens: Set[str], text_tokens: Set[str]) -> float:
+    return len(item_tokens & text_tokens) / len(item_tokens) if item_tokens else 0.0
+
+
+def _item_key(item) -> str:
+    return " ".join(str(item).split()).lower()
+
+
+def diff_paragraphs(old_text: str, new_text: str) -> dict:
+    """
+    Paragraph-level diff of two texts
+
+    Returns:
+        dict with `unchanged` and `removed` old paragraphs, the changed new text
+        grouped into contiguous `sections`, and `changed_chars`
+    """
+    old_paragraphs = split_paragraphs(old_text)
+    new_paragraphs = split_paragraphs(new_text)
+    matcher = difflib.SequenceMatcher(
+        None,
+        [_paragraph_key(paragraph) for paragraph in old_paragraphs],
+        [_paragraph_key(paragraph) for paragraph in new_paragraphs],
+        autojunk=False
+    )
+    unchanged, removed, sections = [], [], []
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            unchanged.extend(old_paragraphs[old_start:old_end])
+            continue
+        removed.extend(old_paragraphs[old_start:old_end])
+        if new_end > new_start:
+            sections.append("\n\n".join(new_paragraphs[new_start:new_end]))
+    return {
+        "unchanged": unchanged,
+        "removed": removed,
+        "sections": sections,
+        "changed_chars": sum(len(section) for section in sections) + sum(len(paragraph) for paragraph in removed)
+    }
+
+
+def _chunk_sections(sections: List[str]) -> List[str]:
+    chunks = []
+    current = ""
+    for section in sections:
+        if current and len(current) + len(section) > RESTRUCTURE_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{section}" if current else section
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _keep_item(item, unchanged_tokens: List[Set[str]], removed_tokens: List[Set[str]]) -> bool:
+    """An item is dropped only if it clearly came from a removed paragraph and from no unchanged one"""
+    tokens = set(tokenize(str(item)))
+    if not tokens:
+        return True
+    if any(_coverage(tokens, paragraph) >= ITEM_MATCH_THRESHOLD for paragraph in unchanged_tokens):
+        return True
+    return not any(_coverage(tokens, paragraph) >= ITEM_MATCH_THRESHOLD for paragraph in removed_tokens)
+
+
+async def revise_structure(policy: dict, old_text: str, new_text: str) -> dict:
+    """
+    Structure a revised policy, re-running the LLM only on changed sections
+
+    Args:
+        policy: Stored policy with its list fields, title and summary
+        old_text: Stored raw text
+        new_text: Text extracted from the revised document
+
+    Returns:
+        dict with `mode` (unchanged, incremental or full), the merged
+        `structured` data, per-field `added` and `removed` items and the size
+        of the text that was re-structured
+    """
+    diff = diff_paragraphs(old_text, new_text)
+    total_chars = max(1, len(new_text))
+
+    if not diff["sections"] and not diff["removed"]:
+        mode = "unchanged"
+        structured = {field: list(policy.get(field) or []) for field in LIST_FIELDS}
+        structured.update(title=policy.get("title"), summary=policy.get("summary"))
+        restructured_chars = 0
+    elif not old_text or diff["changed_chars"] / total_chars > FULL_RESTRUCTURE_RATIO:
+        mode = "full"
+        structured = await structure_policy(new_text)
+        restructured_chars = len(new_text)
+    else:
+        mode = "incremental"
+        unchanged_tokens = [set(tokenize(paragraph)) for paragraph in diff["unchanged"]]
+        removed_tokens = [set(tokenize(paragraph)) for paragraph in diff["removed"]]
+        chunks = _chunk_sections(diff["sections"])
+        partials = await asyncio.gather(*[structure_policy(chunk) for chunk in chunks])
+
+        structured = {"title": policy.get("title"), "summary": policy.get("summary")}
+        for field in LIST_FIELDS:
+            merged = [item for item in policy.get(field) or [] if _keep_item(item, unchanged_tokens, removed_tokens)]
+            seen = {_item_key(item) for item in merged}
+            for partial in partials:
+                for item in partial.get(field) or []:
+                    if _item_key(item) not in seen:
+                        seen.add(_item_key(item))
+                        merged.append(item)
+            structured[field] = merged
+        restructured_chars = sum(len(chunk) for chunk in chunks)
+
+    added, removed = {}, {}
+    for field in LIST_FIELDS:
+        old_keys = {_item_key(item) for item in policy.get(field) or []}
+        new_keys = {_item_key(item) for item in structured.get(field) or []}
+        added[field] = [item for item in structured.get(field) or [] if _item_key(item) not in old_keys]
+        removed[field] = [item for item in policy.get(field) or [] if _item_key(item) not in new_keys]
+
+    return {
+        "mode": mode,
+        "structured": structured,
+        "added": added,
+        "removed": removed,
+        "changed_sections": len(diff["sections"]),
+        "restructured_chars": restructured_chars,
+        "total_chars": len(new_text)
+    }
+
+
+async def invalidate_games(db, policy_id: str, removed_rules: List[str]) -> Dict[str, int]:
+    """
+    Mark generated games built from rules that no longer exist as stale
+
+    Stale games are skipped by the generation caches (so they are regenerated
+    on next request) but stay readable for attempts that are already running.
+
+    Returns:
+        Number of games invalidated per collection
+    """
+    rule_tokens = [tokens for tokens in (set(tokenize(str(rule))) for rule in removed_rules) if tokens]
+    invalidated = {collection_name: 0 for collection_name in GAME_COLLECTIONS}
+    if not rule_tokens:
+        return invalidated
+
+    for collection_name, fields in GAME_COLLECTIONS.items():
+        stale_ids = []
+        async for game in db[collection_name].find(
+            {"policy_id": policy_id, "stale": {"$ne": True}},
+            {field: 1 for field in fields}
+        ):
+            game_tokens = set(tokenize(json.dumps([game.get(field) for field in fields], default=str)))
+            if any(_coverage(tokens, game_tokens) >= GAME_MATCH_THRESHOLD for tokens in rule_tokens):
+                stale_ids.append(game["_id"])
+        if stale_ids:
+            result = await db[collection_name].update_many(
+                {"_id": {"$in": stale_ids}},
+                {"$set": {"stale": True, "invalidated_at": datetime.utcnow()}}
+            )
+            invalidated[collection_name] = result.modified_count
+    return invalidated
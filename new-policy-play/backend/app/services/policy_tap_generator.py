@@ -1,29 +1,32 @@
-import os
 import json
-from groq import Groq
-from dotenv import load_dotenv
-from typing import List, Dict
+import random
+import logging
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from app.models.policy_tap_model import FallingBallQuestion
+from app.services import fallback_generator
+from app.services.llm_service import chat_json, chat_stream
+from app.services.llm_telemetry import record_parse_failure, record_fallback
+from app.services.prompt_builder import PromptBuilder, prompt_budget
+from app.services.policy_index import rank_items, relevant_text_chunks
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY environment variable is required. Please set it in your .env file or environment.")
-MODEL_NAME = "llama-3.3-70b-versatile"
+SYSTEM_PROMPT = "You are an expert at creating educational policy compliance questions. Always return valid JSON objects with a 'questions' array. Each question must be directly based on the provided policy content."
 
-groq_client = Groq(api_key=GROQ_API_KEY)
 
-
-async def generate_falling_ball_questions(policy_data: dict, level: str, num_questions: int = 10) -> List[FallingBallQuestion]:
-    """Generate questions for falling balls game using Groq API"""
-    
-    # Normalize policy data structure
+def _normalize_policy(policy_data: dict) -> dict:
+    """Policies may nest their content under structuredData"""
     if "structuredData" in policy_data and isinstance(policy_data.get("structuredData"), dict):
-        actual_policy_data = policy_data.get("structuredData", {})
-    else:
-        actual_policy_data = policy_data
-    
+        return policy_data.get("structuredData", {})
+    return policy_data
+
+
+def _num_wrong_options(level: str) -> int:
+    return 2 if level == "beginner" else 3 if level == "intermediate" else 4
+
+
+def _build_prompt(actual_policy_data: dict, level: str, num_questions: int) -> Tuple[str, PromptBuilder]:
+    """Question generation prompt with the policy context packed into the call's token budget"""
     # Extract comprehensive policy content
     policy_title = actual_policy_data.get("title", "Policy Document")
     policy_summary = actual_policy_data.get("summary", "")
@@ -32,40 +35,29 @@ async def generate_falling_ball_questions(policy_data: dict, level: str, num_que
     exceptions = actual_policy_data.get("exceptions", []) or []
     clauses = actual_policy_data.get("clauses", []) or []
     policy_sections = actual_policy_data.get("policy_sections", []) or []
-    risks = actual_policy_data.get("risks", []) or []
     raw_text = actual_policy_data.get("raw_text", "")
     
-    # Determine number of wrong options based on level
-    num_wrong_options = 2 if level == "beginner" else 3 if level == "intermediate" else 4
-    
-    # Build comprehensive policy context
-    policy_context = f"""Policy Title: {policy_title}
-
-Policy Summary: {policy_summary[:500] if policy_summary else "N/A"}
-
-Policy Rules ({len(rules)} total):
-{json.dumps(rules[:20], indent=2, ensure_ascii=False) if rules else "No rules available"}
-
-Policy Definitions ({len(definitions)} total):
-{json.dumps(definitions[:15], indent=2, ensure_ascii=False) if definitions else "No definitions available"}
-
-Policy Clauses ({len(clauses)} total):
-{json.dumps(clauses[:15], indent=2, ensure_ascii=False) if clauses else "No clauses available"}
-
-Policy Exceptions ({len(exceptions)} total):
-{json.dumps(exceptions[:10], indent=2, ensure_ascii=False) if exceptions else "No exceptions available"}
-
-Policy Sections ({len(policy_sections)} total):
-{json.dumps(policy_sections[:10], indent=2, ensure_ascii=False) if policy_sections else "No sections available"}
-"""
+    # Start from a random point in the rules so repeat games cover different parts of the policy,
+    # then pull the definitions, clauses, exceptions and raw text most relevant to those rules
+    if rules:
+        rules = rank_items(actual_policy_data, "rules", offset=random.randrange(len(rules)))
+    focus = " ".join(rule for rule in rules[:20] if isinstance(rule, str))
+    definitions = rank_items(actual_policy_data, "definitions", query=focus) or definitions
+    clauses = rank_items(actual_policy_data, "clauses", query=focus) or clauses
+    exceptions = rank_items(actual_policy_data, "exceptions", query=focus) or exceptions
+    raw_text = "\n\n".join(relevant_text_chunks(actual_policy_data, focus, k=3)) or raw_text
     
-    # Include raw text excerpt if available (first 2000 chars for context)
-    if raw_text:
-        policy_context += f"""
-
-Full Policy Text Excerpt (for additional context):
-{raw_text[:2000]}...
-"""
+    # Build comprehensive policy context, packed into the call's token budget by priority
+    builder = PromptBuilder(prompt_budget("policy_tap"))
+    builder.add_text("Policy Title", policy_title, priority=0)
+    builder.add_text("Policy Summary", policy_summary[:500], priority=1)
+    builder.add_list("Policy Rules", rules, priority=1, max_items=20, empty_text="No rules available")
+    builder.add_list("Policy Definitions", definitions, priority=2, max_items=15, empty_text="No definitions available")
+    builder.add_list("Policy Clauses", clauses, priority=3, max_items=15, empty_text="No clauses available")
+    builder.add_list("Policy Exceptions", exceptions, priority=2, max_items=10, empty_text="No exceptions available")
+    builder.add_list("Policy Sections", policy_sections, priority=4, max_items=10, empty_text="No sections available")
+    builder.add_text("Full Policy Text Excerpt (for additional context)", raw_text, priority=5, max_tokens=500, empty_text="Not available")
+    policy_context = builder.build()
     
     prompt = f"""You are an expert at creating educational policy compliance questions. Generate {num_questions} high-quality questions based on the following policy document.
 
@@ -95,30 +87,157 @@ Return ONLY a valid JSON object with this exact structure:
 }}
 
 Generate exactly {num_questions} questions. Make sure each question is unique and directly relates to the policy content provided."""
+    return prompt, builder
+
+
+def _parse_question(q_data: dict, num_wrong_options: int, idx: int) -> Optional[FallingBallQuestion]:
+    """Validate one question object from the LLM; returns None if it is unusable"""
+    try:
+        # Extract question data with multiple possible field names
+        question_text = q_data.get("question", q_data.get("questionText", ""))
+        correct_answer = q_data.get("correct", q_data.get("correctAnswer", q_data.get("correct_option", "")))
+        wrong_opts = q_data.get("wrongOptions", q_data.get("wrong_options", q_data.get("wrongOptions", [])))
+        
+        # Ensure wrong_options is a list
+        if not isinstance(wrong_opts, list):
+            wrong_opts = []
+        
+        # Validate required fields
+        if not question_text or not correct_answer:
+            logger.debug("Skipping question %d: missing question or correct answer", idx + 1)
+            return None
+        
+        # Ensure we have enough wrong options
+        while len(wrong_opts) < num_wrong_options:
+            wrong_opts.append(f"Wrong option {len(wrong_opts) + 1}")
+        
+        question = FallingBallQuestion(
+            question=question_text.strip(),
+            correct=correct_answer.strip(),
+            wrong_options=wrong_opts[:num_wrong_options]
+        )
+        
+        # Additional validation
+        if len(question.question) < 10:
+            logger.debug("Skipping question %d: question too short", idx + 1)
+            return None
+        
+        if len(question.correct) < 3:
+            logger.debug("Skipping question %d: correct answer too short", idx + 1)
+            return None
+        
+        return question
+    
+    except Exception as e:
+        logger.debug("Error parsing question %d: %s", idx + 1, e, exc_info=True)
+        return None
+
+
+class QuestionStreamParser:
+    """
+    Incremental parser for a streamed `{"questions": [{...}, {...}]}` response
 
+    Feed it text deltas as they arrive; every time an object directly inside the
+    first JSON array closes, it is decoded and returned. Braces inside strings
+    are ignored, so question text may contain any characters. Objects that do
+    not decode are skipped and counted in `malformed`.
+    """
+    
+    def __init__(self):
+        self.malformed = 0
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._array_depth = None
+        self._object_start = None
+        self._in_string = False
+        self._escaped = False
+    
+    def feed(self, text: str) -> List[dict]:
+        """Consume more response text and return the question objects completed by it"""
+        self._buffer += text
+        completed = []
+        while self._position < len(self._buffer):
+            char = self._buffer[self._position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif char == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._object_start = self._position
+            elif char in "}]":
+                if char == "}" and self._object_start is not None and self._depth == (self._array_depth or 0) + 1:
+                    try:
+                        completed.append(json.loads(self._buffer[self._object_start:self._position + 1]))
+                    except json.JSONDecodeError as e:
+                        self.malformed += 1
+                        logger.debug("Skipping malformed streamed question: %s", e)
+                    self._object_start = None
+                self._depth -= 1
+            self._position += 1
+        
+        # Drop text that can no longer be part of an object still being read
+        keep_from = self._object_start if self._object_start is not None else self._position
+        self._buffer = self._buffer[keep_from:]
+        self._position -= keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return completed
+
+
+async def generate_falling_ball_questions(policy_data: dict, level: str, num_questions: int = 10, instant: bool = False) -> List[FallingBallQuestion]:
+    """Generate questions for falling balls game using Groq API
+
+    With `instant=True` the questions are built by the local fallback generator
+    only, without calling Groq.
+    """
+    
+    # Normalize policy data structure
+    actual_policy_data = _normalize_policy(policy_data)
+    policy_title = actual_policy_data.get("title", "Policy Document")
+    
+    # Determine number of wrong options based on level
+    num_wrong_options = _num_wrong_options(level)
+    
+    if instant:
+        return _create_fallback_questions(actual_policy_data, level, num_questions, num_wrong_options)
+    
+    prompt, builder = _build_prompt(actual_policy_data, level, num_questions)
+    
     try:
-        print(f"Generating {num_questions} questions for policy: {policy_title} (Level: {level})")
-        print(f"Policy has {len(rules)} rules, {len(definitions)} definitions, {len(clauses)} clauses")
+        logger.debug("Generating %d questions for policy: %s (level %s)", num_questions, policy_title, level, extra={
+            "rules": len(actual_policy_data.get("rules") or []),
+            "definitions": len(actual_policy_data.get("definitions") or []),
+            "clauses": len(actual_policy_data.get("clauses") or []),
+            "context": builder.summary()
+        })
         
-        chat_completion = groq_client.chat.completions.create(
+        response_text = await chat_json(
             messages=[
                 {
                     "role": "system",
-                    "content": "You are an expert at creating educational policy compliance questions. Always return valid JSON objects with a 'questions' array. Each question must be directly based on the provided policy content."
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": prompt
                 }
             ],
-            model=MODEL_NAME,
+            call_site="policy_tap",
+            level=level,
             temperature=0.7,
-            max_tokens=4000,
-            response_format={"type": "json_object"}
+            max_tokens=4000
         )
-        
-        response_text = chat_completion.choices[0].message.content
-        print(f"Groq API response received: {len(response_text)} characters")
+        logger.debug("Groq API response received: %d characters", len(response_text))
         
         data = json.loads(response_text)
         
@@ -136,95 +255,118 @@ Generate exactly {num_questions} questions. Make sure each question is unique an
         # Validate and convert to FallingBallQuestion objects
         questions = []
         for idx, q_data in enumerate(questions_data[:num_questions]):
-            try:
-                # Extract question data with multiple possible field names
-                question_text = q_data.get("question", q_data.get("questionText", ""))
-                correct_answer = q_data.get("correct", q_data.get("correctAnswer", q_data.get("correct_option", "")))
-                wrong_opts = q_data.get("wrongOptions", q_data.get("wrong_options", q_data.get("wrongOptions", [])))
-                
-                # Ensure wrong_options is a list
-                if not isinstance(wrong_opts, list):
-                    wrong_opts = []
-                
-                # Validate required fields
-                if not question_text or not correct_answer:
-                    print(f"Skipping question {idx + 1}: Missing question or correct answer")
-                    continue
-                
-                # Ensure we have enough wrong options
-                while len(wrong_opts) < num_wrong_options:
-                    wrong_opts.append(f"Wrong option {len(wrong_opts) + 1}")
-                
-                question = FallingBallQuestion(
-                    question=question_text.strip(),
-                    correct=correct_answer.strip(),
-                    wrong_options=wrong_opts[:num_wrong_options]
-                )
-                
-                # Additional validation
-                if len(question.question) < 10:
-                    print(f"Skipping question {idx + 1}: Question too short")
-                    continue
-                
-                if len(question.correct) < 3:
-                    print(f"Skipping question {idx + 1}: Correct answer too short")
-                    continue
-                
+            question = _parse_question(q_data, num_wrong_options, idx)
+            if question is not None:
                 questions.append(question)
-                print(f"✓ Question {len(questions)}: {question.question[:50]}...")
-                
-            except Exception as e:
-                print(f"Error parsing question {idx + 1}: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
+                logger.debug("Question %d: %.50s", len(questions), question.question)
         
         if len(questions) < num_questions:
-            print(f"⚠ Warning: Only generated {len(questions)} valid questions, expected {num_questions}")
-            
-            # Try to create better fallback questions using actual policy content
-            if rules:
-                while len(questions) < num_questions:
-                    rule_idx = len(questions) % len(rules)
-                    rule = rules[rule_idx] if rule_idx < len(rules) else "policy compliance"
-                    questions.append(FallingBallQuestion(
-                        question=f"According to the {policy_title}, which statement is correct about: {rule[:100]}?",
-                        correct=f"Correct answer based on {policy_title}",
-                        wrong_options=[f"Incorrect option {i+1} about {rule[:50]}" for i in range(num_wrong_options)]
-                    ))
-            else:
-                # Generic fallback if no rules available
-                while len(questions) < num_questions:
-                    questions.append(FallingBallQuestion(
-                        question=f"Question {len(questions) + 1} about {policy_title}",
-                        correct=f"Correct answer for {policy_title}",
-                        wrong_options=[f"Wrong answer {i+1}" for i in range(num_wrong_options)]
-                    ))
-        
-        print(f"✅ Successfully generated {len(questions)} Policy Tap questions for {policy_title}")
-        return questions[:num_questions]
+            logger.warning("Only generated %d valid questions, expected %d", len(questions), num_questions,
+                           extra={"level": level})
+            record_fallback("policy_tap", level, "top_up")
+            questions.extend(_top_up_questions(actual_policy_data, level, num_questions, num_wrong_options, questions))
         
+        logger.info("Generated %d Policy Tap questions for %s", len(questions), policy_title,
+                    extra={"level": level})
+        return questions[:num_questions]
+    
     except json.JSONDecodeError as e:
-        print(f"JSON decode error in falling balls generator: {e}")
+        logger.warning("JSON decode error in falling balls generator: %s", e)
         if 'response_text' in locals():
-            print(f"Response was: {response_text[:500]}")
+            logger.debug("Response was: %.500s", response_text)
+        record_parse_failure("policy_tap", level)
+        record_fallback("policy_tap", level, "parse_failure")
         # Return fallback questions
-        return _create_fallback_questions(policy_title, num_questions, num_wrong_options)
-    except Exception as e:
-        print(f"Error generating falling ball questions: {e}")
-        import traceback
-        traceback.print_exc()
-        return _create_fallback_questions(policy_title, num_questions, num_wrong_options)
+        return _create_fallback_questions(actual_policy_data, level, num_questions, num_wrong_options)
+    except Exception:
+        logger.exception("Error generating falling ball questions")
+        record_fallback("policy_tap", level, "llm_error")
+        return _create_fallback_questions(actual_policy_data, level, num_questions, num_wrong_options)
+
 
+async def stream_falling_ball_questions(policy_data: dict, level: str, num_questions: int = 10, instant: bool = False) -> AsyncIterator[FallingBallQuestion]:
+    """Yield Policy Tap questions one by one as soon as each has been generated
 
-def _create_fallback_questions(policy_title: str, num_questions: int, num_wrong_options: int) -> List[FallingBallQuestion]:
-    """Create fallback questions if Groq fails"""
+    The completion is streamed and its `questions` array parsed incrementally,
+    so the first question is available after a fraction of the full generation
+    time. If the stream fails or ends short, the remaining questions come from
+    the local generator, so callers always receive `num_questions` questions.
+    """
+    actual_policy_data = _normalize_policy(policy_data)
+    policy_title = actual_policy_data.get("title", "Policy Document")
+    num_wrong_options = _num_wrong_options(level)
     questions = []
-    for i in range(num_questions):
+    
+    if not instant:
+        prompt, builder = _build_prompt(actual_policy_data, level, num_questions)
+        logger.debug("Streaming %d questions for policy: %s (level %s), context %s",
+                     num_questions, policy_title, level, builder.summary())
+        
+        parser = QuestionStreamParser()
+        parsed = 0
+        try:
+            stream = chat_stream(
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                call_site="policy_tap",
+                level=level,
+                temperature=0.7,
+                max_tokens=4000
+            )
+            async for delta in stream:
+                for q_data in parser.feed(delta):
+                    question = _parse_question(q_data, num_wrong_options, parsed)
+                    parsed += 1
+                    if question is None or any(q.question == question.question for q in questions):
+                        continue
+                    questions.append(question)
+                    logger.debug("Streamed question %d: %.50s", len(questions), question.question)
+                    yield question
+                    if len(questions) >= num_questions:
+                        break
+                if len(questions) >= num_questions:
+                    await stream.aclose()
+                    break
+        except Exception as e:
+            logger.warning("Error streaming falling ball questions: %s", e)
+        
+        if parser.malformed:
+            # Counted like a chat_json response that did not parse, once per response
+            record_parse_failure("policy_tap", level)
+            logger.info("Skipped %d malformed streamed questions for policy: %s", parser.malformed, policy_title)
+        if len(questions) < num_questions:
+            logger.warning("Only streamed %d valid questions, expected %d", len(questions), num_questions)
+            record_fallback("policy_tap", level, "top_up")
+    
+    for question in _top_up_questions(actual_policy_data, level, num_questions, num_wrong_options, questions):
+        yield question
+
+
+def _top_up_questions(policy_data: dict, level: str, num_questions: int, num_wrong_options: int,
+                      questions: List[FallingBallQuestion]) -> List[FallingBallQuestion]:
+    """Locally generated questions to fill `questions` up to `num_questions`, skipping repeats"""
+    asked = {q.question for q in questions}
+    extra = []
+    for fallback_question in _create_fallback_questions(policy_data, level, num_questions, num_wrong_options):
+        if len(questions) + len(extra) >= num_questions:
+            break
+        if fallback_question.question not in asked:
+            extra.append(fallback_question)
+    return extra
+
+
+def _create_fallback_questions(policy_data: dict, level: str, num_questions: int, num_wrong_options: int) -> List[FallingBallQuestion]:
+    """Create fallback questions if Groq fails, from the policy's own rules, definitions and exceptions"""
+    questions = fallback_generator.build_policy_tap_questions(policy_data, level, num_questions, num_wrong_options)
+    
+    # Generic placeholders only if the policy has too little structured content
+    policy_title = policy_data.get("title", "Policy Document")
+    for i in range(len(questions), num_questions):
         questions.append(FallingBallQuestion(
             question=f"Question {i + 1} about {policy_title}",
             correct="Correct answer option",
             wrong_options=[f"Wrong option {j + 1}" for j in range(num_wrong_options)]
         ))
     return questions
-
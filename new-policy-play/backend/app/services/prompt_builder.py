@@ -0,0 +1,146 @@
+"""
+Token-budget-aware prompt assembly
+
+Generators describe the policy context they would like to send as labelled
+sections with a priority, and the builder packs them into a per-call token
+budget. Tokens are estimated locally (no tokenizer download), JSON is
+serialized compactly, and the estimated size of each prompt is reported so
+call sites can be compared.
+"""
+import json
+import math
+from typing import Any, Dict, List, Optional
+from app.utils.settings import get_settings
+
+# Rough characters-per-token ratio for English text with the Llama 3 tokenizer
+CHARS_PER_TOKEN = 4
+
+# Default context budget (in tokens) per call site; override with PROMPT_BUDGET_<CALL_SITE>
+PROMPT_BUDGETS = {
+    "policy_tap": 2500,
+    "room1": 1000,
+    "room2": 1000,
+    "room3": 1200,
+    "room4": 800,
+    "room5": 900,
+    "scenario": 600,
+    "violation": 600,
+    "analyze": 6000,
+}
+DEFAULT_PROMPT_BUDGET = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a string without a tokenizer"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def compact_json(value: Any) -> str:
+    """Serialize to JSON without indentation or padding"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def prompt_budget(call_site: str) -> int:
+    """Token budget for the policy context of a call site"""
+    override = get_settings().prompt_budget_overrides.get(call_site)
+    if override:
+        return override
+    return PROMPT_BUDGETS.get(call_site, DEFAULT_PROMPT_BUDGET)
+
+
+class PromptBuilder:
+    """
+    Packs labelled context sections into a token budget
+
+    Sections are rendered in the order they were added, but filled by priority
+    (lower number first) in two passes: first up to each section's share
+    (`max_items` for lists, `max_tokens` for text), then with whatever budget is
+    left over, so a long high-priority section cannot starve everything after it.
+    """
+
+    def __init__(self, budget_tokens: int):
+        self.budget_tokens = budget_tokens
+        self.used_tokens = 0
+        self._sections: List[Dict] = []
+
+    def add_text(self, label: str, text: Optional[str], priority: int = 0, max_tokens: Optional[int] = None,
+                 empty_text: str = "N/A"):
+        """Add a free-text section; it is truncated at a word boundary if it does not fit"""
+        self._sections.append({
+            "kind": "text", "label": label, "text": (text or "").strip(), "priority": priority,
+            "max_tokens": max_tokens, "empty_text": empty_text, "included": "", "tokens": 0
+        })
+        return self
+
+    def add_list(self, label: str, items: Optional[List], priority: int = 0, max_items: Optional[int] = None,
+                 empty_text: str = "None available"):
+        """Add a list section; whole items are included in order while they fit"""
+        self._sections.append({
+            "kind": "list", "label": label, "items": list(items or []),
+            "priority": priority, "max_items": max_items, "empty_text": empty_text, "included": []
+        })
+        return self
+
+    def _fill_list(self, section: Dict, limit: Optional[int]):
+        items = section["items"]
+        included = section["included"]
+        while len(included) < len(items) and (limit is None or len(included) < limit):
+            cost = estimate_tokens(compact_json(items[len(included)])) + 1
+            if self.used_tokens + cost > self.budget_tokens:
+                return
+            included.append(items[len(included)])
+            self.used_tokens += cost
+
+    def _fill_text(self, section: Dict, limit: Optional[int]):
+        text = section["text"]
+        available = self.budget_tokens - self.used_tokens + section["tokens"]
+        if limit is not None:
+            available = min(available, limit)
+        max_chars = available * CHARS_PER_TOKEN
+        if max_chars <= len(section["included"]) or not text:
+            return
+        if len(text) > max_chars:
+            text = text[:max_chars].rsplit(" ", 1)[0] + "..."
+        tokens = estimate_tokens(text)
+        self.used_tokens += tokens - section["tokens"]
+        section["included"] = text
+        section["tokens"] = tokens
+
+    def build(self) -> str:
+        """Fill sections by priority and render them in insertion order"""
+        self.used_tokens = sum(estimate_tokens(f"{section['label']}:\n") for section in self._sections)
+        by_priority = sorted(self._sections, key=lambda section: section["priority"])
+
+        for section in by_priority:
+            if section["kind"] == "text":
+                self._fill_text(section, section["max_tokens"])
+            else:
+                self._fill_list(section, section["max_items"])
+        for section in by_priority:
+            if section["kind"] == "text":
+                self._fill_text(section, None)
+            else:
+                self._fill_list(section, None)
+
+        parts = []
+        for section in self._sections:
+            if section["kind"] == "text":
+                parts.append(f"{section['label']}: {section['included'] or section['empty_text']}")
+            elif section["included"]:
+                parts.append(
+                    f"{section['label']} ({len(section['included'])} of {len(section['items'])}):\n"
+                    f"{compact_json(section['included'])}"
+                )
+            else:
+                parts.append(f"{section['label']}: {section['empty_text']}")
+        return "\n\n".join(parts)
+
+    def summary(self) -> str:
+        """Short description of what was packed, for logging"""
+        counts = []
+        for section in self._sections:
+            if section["kind"] == "list":
+                counts.append(f"{section['label']} {len(section['included'])}/{len(section['items'])}")
+        return f"~{self.used_tokens}/{self.budget_tokens} tokens" + (f" ({', '.join(counts)})" if counts else "")
@@ -0,0 +1,244 @@
+"""
+In-progress attempt store
+
+Live escape room and Policy Tap attempts are kept in process memory while a
+game is running. Answers mutate the cached document and only mark the changed
+fields dirty; a background task checkpoints dirty attempts to MongoDB in one
+bulk write every ATTEMPT_FLUSH_INTERVAL_SECONDS, and `finish` writes the final
+state synchronously. After a restart, attempts are lazily reloaded from their
+last checkpoint the next time they are touched.
+
+With ATTEMPT_STORE_BACKEND=mongo nothing is cached: every load reads Mongo and
+every update is written through, which is required when several worker
+processes serve the same players (the launcher selects it for multi-worker mode).
+"""
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set
+from bson import ObjectId
+from pymongo import UpdateOne
+from app.utils.db import get_database
+from app.utils.retention import abandon_deadline
+from app.utils.settings import get_settings
+
+# Seconds between write-behind checkpoints of dirty attempts
+ATTEMPT_FLUSH_INTERVAL_SECONDS = get_settings().attempt_flush_interval_seconds
+# Attempts not touched for this long are checkpointed and dropped from memory
+ATTEMPT_IDLE_EVICT_SECONDS = get_settings().attempt_idle_evict_seconds
+# "memory" = write-behind (default), "mongo" = write every mutation through immediately
+ATTEMPT_STORE_BACKEND = get_settings().attempt_store_backend
+
+logger = logging.getLogger(__name__)
+
+
+class AttemptStore:
+    """Write-behind cache for the attempt documents of one collection"""
+
+    def __init__(self, collection_name: str, write_behind: bool = True):
+        self.collection_name = collection_name
+        self.write_behind = write_behind
+        self._attempts: Dict[str, dict] = {}
+        self._dirty: Dict[str, Set[str]] = {}
+        # Dirty fields taken by a flush whose bulk write has not completed yet
+        self._flushing: Dict[str, Set[str]] = {}
+        self._last_access: Dict[str, float] = {}
+        # Locks of attempts someone is holding or waiting for, with the number of such callers
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+
+    def _collection(self, db):
+        return db[self.collection_name]
+
+    @asynccontextmanager
+    async def lock(self, attempt_id: str):
+        """
+        Per-attempt lock so concurrent submits cannot interleave read-modify-write
+
+        The lock is dropped when its last holder or waiter leaves, so ids that
+        turn out to be unknown, foreign or finished leave nothing behind.
+        """
+        lock = self._locks.get(attempt_id)
+        if lock is None:
+            lock = self._locks[attempt_id] = asyncio.Lock()
+        self._lock_users[attempt_id] = self._lock_users.get(attempt_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users = self._lock_users.pop(attempt_id) - 1
+            if users:
+                self._lock_users[attempt_id] = users
+            else:
+                self._locks.pop(attempt_id, None)
+
+    async def create(self, db, attempt_doc: dict) -> str:
+        """Insert a new attempt durably and keep it cached for gameplay"""
+        # Attempts that are never finished expire through the TTL index
+        attempt_doc.setdefault("expire_at", abandon_deadline())
+        result = await self._collection(db).insert_one(attempt_doc)
+        attempt_id = str(result.inserted_id)
+        if self.write_behind:
+            self._attempts[attempt_id] = attempt_doc
+            self._last_access[attempt_id] = time.monotonic()
+        return attempt_id
+
+    async def load(self, db, attempt_id: str, user_id: str) -> Optional[dict]:
+        """Return the live attempt for a user, recovering it from Mongo if not cached"""
+        attempt = self._attempts.get(attempt_id)
+        if attempt is None:
+            attempt = await self._collection(db).find_one({
+                "_id": ObjectId(attempt_id),
+                "user_id": user_id
+            })
+            if attempt is None:
+                return None
+            if attempt.get("completed_at") or not self.write_behind:
+                # Finished attempts are read-only, and write-through mode never caches
+                return attempt
+            attempt = self._attempts.setdefault(attempt_id, attempt)
+
+        if attempt.get("user_id") != user_id:
+            return None
+
+        self._last_access[attempt_id] = time.monotonic()
+        return attempt
+
+    async def update(self, db, attempt_id: str, fields: dict):
+        """Apply a $set-style update to a cached attempt and mark it dirty"""
+        attempt = self._attempts.get(attempt_id)
+        if attempt is None:
+            # Not cached (e.g. evicted between load and update) - write straight through
+            await self._collection(db).update_one({"_id": ObjectId(attempt_id)}, {"$set": fields})
+            return
+
+        attempt.update(fields)
+        self._dirty.setdefault(attempt_id, set()).update(fields.keys())
+        self._last_access[attempt_id] = time.monotonic()
+
+        if not self.write_behind:
+            await self.checkpoint(db, attempt_id)
+
+    async def finish(self, db, attempt_id: str, fields: dict) -> Optional[dict]:
+        """Write the final state of an attempt to Mongo and drop it from memory"""
+        attempt = self._attempts.get(attempt_id)
+        # Fields an in-flight flush is writing are included too, in case that flush fails
+        dirty = set(self._dirty.get(attempt_id, ())) | self._flushing.get(attempt_id, set())
+
+        update_fields = {key: attempt[key] for key in dirty} if attempt else {}
+        update_fields.update(fields)
+        try:
+            await self._collection(db).update_one(
+                {"_id": ObjectId(attempt_id)},
+                {"$set": update_fields, "$unset": {"expire_at": ""}}
+            )
+        except Exception as e:
+            # The attempt stays cached with its unflushed answers until a finish succeeds
+            logger.warning("Failed to finish attempt %s in %s: %s", attempt_id, self.collection_name, e)
+            raise
+        self._attempts.pop(attempt_id, None)
+        self._dirty.pop(attempt_id, None)
+        self._last_access.pop(attempt_id, None)
+
+        if attempt is not None:
+            attempt.update(fields)
+            attempt.pop("expire_at", None)
+        return attempt
+
+    async def checkpoint(self, db, attempt_id: str):
+        """Persist the dirty fields of a single attempt"""
+        dirty = self._dirty.pop(attempt_id, None)
+        attempt = self._attempts.get(attempt_id)
+        if not dirty or attempt is None:
+            return
+        try:
+            await self._collection(db).update_one(
+                {"_id": ObjectId(attempt_id)},
+                {"$set": {key: attempt[key] for key in dirty}}
+            )
+        except Exception:
+            # Keep the fields dirty so the next flush retries them
+            self._dirty.setdefault(attempt_id, set()).update(dirty)
+            raise
+
+    async def flush(self, db) -> int:
+        """Checkpoint every dirty attempt in one bulk write and evict idle ones"""
+        dirty, self._dirty = self._dirty, {}
+        self._flushing = dirty
+        operations = []
+        for attempt_id, keys in dirty.items():
+            attempt = self._attempts.get(attempt_id)
+            if attempt is None:
+                continue
+            operations.append(UpdateOne(
+                {"_id": ObjectId(attempt_id)},
+                {"$set": {key: attempt[key] for key in keys}}
+            ))
+
+        try:
+            if operations:
+                await self._collection(db).bulk_write(operations, ordered=False)
+        except Exception:
+            # Attempts finished meanwhile wrote these fields themselves and are no longer cached
+            for attempt_id, keys in dirty.items():
+                if attempt_id in self._attempts:
+                    self._dirty.setdefault(attempt_id, set()).update(keys)
+            raise
+        finally:
+            self._flushing = {}
+
+        # Drop attempts that have been idle too long (abandoned games); their state is checkpointed
+        cutoff = time.monotonic() - ATTEMPT_IDLE_EVICT_SECONDS
+        for attempt_id, last_access in list(self._last_access.items()):
+            if last_access < cutoff and attempt_id not in self._dirty and attempt_id not in self._locks:
+                self._attempts.pop(attempt_id, None)
+                self._last_access.pop(attempt_id, None)
+
+        return len(operations)
+
+
+write_behind = ATTEMPT_STORE_BACKEND != "mongo"
+escape_attempt_store = AttemptStore("escape_attempts", write_behind=write_behind)
+policy_tap_attempt_store = AttemptStore("falling_ball_attempts", write_behind=write_behind)
+ATTEMPT_STORES = [escape_attempt_store, policy_tap_attempt_store]
+
+_flush_task: Optional[asyncio.Task] = None
+
+
+async def flush_attempt_stores():
+    """Checkpoint all dirty attempts across stores"""
+    db = await get_database()
+    for store in ATTEMPT_STORES:
+        try:
+            flushed = await store.flush(db)
+            if flushed:
+                logger.info("Checkpointed %d live attempts to %s", flushed, store.collection_name)
+        except Exception as e:
+            logger.warning("Failed to checkpoint %s: %s", store.collection_name, e)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(ATTEMPT_FLUSH_INTERVAL_SECONDS)
+        await flush_attempt_stores()
+
+
+async def start_attempt_store():
+    """Start the periodic write-behind flush task"""
+    global _flush_task
+    if _flush_task is None and write_behind:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_attempt_store():
+    """Stop the flush task and checkpoint everything still in memory"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await flush_attempt_stores()
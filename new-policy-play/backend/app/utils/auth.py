@@ -1,4 +1,3 @@
-import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -6,9 +5,11 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.utils.db import get_database
+from app.utils.settings import get_settings
+from app.utils.request_metrics import timed_phase
 
 # JWT Configuration
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+SECRET_KEY = get_settings().secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
@@ -42,6 +43,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current authenticated user from JWT token"""
+    with timed_phase("auth"):
+        return await _authenticate(credentials)
+
+
+async def _authenticate(credentials: HTTPAuthorizationCredentials):
+    """Decode the token and load its user (timed as the request's auth phase)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -57,8 +64,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    # Get user from database
-    db = await get_database()
+    # Get user from database (primary, so a freshly signed-up user is always found)
+    db = await get_database("gameplay")
     from bson import ObjectId
     try:
         # Try to find user by ObjectId
@@ -0,0 +1,246 @@
+"""
+Blob store for uploaded policy originals
+
+Uploaded files are stored by the SHA-256 of their content, so the same file
+uploaded twice is stored once and any worker can read it back by key. Two
+backends share one interface:
+- `gridfs` (default): a GridFS bucket in the application database, so every
+  replica behind the load balancer sees the same files
+- `local`: a directory on disk, for single-instance development setups
+
+Writes and reads are streamed in BLOB_CHUNK_BYTES chunks and reads can be
+limited to a byte range.
+"""
+import os
+import uuid
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError
+from app.utils.db import get_database
+from app.utils.settings import get_settings
+
+# "gridfs" or "local"
+BLOB_STORE_BACKEND = get_settings().blob_store_backend
+BLOB_STORE_LOCAL_DIR = get_settings().blob_store_local_dir
+BLOB_GRIDFS_BUCKET = get_settings().blob_gridfs_bucket
+BLOB_CHUNK_BYTES = get_settings().blob_chunk_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class BlobNotFoundError(Exception):
+    """Raised when no blob is stored under a key"""
+
+
+async def iter_upload(upload_file) -> AsyncIterator[bytes]:
+    """Read a FastAPI UploadFile in chunks"""
+    while True:
+        chunk = await upload_file.read(BLOB_CHUNK_BYTES)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+    """Feed in-memory content to `put` in chunks"""
+    for start in range(0, len(data), BLOB_CHUNK_BYTES):
+        yield data[start:start + BLOB_CHUNK_BYTES]
+
+
+class BlobStore(ABC):
+    """Content-addressed blob store interface"""
+
+    backend = ""
+
+    @abstractmethod
+    async def put(self, chunks: AsyncIterator[bytes], filename: str = "", content_type: str = "") -> dict:
+        """
+        Store a stream of bytes and return its descriptor
+
+        Returns:
+            dict with `key` (sha256 hex), `size`, `backend` and `created`
+            (False if identical content was already stored)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Stream a blob, optionally only bytes [start, end) of it"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def size(self, key: str) -> int:
+        """Size of a stored blob in bytes"""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self.size(key)
+            return True
+        except BlobNotFoundError:
+            return False
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Remove a blob (no error if it is not stored)"""
+
+    async def read_all(self, key: str) -> bytes:
+        return b"".join([chunk async for chunk in self.read(key)])
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under `root/<first two hex chars>/<sha256>`"""
+
+    backend = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    async def put(self, chunks: AsyncIterator[bytes], filename: str = "", content_type: str = "") -> dict:
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = os.path.join(self.root, f".pending-{uuid.uuid4().hex}")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, "wb") as temp_file:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await asyncio.to_thread(temp_file.write, chunk)
+
+            key = digest.hexdigest()
+            path = self._path(key)
+            if os.path.exists(path):
+                return {"key": key, "size": size, "backend": self.backend, "created": False}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            return {"key": key, "size": size, "backend": self.backend, "created": True}
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise BlobNotFoundError(key)
+        with open(path, "rb") as blob_file:
+            blob_file.seek(start)
+            remaining = None if end is None else max(0, end - start)
+            while remaining is None or remaining > 0:
+                size = BLOB_CHUNK_BYTES if remaining is None else min(BLOB_CHUNK_BYTES, remaining)
+                chunk = await asyncio.to_thread(blob_file.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            raise BlobNotFoundError(key)
+
+    async def delete(self, key: str):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class GridFSBlobStore(BlobStore):
+    """Blobs as GridFS files whose filename is the content hash"""
+
+    backend = "gridfs"
+
+    def __init__(self, db, bucket_name: str):
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+        self.files = db[f"{bucket_name}.files"]
+
+    async def ensure_indexes(self):
+        """One file per key: a concurrent upload of the same content fails its rename"""
+        await self.files.create_index("filename", unique=True, name="unique_filename")
+
+    async def _find(self, key: str) -> Optional[dict]:
+        return await self.files.find_one({"filename": key}, {"_id": 1, "length": 1})
+
+    async def put(self, chunks: AsyncIterator[bytes], filename: str = "", content_type: str = "") -> dict:
+        # The hash is only known at the end, so upload under a pending name and rename
+        upload = self.bucket.open_upload_stream(
+            f"pending/{uuid.uuid4().hex}",
+            metadata={"original_filename": filename, "content_type": content_type}
+        )
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await upload.write(chunk)
+            await upload.close()
+        except BaseException:
+            await upload.abort()
+            raise
+
+        key = digest.hexdigest()
+        if await self._find(key) is not None:
+            await self.bucket.delete(upload._id)
+            return {"key": key, "size": size, "backend": self.backend, "created": False}
+        try:
+            await self.bucket.rename(upload._id, key)
+        except DuplicateKeyError:
+            # Another upload of the same content was renamed since the check above
+            await self.bucket.delete(upload._id)
+            return {"key": key, "size": size, "backend": self.backend, "created": False}
+        return {"key": key, "size": size, "backend": self.backend, "created": True}
+
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        file_doc = await self._find(key)
+        if file_doc is None:
+            raise BlobNotFoundError(key)
+        download = await self.bucket.open_download_stream(file_doc["_id"])
+        download.seek(start)
+        remaining = (file_doc["length"] - start) if end is None else max(0, min(end, file_doc["length"]) - start)
+        while remaining > 0:
+            chunk = await download.read(min(BLOB_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    async def size(self, key: str) -> int:
+        file_doc = await self._find(key)
+        if file_doc is None:
+            raise BlobNotFoundError(key)
+        return file_doc["length"]
+
+    async def delete(self, key: str):
+        file_doc = await self._find(key)
+        if file_doc is not None:
+            await self.bucket.delete(file_doc["_id"])
+
+
+_blob_store: Optional[BlobStore] = None
+
+
+async def get_blob_store() -> BlobStore:
+    """Blob store for the configured backend"""
+    global _blob_store
+    if _blob_store is None:
+        if BLOB_STORE_BACKEND == "local":
+            _blob_store = LocalBlobStore(BLOB_STORE_LOCAL_DIR)
+        else:
+            store = GridFSBlobStore(await get_database(), BLOB_GRIDFS_BUCKET)
+            try:
+                await store.ensure_indexes()
+            except Exception as e:
+                logger.warning("Failed to create the blob store's unique filename index: %s", e)
+            _blob_store = store
+        logger.info("Blob store: %s", _blob_store.backend)
+    return _blob_store
@@ -0,0 +1,114 @@
+"""
+Response compression
+
+`CompressionMiddleware` compresses response bodies of at least
+COMPRESSION_MINIMUM_BYTES with brotli when the client accepts it and the
+`brotli` package is installed, otherwise with gzip. Only complete bodies are
+compressed: streamed responses (generation progress over SSE/NDJSON) pass
+through untouched so every event still reaches the client when it is sent.
+Time spent compressing is the request's "compress" phase.
+"""
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+import gzip
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from app.utils.request_metrics import timed_phase
+from app.utils.settings import get_settings
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml", "image/svg+xml", "text/")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred content coding the client accepts ("br", "gzip" or None)"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    if HAS_BROTLI and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware (streaming responses are passed through as they are sent)"""
+
+    def __init__(self, app):
+        settings = get_settings()
+        self.app = app
+        self.enabled = settings.compression_enabled
+        self.minimum_bytes = settings.compression_minimum_bytes
+        self.gzip_level = settings.compression_gzip_level
+        self.brotli_quality = settings.compression_brotli_quality
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        with timed_phase("compress"):
+            if encoding == "br":
+                return brotli.compress(body, quality=self.brotli_quality)
+            # mtime=0 keeps the output identical for identical bodies
+            return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def should_compress(self, start_message: dict, body: bytes) -> bool:
+        headers = Headers(raw=start_message["headers"])
+        return (
+            len(body) >= self.minimum_bytes
+            and "content-encoding" not in headers
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "passthrough": False}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the response is streamed
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            start, body = state["start"], message.get("body", b"")
+            state["passthrough"] = True
+            if message.get("more_body", False) or not self.should_compress(start, body):
+                await send(start)
+                await send(message)
+                return
+
+            compressed = self.compress(body, encoding)
+            if len(compressed) >= len(body):
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            # The compressed body is a different representation; keep validators comparable (like nginx)
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
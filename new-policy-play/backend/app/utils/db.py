@@ -1,174 +1,129 @@
-import os
-import ssl
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 try:
     import certifi
     HAS_CERTIFI = True
 except ImportError:
     HAS_CERTIFI = False
+import logging
+from contextlib import asynccontextmanager
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.read_preferences import ReadPreference
-from dotenv import load_dotenv
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from app.utils.settings import get_settings
+from app.utils.db_metrics import create_listeners
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # MongoDB connection settings
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise ValueError("MONGO_URI environment variable is required. Please set it in your .env file or environment.")
-DATABASE_NAME = "policyplay"
+DATABASE_NAME = get_settings().database_name
 COLLECTION_NAME = "policies"
 
+# Read profiles, chosen per route:
+# - "gameplay": live game state that a player just wrote (sessions, attempts,
+#   game sets) - always read from the primary
+# - "analytics": leaderboards and admin dashboards - may be served by a
+#   secondary lagging at most MONGO_ANALYTICS_MAX_STALENESS_SECONDS, with
+#   majority read concern so causal sessions over them are consistent
+READ_PROFILES = ("gameplay", "analytics")
+
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
 # Global MongoDB client
 client: AsyncIOMotorClient = None
 database = None
 collection = None
+# Database handles per read profile
+_profile_databases = {}
+
+
+def build_client_options(settings) -> dict:
+    """Driver options for the single configured connection strategy"""
+    options = {
+        "readPreference": settings.mongo_read_preference,
+        "retryWrites": True,
+        "w": "majority",
+        "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+        "connectTimeoutMS": settings.mongo_connect_timeout_ms,
+        "socketTimeoutMS": settings.mongo_socket_timeout_ms,
+        # Pool sizing is per worker process: total connections = workers x maxPoolSize
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "maxIdleTimeMS": settings.mongo_max_idle_time_ms,
+        "waitQueueTimeoutMS": settings.mongo_wait_queue_timeout_ms,
+        "maxConnecting": settings.mongo_max_connecting,
+    }
+    if settings.mongo_monitoring:
+        options["event_listeners"] = create_listeners(settings.mongo_slow_checkout_ms)
+    if settings.mongo_tls:
+        options["tls"] = True
+        if settings.mongo_tls_allow_invalid_certificates:
+            options["tlsAllowInvalidCertificates"] = True
+        elif HAS_CERTIFI:
+            options["tlsCAFile"] = certifi.where()
+    return options
+
+
+def build_read_profile(settings, profile: str) -> dict:
+    """with_options() arguments of a read profile"""
+    if profile == "gameplay":
+        return {"read_preference": Primary(), "read_concern": ReadConcern("local")}
+    if profile == "analytics":
+        mode = _READ_PREFERENCES.get(settings.mongo_analytics_read_preference.lower(), SecondaryPreferred)
+        if mode is Primary:
+            read_preference = Primary()
+        else:
+            read_preference = mode(max_staleness=settings.mongo_analytics_max_staleness_seconds)
+        return {"read_preference": read_preference, "read_concern": ReadConcern("majority")}
+    raise ValueError(f"Unknown read profile: {profile}")
 
 
 async def connect_to_mongo():
-    """Initialize MongoDB connection"""
+    """
+    Initialize MongoDB connection
+    
+    Uses one strategy configured through the MONGO_* settings and fails fast
+    (within MONGO_SERVER_SELECTION_TIMEOUT_MS) if the cluster is unreachable.
+    """
     global client, database, collection
+    settings = get_settings()
+    if not settings.mongo_uri:
+        raise ValueError("MONGO_URI environment variable is required. Please set it in your .env file or environment.")
     
     try:
-        # MongoDB Atlas connection with proper SSL/TLS handling
-        connection_uri = MONGO_URI
-        
-        # Ensure the connection string has proper SSL parameters
-        # MongoDB Atlas requires TLS/SSL by default
-        # Note: w=majority requires primary, but we'll keep it for data consistency
-        # If primary is unavailable, writes will fail (which is expected MongoDB behavior)
-        if "retrywrites" not in connection_uri.lower():
-            separator = "&" if "?" in connection_uri else "?"
-            connection_uri = f"{connection_uri}{separator}retryWrites=true&w=majority"
-        
-        # Add TLS parameters to connection string if not present
-        if "tls=" not in connection_uri.lower():
-            separator = "&" if "?" in connection_uri or "&" in connection_uri else "?"
-            connection_uri = f"{connection_uri}{separator}tls=true"
+        logger.info("Connecting to MongoDB...")
+        client = AsyncIOMotorClient(settings.mongo_uri, **build_client_options(settings))
         
-        # Helper function to build URI with read preference
-        def build_uri_with_read_preference(base_uri, read_pref):
-            """Build URI with read preference, removing any existing readPreference"""
-            from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
-            # Parse the URI
-            parsed = urlparse(base_uri)
-            # Parse query parameters
-            params = parse_qs(parsed.query)
-            # Remove any existing readPreference (case-insensitive)
-            params = {k: v for k, v in params.items() if k.lower() != 'readpreference'}
-            # Add new read preference (parse_qs returns lists, so we need to use a list)
-            params['readPreference'] = [read_pref]
-            # Rebuild query string
-            new_query = urlencode(params, doseq=True)
-            # Rebuild URI
-            new_parsed = parsed._replace(query=new_query)
-            return urlunparse(new_parsed)
+        # ping is answered by any reachable member, so this also works on a degraded replica set
+        await client.admin.command("ping")
         
-        # Build URIs with different read preferences
-        uri_secondary_preferred = build_uri_with_read_preference(connection_uri, "secondaryPreferred")
-        uri_nearest = build_uri_with_read_preference(connection_uri, "nearest")
-        uri_primary_preferred = build_uri_with_read_preference(connection_uri, "primaryPreferred")
-        
-        connection_attempts = [
-            # Strategy 1: SecondaryPreferred - prefer secondaries (best for degraded clusters)
-            {
-                "connection_uri": uri_secondary_preferred,
-                "tls": True,
-                "tlsAllowInvalidCertificates": True,
-                "serverSelectionTimeoutMS": 60000,
-                "connectTimeoutMS": 60000,
-                "socketTimeoutMS": 60000,
-            },
-            # Strategy 2: Nearest read preference - read from nearest available server
-            {
-                "connection_uri": uri_nearest,
-                "tls": True,
-                "tlsAllowInvalidCertificates": True,
-                "serverSelectionTimeoutMS": 60000,
-                "connectTimeoutMS": 60000,
-                "socketTimeoutMS": 60000,
-            },
-            # Strategy 3: Standard connection with certifi and secondaryPreferred
-            {
-                "connection_uri": uri_secondary_preferred,
-                "tls": True,
-                "tlsAllowInvalidCertificates": False,
-                "tlsCAFile": certifi.where() if HAS_CERTIFI else None,
-                "serverSelectionTimeoutMS": 30000,
-                "connectTimeoutMS": 30000,
-                "socketTimeoutMS": 30000,
-                "retryWrites": True,
-                "maxPoolSize": 10,
-            },
-            # Strategy 4: PrimaryPreferred - fallback to primary if available
-            {
-                "connection_uri": uri_primary_preferred,
-                "tls": True,
-                "tlsAllowInvalidCertificates": True,
-                "serverSelectionTimeoutMS": 60000,
-            },
-            # Strategy 5: Minimal SSL settings with secondaryPreferred
-            {
-                "connection_uri": uri_secondary_preferred,
-                "tls": True,
-                "tlsAllowInvalidCertificates": True,
-            }
-        ]
-        
-        last_error = None
-        for i, config in enumerate(connection_attempts):
-            try:
-                print(f"🔄 Attempting MongoDB connection (strategy {i+1}/{len(connection_attempts)})...")
-                
-                # Extract connection_uri from config
-                uri = config.pop("connection_uri")
-                
-                print(f"   Using URI: {uri[:80]}...")  # Print first 80 chars for debugging
-                
-                client = AsyncIOMotorClient(uri, **config)
-                
-                # Test connection - try a simple operation that works with read preference
-                # The issue is that some operations still try to find primary even with read preference
-                # So we'll use a simple find operation on a collection which respects read preference
-                test_db = client[DATABASE_NAME]
-                
-                # Try to access a collection - this should work with read preference
-                # Use find_one with limit 0 (just to test connection, doesn't return data)
-                test_collection = test_db[COLLECTION_NAME]
-                # Use find with limit 0 - this is a read operation that respects read preference
-                async for _ in test_collection.find({}).limit(0):
-                    break  # Just test connection, don't process results
-                
-                print(f"✅ Connected to MongoDB database: {DATABASE_NAME}")
-                database = client[DATABASE_NAME]
-                collection = database[COLLECTION_NAME]
-                return True
-                
-            except Exception as e:
-                last_error = e
-                print(f"   Strategy {i+1} failed: {str(e)[:200]}")
-                if client:
-                    try:
-                        client.close()
-                    except:
-                        pass
-                    client = None
-                continue
-        
-        # If all strategies failed, raise the last error
-        raise last_error
+        logger.info("Connected to MongoDB database: %s", DATABASE_NAME)
+        database = client[DATABASE_NAME]
+        collection = database[COLLECTION_NAME]
+        _profile_databases.clear()
+        for profile in READ_PROFILES:
+            _profile_databases[profile] = database.with_options(**build_read_profile(settings, profile))
+        return True
         
     except Exception as e:
-        print(f"❌ Failed to connect to MongoDB after all attempts")
-        print(f"   Last error: {str(e)}")
-        print(f"\nTroubleshooting tips:")
-        print(f"1. Check your MongoDB Atlas IP whitelist (allow 0.0.0.0/0 for testing)")
-        print(f"2. Verify your MongoDB username and password in the connection string")
-        print(f"3. Ensure your network allows outbound connections to MongoDB Atlas (port 27017)")
-        print(f"4. Check if MongoDB Atlas cluster is running and accessible")
-        print(f"5. Try updating your Python SSL/TLS libraries: pip install --upgrade certifi")
-        print(f"6. Check firewall/antivirus settings that might block SSL connections")
+        if client:
+            client.close()
+            client = None
+        logger.error(
+            "Failed to connect to MongoDB: %s\n"
+            "Troubleshooting tips:\n"
+            "1. Check your MongoDB Atlas IP whitelist (allow 0.0.0.0/0 for testing)\n"
+            "2. Verify your MongoDB username and password in the connection string\n"
+            "3. Ensure your network allows outbound connections to MongoDB Atlas (port 27017)\n"
+            "4. Check if MongoDB Atlas cluster is running and accessible\n"
+            "5. Try updating your Python SSL/TLS libraries: pip install --upgrade certifi\n"
+            "6. For a local mongod without TLS set MONGO_TLS=false; raise MONGO_SERVER_SELECTION_TIMEOUT_MS for slow networks",
+            str(e)[:300]
+        )
         raise
 
 
@@ -177,14 +132,38 @@ async def close_mongo_connection():
     global client
     if client:
         client.close()
-        print("✅ MongoDB connection closed")
+        logger.info("MongoDB connection closed")
 
 
-async def get_database():
-    """Get database instance"""
+async def get_database(profile: str = None):
+    """
+    Get database instance
+    
+    Args:
+        profile: Optional read profile ("gameplay" or "analytics"); without one
+            reads use the client-wide MONGO_READ_PREFERENCE
+    """
     if database is None:
         await connect_to_mongo()
-    return database
+    if profile is None:
+        return database
+    return _profile_databases[profile]
+
+
+@asynccontextmanager
+async def causal_session():
+    """
+    Causally consistent session for a request that issues several dependent
+    operations
+    
+    Pass it as `session=` to each operation: later reads see earlier writes of
+    the session and never go back in time, even when they are served by
+    different secondaries.
+    """
+    if client is None:
+        await connect_to_mongo()
+    async with await client.start_session(causal_consistency=True) as session:
+        yield session
 
 
 async def get_collection():
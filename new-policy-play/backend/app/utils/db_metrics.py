@@ -0,0 +1,188 @@
+"""
+MongoDB connection pool and command metrics
+
+pymongo calls these listeners for every pool and command event. They keep
+running gauges (open, in-use and waiting connections) and rolling samples of
+checkout wait time and per-command latency, so pool starvation shows up as
+rising wait times and checkout failures instead of random slow requests.
+
+Events arrive on the driver's worker threads, so all state is guarded by a lock.
+"""
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterable, Optional
+from pymongo import monitoring
+from app.utils.request_metrics import add_phase
+
+# Samples kept per rolling series
+METRICS_WINDOW = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def summarize(samples: Iterable[float]) -> dict:
+    """Count, mean, p50, p95, p99 and max of a sample series (milliseconds)"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def percentile(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": round(ordered[-1], 2)
+    }
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool gauges and checkout wait times"""
+
+    def __init__(self, slow_checkout_ms: float):
+        self.slow_checkout_ms = slow_checkout_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open_connections = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.checkouts = 0
+        self.slow_checkouts = 0
+        self.checkout_failures: Dict[str, int] = defaultdict(int)
+        self.pool_clears = 0
+        self.wait_ms: Deque[float] = deque(maxlen=METRICS_WINDOW)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+        logger.warning("MongoDB connection pool cleared for %s", event.address)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+
+    def connection_check_out_started(self, event):
+        # Started and finished events of one checkout fire on the same thread
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def _wait_ms(self, event) -> float:
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7 reports it directly
+        if duration is not None:
+            return duration * 1000
+        started = getattr(self._local, "started", None)
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def connection_check_out_failed(self, event):
+        wait_ms = self._wait_ms(event)
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.checkout_failures[str(event.reason)] += 1
+        logger.warning("MongoDB connection checkout failed after %.0fms: %s", wait_ms, event.reason)
+
+    def connection_checked_out(self, event):
+        wait_ms = self._wait_ms(event)
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_ms.append(wait_ms)
+            if wait_ms >= self.slow_checkout_ms:
+                self.slow_checkouts += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "checkouts": self.checkouts,
+                "slow_checkouts": self.slow_checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "pool_clears": self.pool_clears,
+                "checkout_wait_ms": summarize(self.wait_ms)
+            }
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Latency and failures per MongoDB command name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency_ms: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        # Runs on the thread that issued the command, inside the request's context
+        add_phase("mongo", event.duration_micros / 1_000_000)
+        with self._lock:
+            self.latency_ms[event.command_name].append(event.duration_micros / 1000)
+
+    def failed(self, event):
+        add_phase("mongo", event.duration_micros / 1_000_000)
+        with self._lock:
+            self.latency_ms[event.command_name].append(event.duration_micros / 1000)
+            self.failures[event.command_name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {**summarize(samples), "failures": self.failures.get(name, 0)}
+                for name, samples in self.latency_ms.items()
+            }
+
+
+pool_metrics: Optional[PoolMetrics] = None
+command_metrics: Optional[CommandMetrics] = None
+
+
+def create_listeners(slow_checkout_ms: float) -> list:
+    """Create this process's listeners (once) and return them for the client options"""
+    global pool_metrics, command_metrics
+    if pool_metrics is None:
+        pool_metrics = PoolMetrics(slow_checkout_ms)
+        command_metrics = CommandMetrics()
+    return [pool_metrics, command_metrics]
+
+
+def db_metrics_snapshot() -> dict:
+    """Current pool gauges and command latencies"""
+    if pool_metrics is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "pool": pool_metrics.snapshot(),
+        "commands": command_metrics.snapshot()
+    }
@@ -0,0 +1,69 @@
+"""
+HTTP caching of generated content
+
+Game sets, escape rooms and structured policies do not change once generated:
+regeneration inserts a new document and a policy revision bumps its `revision`.
+Their GET routes therefore send a strong ETag built from the document id and
+its generation version, plus Cache-Control. Routes read only the version fields
+first; when the client's If-None-Match still matches they answer 304 Not
+Modified without loading (or sending) the document itself.
+
+Responses are per user (they need a bearer token), so Cache-Control is always
+`private`. Content that can never change under its URL (a finished game set)
+may be reused for HTTP_CACHE_MAX_AGE_SECONDS without asking; everything else is
+revalidated on every view.
+"""
+import json
+import hashlib
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import Response, status
+from app.utils.settings import get_settings
+
+# Bumped when the body of a cached route changes shape, so clients drop old copies
+CACHE_FORMAT_VERSION = 1
+
+
+def make_etag(kind: str, document_id, version) -> str:
+    return f'"{kind}-{document_id}-{version}-v{CACHE_FORMAT_VERSION}"'
+
+
+def generation_stamp(created_at: Optional[datetime]) -> str:
+    """Version of a document that is never updated after it was generated"""
+    if not created_at:
+        return "0"
+    # Stored datetimes are naive UTC; the stamp must not depend on the server's time zone
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return str(int(created_at.timestamp() * 1000))
+
+
+def state_digest(*values) -> str:
+    """Short digest of mutable state included in a response"""
+    encoded = json.dumps(values, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison (compressed responses carry W/ ETags)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def cache_control(immutable: bool = False) -> str:
+    max_age = get_settings().http_cache_max_age_seconds
+    if immutable and max_age > 0:
+        return f"private, max-age={max_age}"
+    return "private, no-cache"
+
+
+def cache_headers(etag: str, immutable: bool = False) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control(immutable)}
+
+
+def not_modified(etag: str, immutable: bool = False) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag, immutable))
@@ -0,0 +1,164 @@
+"""
+Event loop lag monitor and blocking-call detector
+
+A task on the event loop sleeps LOOP_MONITOR_INTERVAL_MS at a time and records
+how late it wakes up (event_loop_lag_seconds in /metrics, recent percentiles at
+GET /api/admin/loop). Lag means something held the loop: a sync call in an async
+handler (the sync Groq client, pdfplumber, mammoth, bcrypt) stalls every
+request on the worker until it returns.
+
+Lag is only known once the loop is free again, so a watchdog thread checks
+whether the monitor is overdue. Past LOOP_BLOCK_THRESHOLD_MS it captures the
+stack of the event loop thread and the running task while the block is still in
+progress; when the monitor wakes up the block is logged with that stack and
+counted per route (event_loop_blocked_total, event_loop_blocked_seconds).
+Blocks the watchdog did not catch in time count as "unknown", blocks outside
+request tasks (background jobs, protocol callbacks) as "background".
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from app.utils.db_metrics import summarize
+from app.utils.request_metrics import registry, task_route, install_task_factory
+from app.utils.settings import get_settings
+
+LAG_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+STACK_DEPTH = 25
+RECENT_BLOCKS = 20
+UNKNOWN_ROUTE = "unknown"
+BACKGROUND_ROUTE = "background"
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """Lag samples and blocks of one event loop"""
+
+    def __init__(self, interval: float, threshold: float, window_seconds: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags_ms = deque(maxlen=max(1, int(window_seconds / interval)))
+        self.blocks = deque(maxlen=RECENT_BLOCKS)
+        self.block_counts: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        # When the monitor should wake up next (time.monotonic), and what the watchdog saw when it did not
+        self._expected_wake: Optional[float] = None
+        self._captured: Optional[Tuple[float, str, Optional[str], str]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop_event.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._watchdog.join()
+
+    async def _run(self):
+        while True:
+            self._expected_wake = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._record(max(0.0, time.monotonic() - self._expected_wake))
+
+    def _record(self, lag: float):
+        registry.observe("event_loop_lag_seconds", (), lag, LAG_BUCKETS)
+        self.lags_ms.append(lag * 1000)
+        captured, self._captured = self._captured, None
+        if lag < self.threshold:
+            return
+
+        if captured is not None and captured[0] == self._expected_wake:
+            _, route, task_name, stack = captured
+        else:
+            route, task_name, stack = UNKNOWN_ROUTE, None, None
+        labels = (("route", route),)
+        registry.inc("event_loop_blocked_total", labels)
+        registry.observe("event_loop_blocked_seconds", labels, lag, LAG_BUCKETS)
+        self.block_counts[route] = self.block_counts.get(route, 0) + 1
+        block = {
+            "at": datetime.utcnow().isoformat(),
+            "route": route,
+            "task": task_name,
+            "blocked_ms": round(lag * 1000, 1),
+            "stack": stack
+        }
+        self.blocks.append(block)
+        logger.warning("Event loop blocked for %.0fms (route %s)%s", lag * 1000, route,
+                       f", while running:\n{stack}" if stack else "",
+                       extra={key: value for key, value in block.items() if key != "stack"})
+
+    def _watch(self):
+        while not self._stop_event.wait(self.threshold / 4):
+            expected = self._expected_wake
+            if expected is None or time.monotonic() - expected < self.threshold:
+                continue
+            captured = self._captured
+            if captured is None or captured[0] != expected:
+                self._captured = (expected, *self._capture())
+
+    def _capture(self) -> Tuple[str, Optional[str], str]:
+        """Route, task name and stack of whatever is running on the loop thread right now"""
+        task = asyncio.current_task(self._loop)
+        route = (task_route(task) if task is not None else None) or BACKGROUND_ROUTE
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_DEPTH)) if frame is not None else ""
+        return route, task.get_name() if task is not None else None, stack
+
+    def snapshot(self) -> dict:
+        return {
+            "worker_pid": os.getpid(),
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "lag_ms": summarize(self.lags_ms),
+            "blocked_by_route": dict(sorted(self.block_counts.items(), key=lambda item: -item[1])),
+            "recent_blocks": list(reversed(self.blocks))
+        }
+
+
+_monitor: Optional[LoopMonitor] = None
+
+
+async def start_loop_monitor():
+    """Start measuring this worker's event loop lag (if LOOP_MONITOR_ENABLED)"""
+    global _monitor
+    settings = get_settings()
+    if _monitor is not None or not settings.loop_monitor_enabled:
+        return
+    install_task_factory(asyncio.get_running_loop())
+    _monitor = LoopMonitor(
+        settings.loop_monitor_interval_ms / 1000,
+        settings.loop_block_threshold_ms / 1000,
+        settings.loop_monitor_window_seconds
+    )
+    _monitor.start()
+
+
+async def stop_loop_monitor():
+    global _monitor
+    if _monitor is not None:
+        await _monitor.stop()
+        _monitor = None
+
+
+def loop_monitor_snapshot() -> dict:
+    if _monitor is None:
+        return {"enabled": False}
+    return {"enabled": True, **_monitor.snapshot()}
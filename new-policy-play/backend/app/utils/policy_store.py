@@ -0,0 +1,195 @@
+"""
+Policy document storage
+
+A policy is stored as two documents:
+- `policies`: metadata and the structured lists (title, summary, rules, ...),
+  small enough to read on every request
+- `policy_text`: the large fields (`raw_text` and the `lexical_index`), keyed by
+  the same _id and only loaded by callers that ask for them
+
+Every read names the fields it needs through one of the projections below, so
+list views never pull rule arrays or raw text they do not use. Policies stored
+before the split still carry their large fields inline; they are moved to
+`policy_text` the first time those fields are loaded.
+"""
+import logging
+from typing import Iterable, List, Optional
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+POLICY_TEXT_COLLECTION = "policy_text"
+# Fields kept out of the main policies document
+LARGE_FIELDS = ["raw_text", "lexical_index"]
+# Bumped when the layout of the stored artifact changes
+POLICY_STORAGE_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+# Policy lists only need counts; $size is evaluated server-side
+LIST_PROJECTION = {
+    "title": 1,
+    "filename": 1,
+    "uploaded_at": 1,
+    "uploaded_by_name": 1,
+    "rules_count": {"$size": {"$ifNull": ["$rules", []]}},
+    "clauses_count": {"$size": {"$ifNull": ["$clauses", []]}}
+}
+TITLE_PROJECTION = {"title": 1}
+# Everything the generators read from the structured policy
+STRUCTURE_PROJECTION = {
+    "title": 1,
+    "summary": 1,
+    "rules": 1,
+    "roles": 1,
+    "clauses": 1,
+    "definitions": 1,
+    "exceptions": 1,
+    "risks": 1,
+    "policy_sections": 1,
+    "structuredData": 1,
+    "raw_text_chars": 1
+}
+
+
+def _object_id(policy_id) -> ObjectId:
+    return policy_id if isinstance(policy_id, ObjectId) else ObjectId(policy_id)
+
+
+def _main_document(policy_document: dict) -> dict:
+    main_document = {key: value for key, value in policy_document.items() if key not in LARGE_FIELDS}
+    main_document["raw_text_chars"] = len(policy_document.get("raw_text") or "")
+    main_document["storage_version"] = POLICY_STORAGE_VERSION
+    return main_document
+
+
+def _text_document(policy_document: dict) -> dict:
+    return {field: policy_document[field] for field in LARGE_FIELDS if field in policy_document}
+
+
+def _failed_indexes(error: BulkWriteError) -> set:
+    return {write_error["index"] for write_error in error.details.get("writeErrors", [])}
+
+
+async def insert_policy(db, policy_document: dict) -> ObjectId:
+    """Store a new policy, splitting its large fields into the side collection"""
+    main_document = _main_document(policy_document)
+
+    result = await db.policies.insert_one(main_document)
+    text_document = _text_document(policy_document)
+    try:
+        await db[POLICY_TEXT_COLLECTION].insert_one({"_id": result.inserted_id, **text_document})
+    except Exception:
+        # Don't leave a policy behind without its text
+        await db.policies.delete_one({"_id": result.inserted_id})
+        raise
+    return result.inserted_id
+
+
+async def insert_policies(db, policy_documents: List[dict]) -> List[Optional[ObjectId]]:
+    """
+    Store several new policies with one unordered insert_many per collection
+
+    Returns:
+        The inserted id for each document, in order; None where it failed
+    """
+    main_documents = [_main_document(document) for document in policy_documents]
+    failed = set()
+    try:
+        # insert_many assigns the _ids client-side, so they are known even on partial failure
+        await db.policies.insert_many(main_documents, ordered=False)
+    except BulkWriteError as e:
+        failed = _failed_indexes(e)
+
+    stored = [index for index in range(len(main_documents)) if index not in failed]
+    text_documents = [
+        {"_id": main_documents[index]["_id"], **_text_document(policy_documents[index])}
+        for index in stored
+    ]
+    if text_documents:
+        try:
+            await db[POLICY_TEXT_COLLECTION].insert_many(text_documents, ordered=False)
+        except BulkWriteError as e:
+            # Don't leave policies behind without their text
+            orphaned = [stored[index] for index in _failed_indexes(e)]
+            await db.policies.delete_many({"_id": {"$in": [main_documents[index]["_id"] for index in orphaned]}})
+            failed.update(orphaned)
+
+    return [None if index in failed else document["_id"] for index, document in enumerate(main_documents)]
+
+
+async def update_policy(db, policy_id, policy_document: dict) -> int:
+    """Replace the given fields of a stored policy; large fields go to the side collection"""
+    main_fields = _main_document(policy_document)
+    text_fields = _text_document(policy_document)
+    result = await db.policies.update_one(
+        {"_id": _object_id(policy_id)},
+        # Legacy inline copies are superseded by the side collection
+        {"$set": main_fields, "$unset": {field: "" for field in LARGE_FIELDS}}
+    )
+    if result.matched_count and text_fields:
+        await db[POLICY_TEXT_COLLECTION].update_one({"_id": _object_id(policy_id)}, {"$set": text_fields}, upsert=True)
+    return result.matched_count
+
+
+async def save_large_fields(db, policy_id, fields: dict) -> int:
+    """
+    Set large fields of a policy whose side document exists (i.e. after `load_large_fields`)
+
+    Does not upsert: a partial side document would hide a legacy policy's inline fields.
+    """
+    result = await db[POLICY_TEXT_COLLECTION].update_one({"_id": _object_id(policy_id)}, {"$set": fields})
+    return result.matched_count
+
+
+async def load_large_fields(db, policy_id, fields: Iterable[str] = LARGE_FIELDS) -> dict:
+    """Load large fields of a policy, moving them out of legacy inline documents"""
+    fields = list(fields)
+    projection = {field: 1 for field in fields}
+    text_document = await db[POLICY_TEXT_COLLECTION].find_one({"_id": _object_id(policy_id)}, projection)
+    if text_document is not None:
+        text_document.pop("_id", None)
+        return text_document
+
+    # Stored before the split: read the inline fields and move them across
+    inline = await db.policies.find_one({"_id": _object_id(policy_id)}, {field: 1 for field in LARGE_FIELDS})
+    if inline is None:
+        return {}
+    inline.pop("_id", None)
+    try:
+        await db[POLICY_TEXT_COLLECTION].update_one({"_id": _object_id(policy_id)}, {"$set": inline}, upsert=True)
+        await db.policies.update_one(
+            {"_id": _object_id(policy_id)},
+            {
+                "$unset": {field: "" for field in LARGE_FIELDS},
+                "$set": {"raw_text_chars": len(inline.get("raw_text") or ""), "storage_version": POLICY_STORAGE_VERSION}
+            }
+        )
+        logger.info("Moved large fields of policy %s to %s", policy_id, POLICY_TEXT_COLLECTION)
+    except Exception as e:
+        logger.warning("Failed to migrate large fields of policy %s: %s", policy_id, e)
+    return {field: inline[field] for field in fields if field in inline}
+
+
+async def find_policy(db, policy_id, projection: Optional[dict] = None,
+                      large_fields: Iterable[str] = ()) -> Optional[dict]:
+    """
+    Fetch one policy with an explicit projection
+
+    Args:
+        projection: Fields of the main document to return (e.g. STRUCTURE_PROJECTION)
+        large_fields: Side-collection fields to attach, e.g. ("lexical_index",)
+    """
+    policy = await db.policies.find_one({"_id": _object_id(policy_id)}, projection or TITLE_PROJECTION)
+    if policy is None:
+        return None
+    large_fields = list(large_fields)
+    if large_fields:
+        policy.update(await load_large_fields(db, policy["_id"], large_fields))
+    return policy
+
+
+async def delete_policy_document(db, policy_id) -> int:
+    """Delete a policy and its large fields; returns the number of policies deleted"""
+    result = await db.policies.delete_one({"_id": _object_id(policy_id)})
+    await db[POLICY_TEXT_COLLECTION].delete_one({"_id": _object_id(policy_id)})
+    return result.deleted_count
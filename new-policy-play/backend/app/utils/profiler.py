@@ -0,0 +1,160 @@
+"""
+On-demand sampling profiler for a live worker
+
+`profile_worker` samples the Python stacks of every thread in this process
+(`sys._current_frames`) from a background thread for a few seconds. No tracing
+hooks are installed, so the cost is one stack walk per thread per interval and
+nothing at all outside a profile. Meanwhile a task on the event loop measures
+loop lag (how late a short sleep wakes up) and records the await chains of
+pending asyncio tasks, which show what requests are waiting on.
+
+Stacks are returned in the collapsed ("folded") format read by flamegraph.pl,
+speedscope and inferno: one line per unique stack, frames root-first separated
+by ";", then the sample count. The profile is wall-clock: idle threads appear
+in their wait frames, and wide non-idle stacks under the event loop thread are
+code blocking the loop (e.g. pdfplumber or a sync client called from a handler).
+
+Only one profile runs per worker at a time; with several workers the one that
+serves the request is profiled.
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, List
+from app.utils.db_metrics import summarize
+from app.utils.settings import BACKEND_DIR
+
+TASK_SNAPSHOT_SECONDS = 0.5
+LOOP_THREAD_LABEL = "event-loop"
+TASKS_ROOT_LABEL = "asyncio-tasks"
+
+_profile_lock = asyncio.Lock()
+
+
+def _short_path(filename: str) -> str:
+    """Module path relative to site-packages or the backend directory"""
+    for marker in ("site-packages", "dist-packages"):
+        marker = f"{os.sep}{marker}{os.sep}"
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    if filename.startswith(BACKEND_DIR):
+        return os.path.relpath(filename, BACKEND_DIR)
+    return os.path.basename(filename)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{frame.f_lineno})".replace(";", ",")
+
+
+def _collapse_frame(root: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ";".join(reversed(labels))
+
+
+def _await_chain(coroutine) -> List[str]:
+    """Frames of a suspended coroutine and everything it is awaiting, outermost first"""
+    labels = []
+    awaitable = coroutine
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None) \
+            or getattr(awaitable, "ag_frame", None)
+        if frame is None:
+            # A future, or a coroutine that has finished
+            labels.append(type(awaitable).__name__)
+            break
+        labels.append(_frame_label(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None) \
+            or getattr(awaitable, "ag_await", None)
+    return labels
+
+
+class StackSampler(threading.Thread):
+    """Counts the collapsed stack of every other thread at a fixed interval"""
+
+    def __init__(self, interval: float, loop_thread_id: int):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.loop_thread_id = loop_thread_id
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                name = names.get(thread_id, f"thread-{thread_id}")
+                if thread_id == self.loop_thread_id:
+                    name = f"{LOOP_THREAD_LABEL} ({name})"
+                self.stacks[_collapse_frame(name, frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _snapshot_tasks(task_stacks: Counter, current: asyncio.Task):
+    for task in asyncio.all_tasks():
+        if task is current or task.done():
+            continue
+        task_stacks[";".join([TASKS_ROOT_LABEL, *_await_chain(task.get_coro())])] += 1
+
+
+async def _probe_loop(interval: float, seconds: float, lags: List[float], task_stacks: Counter):
+    """Sample loop lag every interval and task stacks every TASK_SNAPSHOT_SECONDS"""
+    loop = asyncio.get_running_loop()
+    current = asyncio.current_task()
+    deadline = loop.time() + seconds
+    next_snapshot = loop.time()
+    while loop.time() < deadline:
+        if loop.time() >= next_snapshot:
+            _snapshot_tasks(task_stacks, current)
+            next_snapshot = loop.time() + TASK_SNAPSHOT_SECONDS
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - started - interval) * 1000)
+
+
+def profile_running() -> bool:
+    return _profile_lock.locked()
+
+
+async def profile_worker(seconds: float, interval: float) -> dict:
+    """Profile this worker for `seconds`, sampling every `interval` seconds"""
+    async with _profile_lock:
+        sampler = StackSampler(interval, threading.get_ident())
+        lags: List[float] = []
+        task_stacks: Counter = Counter()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await _probe_loop(interval, seconds, lags, task_stacks)
+        finally:
+            # The sampler wakes up at once; joining only waits for a sample in progress
+            sampler.stop()
+        return {
+            "worker_pid": os.getpid(),
+            "seconds": round(time.perf_counter() - started, 2),
+            "interval_ms": round(interval * 1000, 2),
+            "samples": sampler.samples,
+            "loop_lag_ms": summarize(lags),
+            "stacks": dict(sampler.stacks),
+            "task_stacks": dict(task_stacks)
+        }
+
+
+def collapsed(stacks: Dict[str, int]) -> str:
+    """Folded stack lines, most sampled first"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
@@ -0,0 +1,411 @@
+"""
+Per-request performance metrics
+
+`RequestMetricsMiddleware` times every HTTP request and keeps, per route
+template and method:
+- request count by status code
+- a latency histogram (for p50/p95/p99 via histogram_quantile)
+- time spent in each phase: auth, mongo, groq, serialize and compress
+- request and response payload size histograms
+
+Routes are labelled with their full path template, router and mount prefixes
+included (`/api/admin/policies`, not the router's own `/policies`), resolved
+once at startup by `register_route_templates`.
+
+The DB and LLM layers report phase time with `add_phase`/`timed_phase`; the
+current request is found through a context variable, which Motor carries into
+its executor threads. Phase times are summed, so concurrent calls in one
+request (e.g. five rooms generated in parallel) can add up to more than the
+request's wall time.
+
+Tasks are mapped to the request they work for (`task_route`), including child
+tasks created while handling it, so code running outside the request's context
+(the event loop watchdog) can attribute work to a route.
+
+Each response gets a `Server-Timing` header with the phases measured so far,
+and `/metrics` serves everything in the Prometheus text format. Worker
+processes do not share memory: with METRICS_DIR set (the multi-worker launcher
+sets it), every worker writes its totals there every few seconds and
+`/metrics` adds up the files of all workers.
+"""
+import os
+import glob
+import json
+import time
+import asyncio
+import weakref
+import threading
+import logging
+import orjson
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from fastapi.responses import JSONResponse
+from app.utils.settings import get_settings
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+PHASES = ["auth", "mongo", "groq", "serialize", "compress"]
+METRIC_PREFIX = "policyplay"
+METRICS_FLUSH_SECONDS = 5
+
+Labels = Tuple[Tuple[str, str], ...]
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """Phase durations of one request; phases may be added from driver threads"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (milliseconds)"""
+        with self._lock:
+            entries = [
+                f'{phase};dur={seconds * 1000:.1f};desc="{self.counts[phase]} calls"'
+                for phase, seconds in self.phases.items()
+            ]
+        entries.append(f"app;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+
+def add_phase(phase: str, seconds: float):
+    """Attribute time to a phase of the current request (no-op outside requests)"""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def timed_phase(phase: str):
+    """Time a block (sync or containing awaits) as a phase of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(phase, time.perf_counter() - started)
+
+
+# Task -> ASGI scope of the request it works for (read from other threads)
+_task_scopes: "weakref.WeakKeyDictionary[asyncio.Task, dict]" = weakref.WeakKeyDictionary()
+_current_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+
+# id(route) -> full path template (routes compare by value, so they cannot be dict keys themselves)
+_route_templates: Dict[int, str] = {}
+
+
+def _path_template(route) -> str:
+    return getattr(route, "path_format", None) or getattr(route, "path", "")
+
+
+def register_route_templates(routes, prefix: str = "") -> Dict[int, str]:
+    """
+    Record the full path template of every route, descending into mounts
+
+    Logs a warning when two routes would share a label for the same method,
+    since their metrics (and blocking reports) could not be told apart.
+    """
+    seen: Dict[Tuple[str, str], object] = {}
+    pending = [(route, prefix) for route in routes]
+    while pending:
+        route, route_prefix = pending.pop(0)
+        template = route_prefix + _path_template(route)
+        if getattr(route, "routes", None) is not None:
+            pending.extend((child, template) for child in route.routes)
+            continue
+        _route_templates[id(route)] = template
+        for method in getattr(route, "methods", None) or ["*"]:
+            other = seen.setdefault((method, template), route)
+            if other is not route:
+                logger.warning("Routes %s and %s share the metrics label %s %s",
+                               getattr(other, "name", other), getattr(route, "name", route), method, template)
+    return _route_templates
+
+
+def route_label(scope: dict) -> str:
+    """Full route template of a request; the router stores the matched route in the scope"""
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    template = _route_templates.get(id(route))
+    if template is None:
+        # Not registered at startup: the mount prefixes are in root_path
+        template = scope.get("root_path", "") + _path_template(route)
+    return template or "unmatched"
+
+
+def task_route(task: asyncio.Task) -> Optional[str]:
+    """Route of the request a task works for (None for background tasks)"""
+    scope = _task_scopes.get(task)
+    return route_label(scope) if scope is not None else None
+
+
+def install_task_factory(loop: asyncio.AbstractEventLoop):
+    """Map tasks created during a request (gather, streaming bodies) to that request"""
+    previous = loop.get_task_factory()
+
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        scope = _current_scope.get()
+        if scope is not None:
+            _task_scopes[task] = scope
+        return task
+
+    loop.set_task_factory(factory)
+
+
+class TimedJSONResponse(JSONResponse):
+    """Default response class; JSON rendering counts as the serialize phase"""
+
+    def render(self, content) -> bytes:
+        with timed_phase("serialize"):
+            return super().render(content)
+
+
+class CompactJSONResponse(JSONResponse):
+    """
+    orjson rendering for large payloads (question sets, room puzzles, policy lists)
+
+    Return it from the route instead of a dict: FastAPI then skips its
+    jsonable_encoder pass over the content as well. Datetimes are written in ISO
+    format like the default encoder; ObjectIds and other unknown types as str.
+    """
+
+    def render(self, content) -> bytes:
+        with timed_phase("serialize"):
+            return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MetricsRegistry:
+    """Counters and histograms keyed by metric name and label set"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], dict] = {}
+
+    def inc(self, name: str, labels: Labels, value: float = 1.0):
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + value
+
+    def observe(self, name: str, labels: Labels, value: float, buckets: List[float]):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+                self.histograms[(name, labels)] = histogram
+            for index, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self) -> dict:
+        """JSON-serializable copy, as written to METRICS_DIR"""
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [
+                    [name, list(labels), {**histogram, "counts": list(histogram["counts"])}]
+                    for (name, labels), histogram in self.histograms.items()
+                ]
+            }
+
+
+registry = MetricsRegistry()
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def record_request(method: str, route: str, status_code: int, timing: RequestTiming,
+                   request_bytes: int, response_bytes: int):
+    duration = time.perf_counter() - timing.started
+    route_labels = _labels(method=method, route=route)
+    registry.inc("http_requests_total", _labels(method=method, route=route, status=str(status_code)))
+    registry.observe("http_request_duration_seconds", route_labels, duration, LATENCY_BUCKETS)
+    for phase in PHASES:
+        seconds = timing.phases.get(phase)
+        if seconds is not None:
+            registry.observe("http_request_phase_seconds", _labels(method=method, route=route, phase=phase),
+                             seconds, LATENCY_BUCKETS)
+    registry.observe("http_request_size_bytes", route_labels, request_bytes, SIZE_BUCKETS)
+    registry.observe("http_response_size_bytes", route_labels, response_bytes, SIZE_BUCKETS)
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware (keeps streaming responses and context variables intact)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.server_timing = get_settings().server_timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+        scope_token = _current_scope.set(scope)
+        _task_scopes[asyncio.current_task()] = scope
+        sizes = {"request": 0, "response": 0}
+        status_holder = {"status": 500}
+
+        async def receive_with_size():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                if self.server_timing:
+                    message = {**message, "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", timing.server_timing().encode("latin-1"))
+                    ]}
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_size, send_with_timing)
+        finally:
+            _current_timing.reset(token)
+            _current_scope.reset(scope_token)
+            _task_scopes.pop(asyncio.current_task(), None)
+            # Unmatched paths share one label
+            record_request(scope["method"], route_label(scope), status_holder["status"], timing,
+                           sizes["request"], sizes["response"])
+
+
+def _metrics_dir() -> str:
+    return get_settings().metrics_dir
+
+
+def write_worker_snapshot():
+    """Write this worker's totals to METRICS_DIR"""
+    metrics_dir = _metrics_dir()
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"worker-{os.getpid()}.json")
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as snapshot_file:
+        json.dump(registry.snapshot(), snapshot_file)
+    os.replace(temp_path, path)
+
+
+def _merged_snapshot() -> dict:
+    """This worker's totals, or the sum over all workers when METRICS_DIR is set"""
+    metrics_dir = _metrics_dir()
+    if not metrics_dir:
+        return registry.snapshot()
+    write_worker_snapshot()
+    counters: Dict[Tuple[str, Labels], float] = {}
+    histograms: Dict[Tuple[str, Labels], dict] = {}
+    for path in glob.glob(os.path.join(metrics_dir, "worker-*.json")):
+        try:
+            with open(path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, histogram in snapshot["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.setdefault(key, {**histogram, "counts": [0] * len(histogram["counts"]), "sum": 0.0, "count": 0})
+            merged["counts"] = [total + count for total, count in zip(merged["counts"], histogram["counts"])]
+            merged["sum"] += histogram["sum"]
+            merged["count"] += histogram["count"]
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, list(labels), histogram] for (name, labels), histogram in histograms.items()]
+    }
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [tuple(pair) for pair in labels] + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """All request metrics in the Prometheus text exposition format"""
+    snapshot = _merged_snapshot()
+    lines = []
+    typed = set()
+
+    for name, labels, value in sorted(snapshot["counters"], key=lambda entry: (entry[0], entry[1])):
+        metric = f"{METRIC_PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    for name, labels, histogram in sorted(snapshot["histograms"], key=lambda entry: (entry[0], entry[1])):
+        metric = f"{METRIC_PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            lines.append(f"{metric}_bucket{_format_labels(labels, ('le', str(bound)))} {count}")
+        lines.append(f"{metric}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram['count']}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+_snapshot_task: Optional[asyncio.Task] = None
+
+
+async def _snapshot_loop():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            write_worker_snapshot()
+        except Exception as e:
+            logger.warning("Failed to write metrics snapshot: %s", e)
+
+
+async def start_metrics():
+    """Start writing this worker's totals to METRICS_DIR (if configured)"""
+    global _snapshot_task
+    if _snapshot_task is None and _metrics_dir():
+        _snapshot_task = asyncio.create_task(_snapshot_loop())
+
+
+async def stop_metrics():
+    global _snapshot_task
+    if _snapshot_task is not None:
+        _snapshot_task.cancel()
+        try:
+            await _snapshot_task
+        except asyncio.CancelledError:
+            pass
+        _snapshot_task = None
+        write_worker_snapshot()
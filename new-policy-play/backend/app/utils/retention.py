@@ -0,0 +1,303 @@
+"""
+Retention of game sessions and attempts
+
+Two mechanisms keep the hot collections small:
+- Abandoned games expire. Sessions and attempts are created with an
+  `expire_at` deadline (SESSION_TTL_HOURS ahead) that is removed when they are
+  completed, and a TTL index deletes documents whose deadline has passed.
+  Completed records have no `expire_at` and never expire.
+- Old completed records are archived. Once a day (ARCHIVE_INTERVAL_HOURS) one
+  worker moves records completed more than ARCHIVE_AFTER_DAYS ago into monthly
+  `<collection>_archive_<YYYY_MM>` collections, keeping only the fields the
+  analytics use.
+
+Archiving upserts by _id before deleting, so a batch interrupted halfway is
+simply repeated on the next run. A failed run gives up its lease after
+ARCHIVE_RETRY_SECONDS instead of holding it for the whole interval.
+
+Analytics, score statistics and leaderboards read through `find_with_archives`
+and `count_with_archives`, which add the archives to the hot collection with
+$unionWith (MongoDB 4.4+). Archived game sessions get `completed` and
+`answered_at` back so the same queries match them; their rule is in
+`policy_rule` (use `policy_rule()` to read it from either shape). Each archive
+is indexed on ARCHIVE_INDEX_FIELDS when it is first written, so the $unionWith
+branches do not scan whole months.
+"""
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+import logging
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from app.utils.db import get_database
+from app.utils.settings import get_settings
+
+EXPIRE_FIELD = "expire_at"
+LEASES_COLLECTION = "maintenance_leases"
+# Pause before a failed archival run is retried (by any worker)
+ARCHIVE_RETRY_SECONDS = 900
+# Archives only appear when a run starts a new month, so their names are cached
+ARCHIVE_NAMES_CACHE_SECONDS = 60
+# Fields the analytics and leaderboard queries filter archives on
+ARCHIVE_INDEX_FIELDS = ["user_id", "policy_id", "completed_at"]
+
+logger = logging.getLogger(__name__)
+
+
+def policy_rule(session: dict) -> Optional[str]:
+    """Rule a game session tested, for live and archived sessions"""
+    if session.get("policy_rule"):
+        return session["policy_rule"]
+    if session.get("scenario"):
+        return session["scenario"].get("policy_rule_used")
+    if session.get("violation_scenario"):
+        return session["violation_scenario"].get("policy_rule_violated")
+    return None
+
+
+def _compact_game_session(session: dict) -> dict:
+    return {
+        "_id": session["_id"],
+        "user_id": session.get("user_id"),
+        "policy_id": session.get("policy_id"),
+        "game_type": session.get("game_type"),
+        "score": session.get("score", 0),
+        "correct": session.get("correct", False),
+        "policy_rule": policy_rule(session),
+        "created_at": session.get("created_at"),
+        "completed_at": session.get("answered_at")
+    }
+
+
+def _compact_escape_attempt(attempt: dict) -> dict:
+    return {
+        "_id": attempt["_id"],
+        "user_id": attempt.get("user_id"),
+        "policy_id": attempt.get("policy_id"),
+        "level": attempt.get("level"),
+        "score": attempt.get("score", 0),
+        "time_taken": attempt.get("time_taken", 0),
+        "rooms_completed": attempt.get("rooms_completed", []),
+        "created_at": attempt.get("created_at"),
+        "completed_at": attempt.get("completed_at")
+    }
+
+
+def _compact_policy_tap_attempt(attempt: dict) -> dict:
+    return {
+        "_id": attempt["_id"],
+        "user_id": attempt.get("user_id"),
+        "policy_id": attempt.get("policy_id"),
+        "level": attempt.get("level"),
+        "score": attempt.get("score", 0),
+        "correct_answers": attempt.get("correct_answers", 0),
+        "wrong_answers": attempt.get("wrong_answers", 0),
+        "missed_answers": attempt.get("missed_answers", 0),
+        "time_taken": attempt.get("time_taken", 0),
+        "created_at": attempt.get("created_at"),
+        "completed_at": attempt.get("completed_at")
+    }
+
+
+# collection -> (filter of incomplete records, field holding the completion time, compaction)
+RETAINED_COLLECTIONS: Dict[str, tuple] = {
+    "game_sessions": ({"completed": False}, "answered_at", _compact_game_session),
+    "escape_attempts": ({"completed_at": None}, "completed_at", _compact_escape_attempt),
+    "falling_ball_attempts": ({"completed_at": None}, "completed_at", _compact_policy_tap_attempt),
+}
+
+# Fields set on archived records so queries written for the hot collection match them
+ARCHIVE_VIEWS: Dict[str, dict] = {
+    "game_sessions": {"completed": True, "answered_at": "$completed_at"},
+}
+
+_archive_task: Optional[asyncio.Task] = None
+_archive_names: Dict[str, Tuple[float, List[str]]] = {}
+# Archives this worker has created the indexes on
+_indexed_archives: Set[str] = set()
+
+
+def abandon_deadline() -> datetime:
+    """`expire_at` for a new session or attempt"""
+    return datetime.utcnow() + timedelta(hours=get_settings().session_ttl_hours)
+
+
+def archive_collection_name(collection_name: str, completed_at: datetime) -> str:
+    return f"{collection_name}_archive_{completed_at:%Y_%m}"
+
+
+async def archive_collection_names(db, collection_name: str) -> List[str]:
+    """Monthly archives of a collection (listed at most every ARCHIVE_NAMES_CACHE_SECONDS per worker)"""
+    cached = _archive_names.get(collection_name)
+    if cached is not None and time.monotonic() - cached[0] < ARCHIVE_NAMES_CACHE_SECONDS:
+        return cached[1]
+    names = sorted(await db.list_collection_names(filter={"name": {"$regex": f"^{collection_name}_archive_"}}))
+    _archive_names[collection_name] = (time.monotonic(), names)
+    return names
+
+
+async def _aggregate_with_archives(db, collection_name: str, query: dict, stages: list, session=None):
+    archive_pipeline = [{"$match": query}]
+    if collection_name in ARCHIVE_VIEWS:
+        archive_pipeline.insert(0, {"$set": ARCHIVE_VIEWS[collection_name]})
+    pipeline = [{"$match": query}] + [
+        {"$unionWith": {"coll": archive_name, "pipeline": archive_pipeline}}
+        for archive_name in await archive_collection_names(db, collection_name)
+    ]
+    return db[collection_name].aggregate(pipeline + stages, session=session)
+
+
+async def find_with_archives(db, collection_name: str, query: dict, sort: Optional[list] = None,
+                             limit: int = 1000, session=None) -> List[dict]:
+    """Records of a retained collection matching `query`, archived (compacted) ones included"""
+    stages = [{"$sort": dict(sort)}] if sort else []
+    stages.append({"$limit": limit})
+    cursor = await _aggregate_with_archives(db, collection_name, query, stages, session)
+    return await cursor.to_list(limit)
+
+
+async def count_with_archives(db, collection_name: str, query: dict, session=None) -> int:
+    cursor = await _aggregate_with_archives(db, collection_name, query, [{"$count": "count"}], session)
+    result = await cursor.to_list(1)
+    return result[0]["count"] if result else 0
+
+
+async def _ensure_archive_indexes(db, archive_name: str):
+    """Index an archive on the fields $unionWith matches on (once per worker)"""
+    if archive_name in _indexed_archives:
+        return
+    for field in ARCHIVE_INDEX_FIELDS:
+        await db[archive_name].create_index(field)
+    _indexed_archives.add(archive_name)
+
+
+async def ensure_retention_indexes(db):
+    """TTL index on the abandon deadline, an index for the archive scan and the archives' indexes"""
+    for collection_name, (_, completed_field, _) in RETAINED_COLLECTIONS.items():
+        await db[collection_name].create_index(EXPIRE_FIELD, expireAfterSeconds=0, name="abandoned_ttl")
+        await db[collection_name].create_index(
+            completed_field, name="archive_scan",
+            partialFilterExpression={completed_field: {"$type": "date"}}
+        )
+        # Archives written before they were indexed on creation
+        for archive_name in await archive_collection_names(db, collection_name):
+            await _ensure_archive_indexes(db, archive_name)
+
+
+async def _backfill_deadlines(db, collection_name: str, incomplete: dict) -> int:
+    """Give incomplete records stored before the TTL existed a deadline based on created_at"""
+    ttl_ms = int(get_settings().session_ttl_hours * 3600 * 1000)
+    result = await db[collection_name].update_many(
+        {**incomplete, EXPIRE_FIELD: {"$exists": False}, "created_at": {"$type": "date"}},
+        [{"$set": {EXPIRE_FIELD: {"$add": ["$created_at", ttl_ms]}}}]
+    )
+    return result.modified_count
+
+
+async def _archive_collection(db, collection_name: str, completed_field: str, compact: Callable[[dict], dict],
+                              cutoff: datetime) -> int:
+    settings = get_settings()
+    archived = 0
+    while True:
+        batch = await db[collection_name].find(
+            {completed_field: {"$type": "date", "$lt": cutoff}}
+        ).limit(settings.archive_batch_size).to_list(settings.archive_batch_size)
+        if not batch:
+            return archived
+
+        by_month: Dict[str, list] = {}
+        for record in batch:
+            by_month.setdefault(archive_collection_name(collection_name, record[completed_field]), []).append(
+                ReplaceOne({"_id": record["_id"]}, compact(record), upsert=True)
+            )
+        for archive_name, operations in by_month.items():
+            await _ensure_archive_indexes(db, archive_name)
+            await db[archive_name].bulk_write(operations, ordered=False)
+        _archive_names.pop(collection_name, None)
+        await db[collection_name].delete_many({"_id": {"$in": [record["_id"] for record in batch]}})
+        archived += len(batch)
+        await asyncio.sleep(0)
+
+
+async def run_archival(db=None) -> Dict[str, dict]:
+    """Backfill abandon deadlines and archive old completed records of every retained collection"""
+    db = db or await get_database()
+    cutoff = datetime.utcnow() - timedelta(days=get_settings().archive_after_days)
+    report = {}
+    for collection_name, (incomplete, completed_field, compact) in RETAINED_COLLECTIONS.items():
+        report[collection_name] = {
+            "deadlines_backfilled": await _backfill_deadlines(db, collection_name, incomplete),
+            "archived": await _archive_collection(db, collection_name, completed_field, compact, cutoff)
+        }
+    archived = sum(entry["archived"] for entry in report.values())
+    if archived:
+        logger.info("Archived %d completed sessions and attempts older than %s", archived, f"{cutoff:%Y-%m-%d}")
+    return report
+
+
+async def _acquire_lease(db, name: str, seconds: float) -> Optional[datetime]:
+    """Let one worker per interval run a maintenance task; returns the lease's expiry if acquired"""
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=seconds)
+    try:
+        await db[LEASES_COLLECTION].find_one_and_update(
+            {"_id": name, "until": {"$lt": now}},
+            {"$set": {"until": until, "worker_pid": os.getpid()}},
+            upsert=True
+        )
+        return until
+    except DuplicateKeyError:
+        # The lease exists and has not expired: another worker holds it
+        return None
+
+
+async def _shorten_lease(db, name: str, until: datetime, seconds: float):
+    """Let the task run again after `seconds` (only if this worker still holds the lease)"""
+    await db[LEASES_COLLECTION].update_one(
+        {"_id": name, "until": until},
+        {"$set": {"until": datetime.utcnow() + timedelta(seconds=seconds)}}
+    )
+
+
+async def _archive_loop():
+    interval = get_settings().archive_interval_hours * 3600
+    while True:
+        delay = interval
+        try:
+            db = await get_database()
+            lease = await _acquire_lease(db, "archival", interval)
+            if lease is not None:
+                try:
+                    await run_archival(db)
+                except Exception:
+                    await _shorten_lease(db, "archival", lease, ARCHIVE_RETRY_SECONDS)
+                    raise
+        except Exception as e:
+            delay = min(interval, ARCHIVE_RETRY_SECONDS)
+            logger.warning("Archival run failed, retrying in %.0fs: %s", delay, e)
+        await asyncio.sleep(delay)
+
+
+async def start_retention():
+    """Create the retention indexes and start the periodic archival task"""
+    global _archive_task
+    db = await get_database()
+    try:
+        await ensure_retention_indexes(db)
+    except Exception as e:
+        logger.warning("Failed to create retention indexes: %s", e)
+    if _archive_task is None and get_settings().archive_interval_hours > 0:
+        _archive_task = asyncio.create_task(_archive_loop())
+
+
+async def stop_retention():
+    global _archive_task
+    if _archive_task is not None:
+        _archive_task.cancel()
+        try:
+            await _archive_task
+        except asyncio.CancelledError:
+            pass
+        _archive_task = None
@@ -0,0 +1,256 @@
+"""
+Application settings
+
+All configuration comes from environment variables (and `.env`, loaded once
+here). Modules read their values from `get_settings()` instead of calling
+`load_dotenv()`/`os.getenv()` themselves. Reading settings never touches the
+network; required values such as MONGO_URI and GROQ_API_KEY are only checked
+when the client that needs them is created, which happens in the app's
+startup and fails it immediately if they are missing.
+"""
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _env(name: str, default: str = "") -> str:
+    return os.getenv(name, default)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, "true" if default else "false").lower() == "true"
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name) or default)
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name) or default)
+
+
+@dataclass(frozen=True)
+class Settings:
+    environment: str
+    cors_origins: List[str]
+    secret_key: str
+
+    # MongoDB
+    mongo_uri: Optional[str]
+    database_name: str
+    mongo_tls: bool
+    mongo_tls_allow_invalid_certificates: bool
+    mongo_read_preference: str
+    mongo_analytics_read_preference: str
+    mongo_analytics_max_staleness_seconds: int
+    mongo_server_selection_timeout_ms: int
+    mongo_connect_timeout_ms: int
+    mongo_socket_timeout_ms: int
+    mongo_max_pool_size: int
+    mongo_min_pool_size: int
+    mongo_max_idle_time_ms: int
+    mongo_wait_queue_timeout_ms: int
+    mongo_max_connecting: int
+    mongo_monitoring: bool
+    mongo_slow_checkout_ms: float
+
+    # Groq
+    groq_api_key: Optional[str]
+    llm_timeout_seconds: float
+    llm_max_retries: int
+    llm_breaker_window_seconds: float
+    llm_breaker_min_calls: int
+    llm_breaker_failure_rate: float
+    llm_breaker_slow_call_seconds: float
+    llm_breaker_slow_call_rate: float
+    llm_breaker_open_seconds: float
+    llm_hedge_enabled: bool
+    llm_hedge_min_delay_seconds: float
+    llm_hedge_min_samples: int
+    llm_telemetry_window_seconds: float
+    llm_telemetry_max_samples: int
+    llm_prompt_price_per_million: float
+    llm_completion_price_per_million: float
+    prompt_budget_overrides: Dict[str, int]
+
+    # Games
+    policy_tap_questions: int
+
+    # Live attempts
+    attempt_flush_interval_seconds: float
+    attempt_idle_evict_seconds: float
+    attempt_store_backend: str
+
+    # Uploaded originals
+    blob_store_backend: str
+    blob_store_local_dir: str
+    blob_gridfs_bucket: str
+    blob_chunk_bytes: int
+
+    # Bulk ingestion
+    ingest_extract_workers: int
+    ingest_llm_concurrency: int
+    ingest_insert_batch_size: int
+    ingest_max_files: int
+    ingest_max_file_bytes: int
+    ingest_max_total_bytes: int
+
+    # Retention of sessions and attempts
+    session_ttl_hours: float
+    archive_after_days: int
+    archive_interval_hours: float
+    archive_batch_size: int
+
+    # Policy deletion cleanup
+    cleanup_batch_size: int
+    cleanup_batch_pause_seconds: float
+
+    # Server
+    server_host: str
+    server_port: int
+    web_concurrency: int
+    server_loop: str
+    server_http: str
+    graceful_shutdown_seconds: int
+    keep_alive_seconds: int
+    forwarded_allow_ips: str
+    access_log: bool
+    startup_budget_seconds: float
+
+    # Request metrics
+    server_timing_header: bool
+    metrics_dir: str
+
+    # Response compression
+    compression_enabled: bool
+    compression_minimum_bytes: int
+    compression_gzip_level: int
+    compression_brotli_quality: int
+
+    # HTTP caching of generated content
+    http_cache_max_age_seconds: int
+
+    # Logging
+    log_level: str
+    log_levels: str
+    log_format: str
+    log_queue_size: int
+    log_debug_sample_rate: float
+    log_debug_max_per_second: int
+
+    # Event loop monitoring
+    loop_monitor_enabled: bool
+    loop_monitor_interval_ms: float
+    loop_block_threshold_ms: float
+    loop_monitor_window_seconds: float
+
+    # On-demand profiling
+    profile_max_seconds: float
+    profile_default_interval_ms: float
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            environment=_env("ENVIRONMENT", "development"),
+            cors_origins=[origin for origin in _env("CORS_ORIGINS").split(",") if origin],
+            secret_key=_env("SECRET_KEY", "your-secret-key-change-in-production"),
+            mongo_uri=os.getenv("MONGO_URI"),
+            database_name=_env("MONGO_DATABASE", "policyplay"),
+            mongo_tls=_env_bool("MONGO_TLS", True),
+            mongo_tls_allow_invalid_certificates=_env_bool("MONGO_TLS_ALLOW_INVALID_CERTIFICATES", False),
+            mongo_read_preference=_env("MONGO_READ_PREFERENCE", "primaryPreferred"),
+            mongo_analytics_read_preference=_env("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred"),
+            mongo_analytics_max_staleness_seconds=_env_int("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", 120),
+            mongo_server_selection_timeout_ms=_env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+            mongo_connect_timeout_ms=_env_int("MONGO_CONNECT_TIMEOUT_MS", 5000),
+            mongo_socket_timeout_ms=_env_int("MONGO_SOCKET_TIMEOUT_MS", 30000),
+            mongo_max_pool_size=_env_int("MONGO_MAX_POOL_SIZE", 20),
+            mongo_min_pool_size=_env_int("MONGO_MIN_POOL_SIZE", 2),
+            mongo_max_idle_time_ms=_env_int("MONGO_MAX_IDLE_TIME_MS", 300000),
+            mongo_wait_queue_timeout_ms=_env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+            mongo_max_connecting=_env_int("MONGO_MAX_CONNECTING", 2),
+            mongo_monitoring=_env_bool("MONGO_MONITORING", True),
+            mongo_slow_checkout_ms=_env_float("MONGO_SLOW_CHECKOUT_MS", 50),
+            groq_api_key=os.getenv("GROQ_API_KEY"),
+            llm_timeout_seconds=_env_float("LLM_TIMEOUT_SECONDS", 45),
+            llm_max_retries=_env_int("LLM_MAX_RETRIES", 1),
+            llm_breaker_window_seconds=_env_float("LLM_BREAKER_WINDOW_SECONDS", 60),
+            llm_breaker_min_calls=_env_int("LLM_BREAKER_MIN_CALLS", 5),
+            llm_breaker_failure_rate=_env_float("LLM_BREAKER_FAILURE_RATE", 0.5),
+            llm_breaker_slow_call_seconds=_env_float("LLM_BREAKER_SLOW_CALL_SECONDS", 30),
+            llm_breaker_slow_call_rate=_env_float("LLM_BREAKER_SLOW_CALL_RATE", 0.8),
+            llm_breaker_open_seconds=_env_float("LLM_BREAKER_OPEN_SECONDS", 30),
+            llm_hedge_enabled=_env_bool("LLM_HEDGE_ENABLED", False),
+            llm_hedge_min_delay_seconds=_env_float("LLM_HEDGE_MIN_DELAY_SECONDS", 2),
+            llm_hedge_min_samples=_env_int("LLM_HEDGE_MIN_SAMPLES", 20),
+            llm_telemetry_window_seconds=_env_float("LLM_TELEMETRY_WINDOW_SECONDS", 3600),
+            llm_telemetry_max_samples=_env_int("LLM_TELEMETRY_MAX_SAMPLES", 10000),
+            # Groq list prices (USD per million tokens) of llama-3.3-70b-versatile
+            llm_prompt_price_per_million=_env_float("LLM_PROMPT_PRICE_PER_MILLION", 0.59),
+            llm_completion_price_per_million=_env_float("LLM_COMPLETION_PRICE_PER_MILLION", 0.79),
+            prompt_budget_overrides={
+                name[len("PROMPT_BUDGET_"):].lower(): int(value)
+                for name, value in os.environ.items()
+                if name.startswith("PROMPT_BUDGET_") and value
+            },
+            policy_tap_questions=_env_int("POLICY_TAP_QUESTIONS", 10),
+            attempt_flush_interval_seconds=_env_float("ATTEMPT_FLUSH_INTERVAL_SECONDS", 15),
+            attempt_idle_evict_seconds=_env_float("ATTEMPT_IDLE_EVICT_SECONDS", 7200),
+            attempt_store_backend=_env("ATTEMPT_STORE_BACKEND", "memory").lower(),
+            blob_store_backend=_env("BLOB_STORE_BACKEND", "gridfs").lower(),
+            blob_store_local_dir=_env("BLOB_STORE_LOCAL_DIR", os.path.join(BACKEND_DIR, "uploads", "blobs")),
+            blob_gridfs_bucket=_env("BLOB_GRIDFS_BUCKET", "policy_uploads"),
+            blob_chunk_bytes=_env_int("BLOB_CHUNK_BYTES", 1024 * 1024),
+            ingest_extract_workers=_env_int("INGEST_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)),
+            ingest_llm_concurrency=_env_int("INGEST_LLM_CONCURRENCY", 4),
+            ingest_insert_batch_size=_env_int("INGEST_INSERT_BATCH_SIZE", 50),
+            ingest_max_files=_env_int("INGEST_MAX_FILES", 200),
+            ingest_max_file_bytes=_env_int("INGEST_MAX_FILE_BYTES", 50 * 1024 * 1024),
+            ingest_max_total_bytes=_env_int("INGEST_MAX_TOTAL_BYTES", 500 * 1024 * 1024),
+            session_ttl_hours=_env_float("SESSION_TTL_HOURS", 72),
+            archive_after_days=_env_int("ARCHIVE_AFTER_DAYS", 180),
+            archive_interval_hours=_env_float("ARCHIVE_INTERVAL_HOURS", 24),
+            archive_batch_size=_env_int("ARCHIVE_BATCH_SIZE", 1000),
+            cleanup_batch_size=_env_int("CLEANUP_BATCH_SIZE", 500),
+            cleanup_batch_pause_seconds=_env_float("CLEANUP_BATCH_PAUSE_SECONDS", 0.05),
+            server_host=_env("HOST", "0.0.0.0"),
+            server_port=_env_int("PORT", 8000),
+            web_concurrency=_env_int("WEB_CONCURRENCY", os.cpu_count() or 1),
+            server_loop=_env("SERVER_LOOP"),
+            server_http=_env("SERVER_HTTP"),
+            graceful_shutdown_seconds=_env_int("GRACEFUL_SHUTDOWN_SECONDS", 25),
+            keep_alive_seconds=_env_int("KEEP_ALIVE_SECONDS", 5),
+            forwarded_allow_ips=_env("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+            access_log=_env_bool("ACCESS_LOG", True),
+            startup_budget_seconds=_env_float("STARTUP_BUDGET_SECONDS", 5),
+            server_timing_header=_env_bool("SERVER_TIMING_HEADER", True),
+            metrics_dir=_env("METRICS_DIR"),
+            compression_enabled=_env_bool("COMPRESSION_ENABLED", True),
+            compression_minimum_bytes=_env_int("COMPRESSION_MINIMUM_BYTES", 1024),
+            compression_gzip_level=_env_int("COMPRESSION_GZIP_LEVEL", 6),
+            compression_brotli_quality=_env_int("COMPRESSION_BROTLI_QUALITY", 4),
+            http_cache_max_age_seconds=_env_int("HTTP_CACHE_MAX_AGE_SECONDS", 3600),
+            log_level=_env("LOG_LEVEL", "INFO").upper(),
+            log_levels=_env("LOG_LEVELS"),
+            log_format=_env("LOG_FORMAT", "text" if _env("ENVIRONMENT", "development") == "development" else "json").lower(),
+            log_queue_size=_env_int("LOG_QUEUE_SIZE", 10000),
+            log_debug_sample_rate=_env_float("LOG_DEBUG_SAMPLE_RATE", 0.01),
+            log_debug_max_per_second=_env_int("LOG_DEBUG_MAX_PER_SECOND", 5),
+            loop_monitor_enabled=_env_bool("LOOP_MONITOR_ENABLED", True),
+            loop_monitor_interval_ms=_env_float("LOOP_MONITOR_INTERVAL_MS", 100),
+            loop_block_threshold_ms=_env_float("LOOP_BLOCK_THRESHOLD_MS", 100),
+            loop_monitor_window_seconds=_env_float("LOOP_MONITOR_WINDOW_SECONDS", 300),
+            profile_max_seconds=_env_float("PROFILE_MAX_SECONDS", 60),
+            profile_default_interval_ms=_env_float("PROFILE_DEFAULT_INTERVAL_MS", 10),
+        )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load `.env` and the environment once per process"""
+    load_dotenv()
+    return Settings.from_env()
@@ -0,0 +1,159 @@
+"""
+Structured, non-blocking logging
+
+`setup_logging` routes every `logging` record (including uvicorn's) through a
+bounded in-memory queue to a background thread that writes one JSON object
+per line to stdout. A log call on a request path therefore costs a queue put,
+not a blocking write; if stdout cannot keep up and the queue fills, records
+are dropped (counted in /metrics as log_records_dropped_total) instead of
+slowing requests down.
+
+Levels come from LOG_LEVEL, with per-module overrides in LOG_LEVELS
+("app.routes.escape_routes=DEBUG,uvicorn.access=WARNING"). LOG_FORMAT=text
+writes plain lines for local development.
+
+Per-answer details on gameplay routes go through `SampledLogger.debug`, which
+does nothing unless DEBUG is enabled for the module, then keeps a sample
+(LOG_DEBUG_SAMPLE_RATE) of at most LOG_DEBUG_MAX_PER_SECOND records per
+logger. Fields are passed as a callable so they are only built for records
+that are actually written.
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Union
+from app.utils.settings import get_settings
+from app.utils.request_metrics import registry
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+UVICORN_LOGGERS = ["uvicorn", "uvicorn.error", "uvicorn.access"]
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller and defers formatting to the listener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records stay in this process, so only resolve what may change before the listener
+        # runs (message arguments, the active exception); JSON encoding happens in its thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            registry.inc("log_records_dropped_total", ())
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """Install the queue handler on the root logger and start the writer thread (once per process)"""
+    global _listener
+    if _listener is not None:
+        return
+    settings = get_settings()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.log_format == "text":
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        stream_handler.setFormatter(JSONFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root = logging.getLogger()
+    root.handlers = [DroppingQueueHandler(log_queue)]
+    root.setLevel(settings.log_level)
+    # uvicorn configures its own stream handlers before importing the app
+    for name in UVICORN_LOGGERS:
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    for name, level in _parse_levels(settings.log_levels).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def stop_logging():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class SampledLogger:
+    """Debug logging for hot paths: sampled, rate limited and lazily built"""
+
+    def __init__(self, name: str):
+        settings = get_settings()
+        self.logger = logging.getLogger(name)
+        self.sample_rate = settings.log_debug_sample_rate
+        self.max_per_second = settings.log_debug_max_per_second
+        self._second = 0
+        self._emitted = 0
+        self._suppressed = 0
+
+    def _admit(self) -> bool:
+        if random.random() >= self.sample_rate:
+            return False
+        now = int(time.time())
+        if now != self._second:
+            self._second = now
+            self._emitted = 0
+        if self._emitted >= self.max_per_second:
+            self._suppressed += 1
+            return False
+        self._emitted += 1
+        return True
+
+    def debug(self, message: str, fields: Union[Callable[[], dict], dict, None] = None):
+        if not self.logger.isEnabledFor(logging.DEBUG) or not self._admit():
+            return
+        extra = fields() if callable(fields) else dict(fields or {})
+        if self._suppressed:
+            # Rate-limited records since the last one written
+            extra["suppressed"] = self._suppressed
+            self._suppressed = 0
+        self.logger.debug(message, extra=extra)
@@ -0,0 +1,10 @@
+"""
+Benchmarks that run without Groq or Atlas
+
+- `load_test`: player journeys against a running app backed by a local mongod
+  and `fake_groq`, with throughput and latency percentiles per route
+- `fake_groq`: a Groq-compatible chat completions server with configurable
+  latency and canned JSON for every generator
+- `micro`: micro-benchmarks of text extraction, structuring-response parsing
+  and answer scoring, with a JSON baseline to compare against
+"""
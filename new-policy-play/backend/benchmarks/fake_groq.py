@@ -0,0 +1,131 @@
+"""
+Groq-compatible chat completions server for benchmarks
+
+Answers POST /openai/v1/chat/completions (plain and streamed) with the canned
+JSON of the calling generator after a configurable delay, and reports token
+usage like Groq does. Point the app at it with GROQ_BASE_URL.
+
+Run: python -m benchmarks.fake_groq --port 8100 --latency-ms 800 --jitter-ms 300
+"""
+import time
+import uuid
+import json
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from benchmarks.fixtures import detect_call_site, canned_text
+
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_CHARS = 24
+
+
+class FakeGroqConfig:
+    latency_ms: float = 800
+    jitter_ms: float = 300
+    tokens_per_second: float = 400
+    error_rate: float = 0.0
+
+
+config = FakeGroqConfig()
+app = FastAPI(title="Fake Groq")
+calls = {}
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _time_to_first_token() -> float:
+    return max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    completion_time = completion_tokens / config.tokens_per_second
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "completion_time": completion_time,
+        "total_time": completion_time
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    call_site = detect_call_site(messages)
+    calls[call_site] = calls.get(call_site, 0) + 1
+
+    if random.random() < config.error_rate:
+        await asyncio.sleep(_time_to_first_token())
+        return JSONResponse({"error": {"message": "Simulated upstream error", "type": "internal_server_error"}},
+                            status_code=503)
+
+    text = canned_text(call_site)
+    prompt_tokens = sum(_tokens(message.get("content", "")) for message in messages)
+    completion_tokens = _tokens(text)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "fake")
+
+    if not body.get("stream"):
+        # Whole generation time up front, as a non-streamed completion arrives in one piece
+        await asyncio.sleep(_time_to_first_token() + completion_tokens / config.tokens_per_second)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": _usage(prompt_tokens, completion_tokens)
+        }
+
+    async def events():
+        await asyncio.sleep(_time_to_first_token())
+        chunk_delay = _tokens(text[:STREAM_CHUNK_CHARS]) / config.tokens_per_second
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": text[start:start + STREAM_CHUNK_CHARS]}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(chunk_delay)
+        final = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": completion_id, "usage": _usage(prompt_tokens, completion_tokens)}
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/calls")
+async def get_calls():
+    """Requests received per call site"""
+    return calls
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Groq-compatible chat completions server with canned responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms, help="Mean time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms, help="Standard deviation of the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=config.tokens_per_second, help="Generation speed")
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="Share of requests answered with 503")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    args = parse_args()
+    config.latency_ms = args.latency_ms
+    config.jitter_ms = args.jitter_ms
+    config.tokens_per_second = args.tokens_per_second
+    config.error_rate = args.error_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
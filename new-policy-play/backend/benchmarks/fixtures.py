@@ -0,0 +1,177 @@
+"""
+Sample policy and canned LLM responses shared by the benchmarks
+
+The canned responses have the shape each generator expects, so benchmarked
+requests take the same code path as with real Groq output (no fallbacks).
+"""
+import json
+from typing import List
+
+SAMPLE_POLICY = {
+    "title": "Information Security Policy",
+    "summary": "Rules for protecting company information, devices and accounts.",
+    "rules": [
+        "Employees must lock their screen when leaving their workstation.",
+        "Passwords must be at least 12 characters long and must not be reused.",
+        "Confidential documents must be stored only on approved company drives.",
+        "Security incidents must be reported to the security team within 24 hours.",
+        "Visitors must be escorted at all times inside restricted areas.",
+        "Multi-factor authentication must be enabled on all company accounts.",
+        "Customer data must not be sent to personal email addresses.",
+        "Laptops must use full-disk encryption.",
+    ],
+    "roles": [
+        "Security team: investigates incidents and maintains security controls.",
+        "Managers: approve access requests for their teams.",
+        "Employees: follow the policy and report incidents.",
+    ],
+    "clauses": [
+        "Access to systems is granted on a least-privilege basis.",
+        "Violations may lead to disciplinary action.",
+    ],
+    "definitions": [
+        "Confidential data: information whose disclosure could harm the company or its customers.",
+        "Security incident: any event that compromises the confidentiality, integrity or availability of information.",
+        "Restricted area: a location where only authorised staff may enter without an escort.",
+        "Multi-factor authentication: a login that requires two or more independent proofs of identity.",
+        "Approved drive: a company-managed storage location with backups and access control.",
+        "Least privilege: granting only the access needed to perform a task.",
+    ],
+    "exceptions": [
+        "Screen locking is not required in single-occupant locked offices.",
+        "Service accounts may use hardware keys instead of passwords with the security team's approval.",
+        "Contractors may use personal devices for email if enrolled in device management.",
+        "Incident reports may be delayed when reporting would alert an ongoing attacker.",
+    ],
+    "risks": [
+        "Data breaches through lost or stolen laptops.",
+        "Account takeover through reused passwords.",
+    ],
+    "policy_sections": [
+        "Scope", "Access control", "Data handling", "Incident reporting", "Physical security",
+    ],
+}
+
+SAMPLE_RAW_TEXT = "\n\n".join(
+    [SAMPLE_POLICY["title"], SAMPLE_POLICY["summary"]]
+    + [f"{section}." for section in SAMPLE_POLICY["policy_sections"]]
+    + SAMPLE_POLICY["rules"] + SAMPLE_POLICY["definitions"] + SAMPLE_POLICY["exceptions"]
+    + SAMPLE_POLICY["roles"] + SAMPLE_POLICY["clauses"] + SAMPLE_POLICY["risks"]
+)
+
+# Distinctive text of each generator's system prompt -> call site
+CALL_SITE_MARKERS = [
+    ("definition matching puzzles", "room1"),
+    ("exception identification puzzles", "room2"),
+    ("rule selection puzzles", "room3"),
+    ("violation repair puzzles", "room4"),
+    ("multi-part compliance puzzles", "room5"),
+    ("extracting structured information", "structure"),
+    ("policy analyst", "analyze"),
+    ("specializing in violation detection", "violation"),
+    ("realistic workplace scenarios", "scenario"),
+    ("policy compliance questions", "policy_tap"),
+]
+
+
+def detect_call_site(messages: List[dict]) -> str:
+    """Call site of a chat request, recognised from its system prompt"""
+    system = " ".join(message.get("content", "") for message in messages if message.get("role") == "system")
+    for marker, call_site in CALL_SITE_MARKERS:
+        if marker in system:
+            return call_site
+    return "unknown"
+
+
+def _term(definition: str) -> str:
+    return definition.split(":", 1)[0]
+
+
+def _meaning(definition: str) -> str:
+    return definition.split(":", 1)[1].strip()
+
+
+def _wrong(options: List[str], correct: str, count: int = 3) -> List[str]:
+    return [option for option in options if option != correct][:count]
+
+
+def canned_response(call_site: str) -> dict:
+    """A valid JSON response for the call site"""
+    rules = SAMPLE_POLICY["rules"]
+    definitions = SAMPLE_POLICY["definitions"]
+    exceptions = SAMPLE_POLICY["exceptions"]
+    meanings = [_meaning(definition) for definition in definitions]
+
+    if call_site == "structure":
+        return SAMPLE_POLICY
+    if call_site == "room1":
+        return {"puzzles": [
+            {"term": _term(definition), "definition": _meaning(definition),
+             "wrong_options": _wrong(meanings, _meaning(definition))}
+            for definition in definitions[:5]
+        ]}
+    if call_site == "room2":
+        return {"puzzles": [
+            {"rule": rules[index], "scenario": f"An employee asks whether this applies: {exceptions[index]}",
+             "correct_exception": exceptions[index], "wrong_exceptions": _wrong(exceptions, exceptions[index])}
+            for index in range(len(exceptions))
+        ]}
+    if call_site == "room3":
+        return {"puzzles": [
+            {"scenario": f"A colleague is unsure what to do. Which rule applies? ({index + 1})",
+             "correct_rule": rule, "wrong_rules": _wrong(rules, rule)}
+            for index, rule in enumerate(rules[:5])
+        ]}
+    if call_site == "room4":
+        return {"puzzles": [
+            {"scenario": f"An employee ignores this rule: {rule}", "violation": f"The employee did not follow: {rule}",
+             "fix": rule, "explanation": "The fix restores compliance with the policy rule."}
+            for rule in rules[:5]
+        ]}
+    if call_site == "room5":
+        return {
+            "scenario": "A visitor walks into a restricted area while an unlocked laptop shows customer data.",
+            "definition_question": {"term": _term(definitions[2]), "definition": _meaning(definitions[2]),
+                                    "wrong_options": "; ".join(_wrong(meanings, _meaning(definitions[2])))},
+            "rule_question": {"scenario": "Who should accompany the visitor?", "correct_rule": rules[4],
+                              "wrong_rules": "; ".join(_wrong(rules, rules[4]))},
+            "exception_question": {"rule": rules[0], "scenario": "The laptop is in a locked private office.",
+                                   "correct_exception": exceptions[0],
+                                   "wrong_exceptions": "; ".join(_wrong(exceptions, exceptions[0]))},
+            "violation_question": {"scenario": "The laptop was left unlocked.", "violation": "Screen not locked",
+                                   "fix": rules[0], "explanation": "Locking the screen prevents unauthorised access."}
+        }
+    if call_site == "policy_tap":
+        return {"questions": [
+            {"question": f"Which statement matches the policy? (question {index + 1})",
+             "correct": rule, "wrong_options": _wrong(rules, rule, 4)}
+            for index, rule in enumerate(rules * 3)
+        ]}
+    if call_site == "scenario":
+        return {
+            "scenario_text": "You need to step away from your desk for a meeting. What should you do?",
+            "options": ["Lock the screen", "Leave it unlocked", "Ask a visitor to watch it", "Turn off the monitor"],
+            "correct_answer": 0,
+            "explanation": "The policy requires employees to lock their screen when leaving their workstation.",
+            "policy_rule_used": rules[0]
+        }
+    if call_site == "violation":
+        violation_text = "emailed the customer list to his personal address"
+        return {
+            "scenario_text": f"Before a trip, Sam {violation_text} so he could work offline.",
+            "violation_text": violation_text,
+            "violation_start": 0,
+            "violation_end": 0,
+            "explanation": "Customer data must never be sent to personal email addresses.",
+            "policy_rule_violated": rules[6]
+        }
+    if call_site == "analyze":
+        return {
+            "contradictions": [], "missing_sections": ["Remote work"], "overlapping_content": [],
+            "ambiguous_phrases": ["approved company drives"], "recommendations": ["Define approved drives."]
+        }
+    return {}
+
+
+def canned_text(call_site: str) -> str:
+    return json.dumps(canned_response(call_site))
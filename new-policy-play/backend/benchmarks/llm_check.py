@@ -0,0 +1,97 @@
+"""
+Smoke check of the LLM gateway against the fake Groq server
+
+Starts `benchmarks.fake_groq`, points the Groq client at it and sends one
+`chat_json` and one `chat_stream` request per call site. Every response must
+parse as JSON, the telemetry must record the calls as ok and the circuit
+breaker must stay closed. Exits with status 1 otherwise, so a broken gateway
+(e.g. an SDK change in how responses are parsed) is caught without a Groq key.
+
+Run: python -m benchmarks.llm_check
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import subprocess
+from benchmarks.fixtures import CALL_SITE_MARKERS
+from benchmarks.load_test import free_port, wait_for_http
+
+CHECKED_CALL_SITES = ["structure", "room1", "scenario", "policy_tap"]
+
+
+def _messages(call_site: str) -> list:
+    marker = next(marker for marker, site in CALL_SITE_MARKERS if site == call_site)
+    return [
+        {"role": "system", "content": f"You are an assistant {marker}. Respond with JSON only."},
+        {"role": "user", "content": "Generate the content for the sample policy."}
+    ]
+
+
+async def check_gateway(call_sites: list) -> list:
+    """Problems found, empty if every call succeeded"""
+    # Imported after GROQ_BASE_URL is set: the client and settings are created on import
+    from app.services.llm_service import chat_json, chat_stream, breaker, close_llm_client
+    from app.services.llm_telemetry import telemetry_snapshot
+
+    problems = []
+    try:
+        for call_site in call_sites:
+            for mode in ("json", "stream"):
+                try:
+                    if mode == "json":
+                        text = await chat_json(_messages(call_site), call_site)
+                    else:
+                        text = "".join([delta async for delta in chat_stream(_messages(call_site), call_site)])
+                    json.loads(text)
+                    print(f"ok    {call_site:<12} {mode:<6} {len(text)} chars")
+                except Exception as e:
+                    problems.append(f"{call_site} ({mode}): {type(e).__name__}: {e}")
+                    print(f"FAIL  {call_site:<12} {mode:<6} {type(e).__name__}: {e}")
+    finally:
+        await close_llm_client()
+
+    for entry in telemetry_snapshot()["call_sites"]:
+        failed = entry["calls"] - entry["outcomes"].get("ok", 0)
+        if failed:
+            problems.append(f"telemetry of {entry['call_site']} records {failed} failed calls")
+    if breaker.state != breaker.CLOSED:
+        problems.append(f"circuit breaker is {breaker.state}")
+    return problems
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the LLM gateway against the fake Groq server")
+    parser.add_argument("--call-sites", nargs="+", default=CHECKED_CALL_SITES,
+                        choices=[call_site for _, call_site in CALL_SITE_MARKERS])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    port = free_port()
+    fake_groq = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_groq", "--port", str(port),
+        "--latency-ms", "20", "--jitter-ms", "0", "--tokens-per-second", "100000"
+    ])
+    try:
+        wait_for_http(f"http://127.0.0.1:{port}/calls", 30, fake_groq)
+        os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{port}"
+        os.environ.setdefault("GROQ_API_KEY", "fake")
+        os.environ["LLM_HEDGE_ENABLED"] = "false"
+        problems = asyncio.run(check_gateway(args.call_sites))
+    finally:
+        fake_groq.terminate()
+        fake_groq.wait()
+
+    if problems:
+        print("\nLLM gateway check failed:")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("\nLLM gateway check passed")
+
+
+if __name__ == "__main__":
+    main()
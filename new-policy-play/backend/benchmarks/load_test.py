@@ -0,0 +1,418 @@
+"""
+Load test with scripted player journeys
+
+Starts a throwaway mongod (or uses --mongo-uri), the fake Groq server and the
+app itself (production server, --workers processes), seeds policies, then runs
+virtual players at the requested concurrency. Each player signs up and plays
+one journey:
+- escape: generate -> start -> submit rooms 1-5 -> finish -> leaderboard
+- policy_tap: generate -> start -> N submits -> finish -> leaderboard
+
+Reports throughput and latency percentiles per route (and optionally compares
+them with an earlier report), so regressions are caught before deploy.
+
+Run: python -m benchmarks.load_test --users 200 --concurrency 20 --journey mixed --report load.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEVELS = ["beginner", "intermediate", "expert"]
+JOURNEYS = ["escape", "policy_tap"]
+
+
+class JourneyError(Exception):
+    """A request of a journey failed; the player stops there"""
+
+
+class RouteStats:
+    """Latencies and status codes per route template"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+
+    def record(self, route: str, status_code: int, seconds: float):
+        self.latencies.setdefault(route, []).append(seconds * 1000)
+        codes = self.statuses.setdefault(route, {})
+        codes[status_code] = codes.get(status_code, 0) + 1
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        from app.utils.db_metrics import summarize
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            errors = sum(count for code, count in self.statuses[route].items() if code >= 400)
+            routes[route] = {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0,
+                "statuses": {str(code): count for code, count in sorted(self.statuses[route].items())},
+                "latency_ms": summarize(samples)
+            }
+        return routes
+
+
+class Player:
+    """One virtual player and its token (players share the connection pool)"""
+
+    def __init__(self, client: httpx.AsyncClient, stats: RouteStats):
+        self.client = client
+        self.stats = stats
+        self.headers: Dict[str, str] = {}
+
+    async def call(self, method: str, route: str, path: str, **kwargs) -> dict:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=self.headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(route, 599, time.perf_counter() - started)
+            raise JourneyError(f"{route}: {e}")
+        self.stats.record(route, response.status_code, time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise JourneyError(f"{route}: HTTP {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    async def sign_up(self, run_id: str, number: int):
+        token = await self.call("POST", "POST /api/auth/signup", "/api/auth/signup", json={
+            "email": f"player-{run_id}-{number}@loadtest.example.com",
+            "name": f"Player {number}",
+            "password": "loadtest-password"
+        })
+        self.headers = {"Authorization": f"Bearer {token['access_token']}"}
+
+
+async def escape_journey(player: Player, policy_id: str, level: str, args):
+    room_set = await player.call("POST", "POST /api/escape/generate/{policy_id}",
+                                 f"/api/escape/generate/{policy_id}", params={"level": level})
+    attempt = await player.call("POST", "POST /api/escape/start", "/api/escape/start",
+                                json={"escape_room_id": room_set["escape_room_id"]})
+    attempt_id = attempt["attempt_id"]
+    rooms = room_set["rooms"]
+    master = rooms.get("room5") or {}
+    answers = {
+        1: {"selected_definition": rooms["room1"][0].get("definition", "")},
+        2: {"selected_exception": rooms["room2"][0].get("correct_exception", "")},
+        3: {"selected_rule": rooms["room3"][0].get("correct_rule", "")},
+        4: {"fix": rooms["room4"][0].get("fix", "")},
+        5: {
+            "definition_answer": master.get("definition_question", {}).get("definition", ""),
+            "rule_answer": master.get("rule_question", {}).get("correct_rule", ""),
+            "exception_answer": master.get("exception_question", {}).get("correct_exception", ""),
+            "violation_fix": master.get("violation_question", {}).get("fix", "")
+        }
+    }
+    for room_number, answer in answers.items():
+        await think(args)
+        await player.call("POST", "POST /api/escape/submit/{attempt_id}", f"/api/escape/submit/{attempt_id}",
+                          json={"room_number": room_number, "answer": {**answer, "time_taken": 30}})
+    await player.call("POST", "POST /api/escape/finish/{attempt_id}", f"/api/escape/finish/{attempt_id}",
+                      params={"time_taken": 180})
+    await player.call("GET", "GET /api/escape/leaderboard", "/api/escape/leaderboard", params={"level": level})
+
+
+async def policy_tap_journey(player: Player, policy_id: str, level: str, args):
+    game_set = await player.call("POST", "POST /api/policy-tap/generate/{policy_id}",
+                                 f"/api/policy-tap/generate/{policy_id}", params={"level": level})
+    attempt = await player.call("POST", "POST /api/policy-tap/start", "/api/policy-tap/start",
+                                json={"game_set_id": game_set["game_set_id"]})
+    questions = attempt["questions"]
+    for index in range(min(args.submits, len(questions))):
+        await think(args)
+        question = questions[index]
+        wrong = random.random() < args.wrong_rate and question.get("wrong_options")
+        await player.call("POST", "POST /api/policy-tap/submit", "/api/policy-tap/submit", json={
+            "attempt_id": attempt["attempt_id"],
+            "question_index": index,
+            "selected_option": question["wrong_options"][0] if wrong else question["correct"],
+            "time_taken": round(random.uniform(0.5, 4), 2)
+        })
+    await player.call("POST", "POST /api/policy-tap/finish", "/api/policy-tap/finish",
+                      json={"attempt_id": attempt["attempt_id"], "final_time_taken": 60})
+    await player.call("GET", "GET /api/policy-tap/leaderboard", "/api/policy-tap/leaderboard",
+                      params={"policy_id": policy_id, "level": level})
+
+
+async def think(args):
+    if args.think_ms:
+        await asyncio.sleep(random.uniform(0, 2 * args.think_ms) / 1000)
+
+
+async def run_players(args, base_url: str, policy_ids: List[str]) -> dict:
+    stats = RouteStats()
+    run_id = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    outcomes = {"completed": 0, "failed": 0}
+    failures: Dict[str, int] = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        async def play(number: int):
+            async with semaphore:
+                player = Player(client, stats)
+                journey = random.choice(JOURNEYS) if args.journey == "mixed" else args.journey
+                try:
+                    await player.sign_up(run_id, number)
+                    play_journey = escape_journey if journey == "escape" else policy_tap_journey
+                    await play_journey(player, random.choice(policy_ids), random.choice(args.levels), args)
+                    outcomes["completed"] += 1
+                except JourneyError as e:
+                    outcomes["failed"] += 1
+                    reason = str(e).split(":", 1)[0]
+                    failures[reason] = failures.get(reason, 0) + 1
+                    if args.verbose:
+                        print(f"❌ Player {number}: {e}")
+
+        started = time.perf_counter()
+        tasks = []
+        for number in range(args.users):
+            tasks.append(asyncio.create_task(play(number)))
+            if args.ramp_seconds:
+                await asyncio.sleep(args.ramp_seconds / args.users)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "journeys": {**outcomes, "per_second": round(outcomes["completed"] / elapsed, 2) if elapsed else 0},
+        "failures": failures,
+        "routes": stats.report(elapsed)
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_http(url: str, timeout: float, process: Optional[subprocess.Popen] = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def start_mongod(workdir: str, log) -> Tuple[subprocess.Popen, str]:
+    mongod = shutil.which("mongod")
+    if not mongod:
+        raise RuntimeError("mongod not found on PATH; install MongoDB or pass --mongo-uri")
+    port = free_port()
+    dbpath = os.path.join(workdir, "mongod")
+    os.makedirs(dbpath)
+    process = subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    uri = f"mongodb://127.0.0.1:{port}"
+    from pymongo import MongoClient
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            MongoClient(uri, serverSelectionTimeoutMS=500).admin.command("ping")
+            return process, uri
+        except Exception:
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"mongod did not start (see {log.name})")
+            time.sleep(0.2)
+
+
+async def seed_policies(count: int) -> List[str]:
+    """Insert `count` copies of the sample policy through the app's own storage code"""
+    from bson import ObjectId
+    from app.utils.db import connect_to_mongo, get_database, close_mongo_connection
+    from app.utils.blob_store import get_blob_store
+    from app.utils.policy_store import insert_policies
+    from app.services.policy_ingest import build_policy_document
+    from benchmarks.fixtures import SAMPLE_POLICY, SAMPLE_RAW_TEXT
+
+    await connect_to_mongo()
+    try:
+        db = await get_database()
+        blob_store = await get_blob_store()
+        uploader = {"_id": ObjectId(), "name": "Load test"}
+        documents = []
+        for index in range(count):
+            raw_text = f"{SAMPLE_RAW_TEXT}\n\nCopy {index + 1}"
+
+            async def chunks(data=raw_text.encode()):
+                yield data
+
+            blob = await blob_store.put(chunks(), f"loadtest-{index + 1}.txt", "text/plain")
+            structured = {**SAMPLE_POLICY, "title": f"{SAMPLE_POLICY['title']} #{index + 1}"}
+            documents.append(build_policy_document(f"loadtest-{index + 1}.txt", "text/plain", blob, uploader,
+                                                   structured, raw_text))
+        policy_ids = await insert_policies(db, documents)
+    finally:
+        await close_mongo_connection()
+    return [str(policy_id) for policy_id in policy_ids if policy_id is not None]
+
+
+def stop_process(process: Optional[subprocess.Popen], timeout: float = 30):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def compare_reports(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Routes whose p95 grew by more than `tolerance` (a fraction) over the baseline"""
+    regressions = []
+    for route, entry in current["routes"].items():
+        before = baseline.get("routes", {}).get(route, {}).get("latency_ms", {}).get("p95")
+        after = entry["latency_ms"].get("p95")
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{route}: p95 {before:.1f}ms -> {after:.1f}ms")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n{'route':<46} {'reqs':>6} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for route, entry in report["routes"].items():
+        latency = entry["latency_ms"]
+        print(f"{route:<46} {entry['requests']:>6} {entry['errors']:>5} {entry['throughput_rps']:>8} "
+              f"{latency.get('p50', 0):>8} {latency.get('p95', 0):>8} {latency.get('p99', 0):>8} {latency.get('max', 0):>8}")
+    journeys = report["journeys"]
+    print(f"\n{journeys['completed']} journeys completed, {journeys['failed']} failed in {report['elapsed_seconds']}s "
+          f"({journeys['per_second']} journeys/s)")
+    if report.get("llm_calls"):
+        print(f"LLM calls: {', '.join(f'{site} {count}' for site, count in sorted(report['llm_calls'].items()))}")
+
+
+def configure_environment(args, mongo_uri: str, groq_port: int, app_port: int):
+    """Settings for the app under test; set in this process too so seeding uses the same database"""
+    os.environ.update({
+        "ENVIRONMENT": "production",
+        "HOST": "127.0.0.1",
+        "PORT": str(app_port),
+        "WEB_CONCURRENCY": str(args.workers),
+        "MONGO_URI": mongo_uri,
+        "MONGO_DATABASE": args.database,
+        "MONGO_TLS": "false",
+        "GROQ_API_KEY": "fake-key",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{groq_port}",
+        "SECRET_KEY": "load-test-secret",
+        "ACCESS_LOG": "false",
+        "LOG_LEVEL": "WARNING",
+    })
+
+
+def run(args) -> int:
+    workdir = tempfile.mkdtemp(prefix="policyplay-loadtest-")
+    print(f"📁 Logs in {workdir}")
+    processes = []
+    try:
+        with open(os.path.join(workdir, "mongod.log"), "w") as mongod_log, \
+                open(os.path.join(workdir, "fake_groq.log"), "w") as groq_log, \
+                open(os.path.join(workdir, "app.log"), "w") as app_log:
+            if args.mongo_uri:
+                mongo_uri = args.mongo_uri
+                from pymongo import MongoClient
+                # A dedicated database, emptied so runs are comparable
+                MongoClient(mongo_uri).drop_database(args.database)
+            else:
+                mongod, mongo_uri = start_mongod(workdir, mongod_log)
+                processes.append(mongod)
+                print(f"🍃 mongod at {mongo_uri}")
+
+            groq_port, app_port = free_port(), free_port()
+            fake_groq = subprocess.Popen([
+                sys.executable, "-m", "benchmarks.fake_groq", "--port", str(groq_port),
+                "--latency-ms", str(args.groq_latency_ms), "--jitter-ms", str(args.groq_jitter_ms),
+                "--tokens-per-second", str(args.groq_tokens_per_second), "--error-rate", str(args.groq_error_rate)
+            ], cwd=BACKEND_DIR, stdout=groq_log, stderr=subprocess.STDOUT)
+            processes.append(fake_groq)
+            wait_for_http(f"http://127.0.0.1:{groq_port}/calls", 30, fake_groq)
+            print(f"🤖 Fake Groq at http://127.0.0.1:{groq_port} ({args.groq_latency_ms:.0f}ms ± {args.groq_jitter_ms:.0f}ms)")
+
+            configure_environment(args, mongo_uri, groq_port, app_port)
+            policy_ids = asyncio.run(seed_policies(args.policies))
+            print(f"📄 Seeded {len(policy_ids)} policies")
+
+            app = subprocess.Popen([sys.executable, "main.py"], cwd=BACKEND_DIR, env=os.environ.copy(),
+                                   stdout=app_log, stderr=subprocess.STDOUT)
+            processes.append(app)
+            base_url = f"http://127.0.0.1:{app_port}"
+            wait_for_http(f"{base_url}/health", 60, app)
+            print(f"🚀 App at {base_url} with {args.workers} workers")
+
+            print(f"🏃 {args.users} players ({args.journey}), concurrency {args.concurrency}")
+            report = asyncio.run(run_players(args, base_url, policy_ids))
+            report["llm_calls"] = httpx.get(f"http://127.0.0.1:{groq_port}/calls").json()
+            report["config"] = {key: value for key, value in vars(args).items() if key not in ("report", "compare")}
+    finally:
+        for process in reversed(processes):
+            stop_process(process)
+
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Report written to {args.report}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"⚠️ Regression: {regression}")
+        failed = bool(regressions)
+    total = sum(entry["requests"] for entry in report["routes"].values())
+    errors = sum(entry["errors"] for entry in report["routes"].values())
+    if total and errors / total > args.max_error_rate:
+        print(f"⚠️ Error rate {errors / total:.1%} above {args.max_error_rate:.1%}")
+        failed = True
+    return 1 if failed else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the API with scripted player journeys")
+    parser.add_argument("--users", type=int, default=100, help="Players in total (one journey each)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Players playing at the same time")
+    parser.add_argument("--journey", choices=JOURNEYS + ["mixed"], default="mixed")
+    parser.add_argument("--submits", type=int, default=10, help="Answers per Policy Tap game")
+    parser.add_argument("--levels", nargs="+", choices=LEVELS, default=LEVELS)
+    parser.add_argument("--policies", type=int, default=3, help="Policies seeded (each level is generated once per policy)")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a player's answers")
+    parser.add_argument("--wrong-rate", type=float, default=0.2, help="Share of wrong Policy Tap answers")
+    parser.add_argument("--ramp-seconds", type=float, default=0, help="Spread player arrivals over this time")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--workers", type=int, default=2, help="App worker processes")
+    parser.add_argument("--mongo-uri", help="Use this MongoDB instead of starting a throwaway mongod")
+    parser.add_argument("--database", default="policyplay_loadtest", help="Database name (dropped first with --mongo-uri)")
+    parser.add_argument("--groq-latency-ms", type=float, default=800)
+    parser.add_argument("--groq-jitter-ms", type=float, default=300)
+    parser.add_argument("--groq-tokens-per-second", type=float, default=400)
+    parser.add_argument("--groq-error-rate", type=float, default=0.0)
+    parser.add_argument("--report", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Earlier JSON report; exit 1 if a route's p95 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 growth over --compare (fraction)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Exit 1 above this share of failed requests")
+    parser.add_argument("--verbose", action="store_true", help="Print every failed journey")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
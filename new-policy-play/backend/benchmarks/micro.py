@@ -0,0 +1,319 @@
+"""
+Micro-benchmarks of parser and scoring hot paths
+
+- text extraction from generated PDF and DOCX documents of 1-500 pages
+  (`read_pdf_text`/`read_docx_text`, the blocking work behind
+  `extract_text_from_pdf`/`extract_text_from_docx`), in pages/sec
+- post-processing of structuring responses (`parse_structure_response`)
+- escape room answer checking (`check_room_answer`, every room)
+- Policy Tap scoring (`score_answer`)
+
+Each benchmark is repeated for at least --min-time seconds. Results can be
+saved as a JSON baseline and later runs compared with it; a benchmark whose
+throughput dropped by more than --tolerance fails the comparison.
+
+Run: python -m benchmarks.micro --save baseline.json
+     python -m benchmarks.micro --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import zipfile
+import platform
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from xml.sax.saxutils import escape
+from benchmarks.fixtures import SAMPLE_POLICY, canned_response, canned_text
+
+DEFAULT_PAGES = [1, 10, 100, 500]
+LINES_PER_PAGE = 45
+# A round of a fast benchmark repeats the call until it takes at least this long
+MIN_ROUND_SECONDS = 0.01
+
+
+def _page_lines(page: int) -> List[str]:
+    """Policy-like text for one page"""
+    sentences = SAMPLE_POLICY["rules"] + SAMPLE_POLICY["definitions"] + SAMPLE_POLICY["exceptions"]
+    lines = [f"Section {page}. {SAMPLE_POLICY['policy_sections'][page % len(SAMPLE_POLICY['policy_sections'])]}"]
+    for index in range(LINES_PER_PAGE - 1):
+        lines.append(sentences[(page + index) % len(sentences)][:95])
+    return lines
+
+
+def write_pdf(path: str, pages: int):
+    """A text-only PDF with `pages` pages (Helvetica, no external libraries)"""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")
+    pages_id = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for page in range(pages):
+        text = "".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '\n"
+            for line in _page_lines(page)
+        )
+        stream = f"BT /F1 10 Tf 14 TL 50 790 Td\n{text}ET".encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content, font)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), pages
+    )
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, "wb") as pdf_file:
+        pdf_file.write(output)
+
+
+def write_docx(path: str, pages: int):
+    """A DOCX with `pages` pages of paragraphs separated by page breaks"""
+    paragraphs = []
+    for page in range(pages):
+        for line in _page_lines(page):
+            paragraphs.append(f"<w:p><w:r><w:t>{escape(line)}</w:t></w:r></w:p>")
+        paragraphs.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{"".join(paragraphs)}</w:body></w:document>'
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        archive.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>'
+        ))
+        archive.writestr("word/document.xml", document)
+
+
+def build_corpus(corpus_dir: str, page_counts: List[int]) -> Dict[str, str]:
+    """Generate (or reuse) one PDF and one DOCX per page count"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = {}
+    for pages in page_counts:
+        for extension, write in (("pdf", write_pdf), ("docx", write_docx)):
+            path = os.path.join(corpus_dir, f"policy-{pages}p.{extension}")
+            if not os.path.exists(path):
+                write(path, pages)
+            corpus[f"{extension}_{pages}p"] = path
+    return corpus
+
+
+def measure(func: Callable[[], object], min_time: float, max_time: float) -> dict:
+    """Time repeated calls of `func`; fast calls are looped so each round lasts MIN_ROUND_SECONDS"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_ROUND_SECONDS:
+            break
+        loops *= 10
+
+    per_call = [elapsed / loops]
+    total = elapsed
+    while (total < min_time or len(per_call) < 3) and total < max_time:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        per_call.append(elapsed / loops)
+        total += elapsed
+
+    mean = statistics.mean(per_call)
+    return {
+        "rounds": len(per_call),
+        "loops": loops,
+        "mean_ms": round(mean * 1000, 4),
+        "min_ms": round(min(per_call) * 1000, 4),
+        "max_ms": round(max(per_call) * 1000, 4),
+        "stdev_ms": round(statistics.stdev(per_call) * 1000, 4) if len(per_call) > 1 else 0.0,
+        "ops_per_sec": round(1 / mean, 2)
+    }
+
+
+def extraction_benchmarks(corpus: Dict[str, str]) -> Dict[str, tuple]:
+    from app.services.parser_service import read_pdf_text, read_docx_text
+    benchmarks = {}
+    for name, path in corpus.items():
+        extension, pages = name.split("_")
+        read = read_pdf_text if extension == "pdf" else read_docx_text
+        benchmarks[f"extract_{name}"] = (lambda read=read, path=path: read(path), int(pages.rstrip("p")), "pages")
+    return benchmarks
+
+
+def structure_benchmarks() -> Dict[str, tuple]:
+    from app.services.groq_service import parse_structure_response
+    response = canned_text("structure")
+    large = json.dumps({field: value * 25 if isinstance(value, list) else value
+                        for field, value in SAMPLE_POLICY.items()})
+    wrapped = f"Here is the structured policy:\n```json\n{large}\n```"
+    # Fields missing or of the wrong type are filled in
+    partial = json.dumps({"title": SAMPLE_POLICY["title"], "rules": SAMPLE_POLICY["rules"], "roles": None, "risks": "n/a"})
+    return {
+        "structure_parse": (lambda: parse_structure_response(response), None, None),
+        "structure_parse_large": (lambda: parse_structure_response(large), None, None),
+        "structure_parse_wrapped": (lambda: parse_structure_response(wrapped), None, None),
+        "structure_parse_partial": (lambda: parse_structure_response(partial), None, None),
+    }
+
+
+def scoring_benchmarks() -> Dict[str, tuple]:
+    from app.routes.escape_routes import check_room_answer
+    from app.routes.policy_tap_routes import score_answer
+    # Stored the way escape_service saves them: puzzle lists for rooms 1-4, one master puzzle for room 5
+    rooms = {f"room{number}": canned_response(f"room{number}")["puzzles"] for number in range(1, 5)}
+    rooms["room5"] = canned_response("room5")
+    master = rooms["room5"]
+    answers = {
+        1: {"selected_definition": rooms["room1"][0]["definition"]},
+        2: {"selected_exception": rooms["room2"][0]["correct_exception"]},
+        3: {"selected_rule": "A rule that is not the right one"},
+        4: {"fix": "  " + rooms["room4"][0]["fix"].upper() + "  "},
+        5: {
+            "definition_answer": master["definition_question"]["definition"],
+            "rule_answer": master["rule_question"]["correct_rule"],
+            "exception_answer": master["exception_question"]["correct_exception"],
+            "violation_fix": master["violation_question"]["fix"]
+        }
+    }
+    benchmarks = {
+        f"escape_check_room{number}": (
+            lambda number=number, answer=answer: check_room_answer(number, rooms[f"room{number}"], answer), None, None
+        )
+        for number, answer in answers.items()
+    }
+    question = canned_response("policy_tap")["questions"][0]
+    benchmarks["policy_tap_score_correct"] = (lambda: score_answer(question, question["correct"], 1.2, False), None, None)
+    benchmarks["policy_tap_score_wrong"] = (lambda: score_answer(question, question["wrong_options"][0], 3.0, False), None, None)
+    benchmarks["policy_tap_score_missed"] = (lambda: score_answer(question, "", 5.0, True), None, None)
+    return benchmarks
+
+
+def run_benchmarks(args) -> dict:
+    benchmarks = {}
+    if "extraction" in args.groups:
+        corpus = build_corpus(args.corpus_dir, args.pages)
+        benchmarks.update(extraction_benchmarks(corpus))
+    if "structure" in args.groups:
+        benchmarks.update(structure_benchmarks())
+    if "scoring" in args.groups:
+        benchmarks.update(scoring_benchmarks())
+
+    results = {}
+    for name, (func, units, unit_name) in benchmarks.items():
+        if args.filter and args.filter not in name:
+            continue
+        result = measure(func, args.min_time, args.max_time)
+        if units:
+            result[f"{unit_name}_per_sec"] = round(units * result["ops_per_sec"], 2)
+        results[name] = result
+        throughput = f"{result[f'{unit_name}_per_sec']} {unit_name}/s" if units else f"{result['ops_per_sec']} ops/s"
+        print(f"{name:<32} {result['mean_ms']:>12.4f} ms  ± {result['stdev_ms']:<10.4f} {throughput:>18}  ({result['rounds']} rounds)")
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def throughput(result: dict) -> float:
+    """The metric compared across runs: pages/sec for extraction, ops/sec otherwise"""
+    return result.get("pages_per_sec", result["ops_per_sec"])
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Print the change per benchmark and return those slower than the baseline by more than `tolerance`"""
+    regressions = []
+    print(f"\n{'benchmark':<32} {'baseline':>14} {'current':>14} {'change':>9}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = throughput(baseline[name]), throughput(result)
+        change = (after - before) / before if before else 0.0
+        marker = ""
+        if change < -tolerance:
+            regressions.append(name)
+            marker = "  ⚠️ regression"
+        print(f"{name:<32} {before:>14.2f} {after:>14.2f} {change:>+8.1%}{marker}")
+    return regressions
+
+
+def main(args) -> int:
+    results = run_benchmarks(args)
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results
+    }
+    if args.save:
+        with open(args.save, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"\nResults written to {args.save}")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"Compared with {args.compare} ({baseline.get('git_commit') or 'unknown commit'})")
+        regressions = compare(results, baseline.get("benchmarks", {}), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of parser and scoring hot paths")
+    parser.add_argument("--groups", nargs="+", choices=["extraction", "structure", "scoring"],
+                        default=["extraction", "structure", "scoring"])
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this text")
+    parser.add_argument("--pages", nargs="+", type=int, default=DEFAULT_PAGES, help="Page counts of the generated documents")
+    parser.add_argument("--corpus-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".corpus"),
+                        help="Where generated documents are kept between runs")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds spent per benchmark (at least 3 rounds)")
+    parser.add_argument("--max-time", type=float, default=60.0, help="Stop repeating a slow benchmark after this long")
+    parser.add_argument("--save", help="Write results to this JSON file (e.g. a new baseline)")
+    parser.add_argument("--compare", help="Baseline JSON to compare with; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed throughput drop (fraction)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,66 @@
+"""
+Script to bulk-import policy documents
+Run: python ingest_policies.py <directory-or-zip> --admin-email admin@example.com
+"""
+import sys
+import json
+import asyncio
+import argparse
+from app.utils.db import connect_to_mongo, get_database, close_mongo_connection
+from app.services.llm_service import init_llm_client, close_llm_client
+from app.services.policy_ingest import collect_documents, ingest_documents
+
+
+def print_result(entry: dict):
+    status_icon = {"inserted": "✅", "duplicate": "⏭️", "failed": "❌"}.get(entry["status"], "•")
+    detail = entry.get("policy_id") or entry.get("duplicate_of") or f"{entry.get('stage')}: {entry.get('error')}"
+    print(f"{status_icon} {entry['filename']} ({entry['seconds']}s) {detail}")
+
+
+async def ingest(args):
+    documents = collect_documents(args.source)
+    if not documents:
+        print(f"No PDF or DOCX documents found in {args.source}")
+        return 1
+    print(f"Found {len(documents)} documents in {args.source}")
+
+    await connect_to_mongo()
+    init_llm_client()
+    try:
+        db = await get_database()
+        admin = await db.users.find_one({"email": args.admin_email, "role": "admin"})
+        if not admin:
+            print(f"No admin user with email {args.admin_email}. Create one with create_admin.py first.")
+            return 1
+
+        report = await ingest_documents(
+            db, documents, admin,
+            extract_workers=args.workers,
+            llm_concurrency=args.llm_concurrency,
+            on_result=print_result
+        )
+    finally:
+        await close_llm_client()
+        await close_mongo_connection()
+
+    print(f"\n{report['inserted']} inserted, {report['duplicate']} duplicates, {report['failed']} failed "
+          f"of {report['total']} in {report['elapsed_seconds']}s ({report['docs_per_minute']} docs/min)")
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=2, default=str)
+        print(f"Report written to {args.report}")
+    return 1 if report["failed"] else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk-import policy documents (PDF/DOCX) from a directory or zip")
+    parser.add_argument("source", help="Directory (searched recursively) or zip archive")
+    parser.add_argument("--admin-email", required=True, help="Admin recorded as the uploader")
+    parser.add_argument("--workers", type=int, help="Extraction processes (default INGEST_EXTRACT_WORKERS)")
+    parser.add_argument("--llm-concurrency", type=int, help="Structuring calls in flight (default INGEST_LLM_CONCURRENCY)")
+    parser.add_argument("--report", help="Also write the full JSON report to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(ingest(parse_args())))
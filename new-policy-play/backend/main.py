@@ -1,17 +1,85 @@
+import time
+_import_started = time.perf_counter()
+
+import os
+import glob
+import logging
+import tempfile
+import importlib.util
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.routes import policy_routes, auth_routes, game_routes, admin_routes, analysis_routes, escape_routes, policy_tap_routes
 from app.utils.db import connect_to_mongo, close_mongo_connection
+from app.utils.attempt_store import start_attempt_store, stop_attempt_store
+from app.utils.retention import start_retention, stop_retention
+from app.services.llm_service import breaker, init_llm_client, close_llm_client
+from app.services.policy_cleanup import resume_cleanup_jobs, stop_cleanup_jobs
+from app.utils.settings import get_settings
+from app.utils.request_metrics import (
+    RequestMetricsMiddleware, TimedJSONResponse, render_prometheus, start_metrics, stop_metrics, register_route_templates
+)
+from app.utils.structured_logging import setup_logging
+from app.utils.compression import CompressionMiddleware
+from app.utils.loop_monitor import start_loop_monitor, stop_loop_monitor
+
+settings = get_settings()
+# Every worker imports this module after uvicorn has configured its loggers; queued
+# records are written out at exit, after uvicorn's own shutdown messages
+setup_logging()
+logger = logging.getLogger(__name__)
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+
+def report_startup(timings: list):
+    """Print how long each startup phase took against STARTUP_BUDGET_SECONDS"""
+    total = sum(seconds for _, seconds in timings)
+    phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings)
+    if total > settings.startup_budget_seconds:
+        logger.warning("Worker %d startup took %.2fs, over the %.1fs budget (%s)",
+                       os.getpid(), total, settings.startup_budget_seconds, phases)
+    else:
+        logger.info("Worker %d ready in %.2fs (%s)", os.getpid(), total, phases)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler for startup and shutdown"""
-    # Startup
+    # Startup - runs once in every worker process, so each worker owns its clients
+    timings = [("imports", IMPORT_SECONDS)]
+    started = time.perf_counter()
     await connect_to_mongo()
+    timings.append(("mongo", time.perf_counter() - started))
+    
+    started = time.perf_counter()
+    init_llm_client()
+    timings.append(("llm client", time.perf_counter() - started))
+    
+    started = time.perf_counter()
+    await start_attempt_store()
+    timings.append(("attempt store", time.perf_counter() - started))
+    
+    started = time.perf_counter()
+    register_route_templates(app.routes)
+    await start_metrics()
+    await start_loop_monitor()
+    await start_retention()
+    timings.append(("retention", time.perf_counter() - started))
+    
+    started = time.perf_counter()
+    await resume_cleanup_jobs()
+    timings.append(("cleanup jobs", time.perf_counter() - started))
+    
+    report_startup(timings)
     yield
-    # Shutdown
+    # Shutdown (after in-flight requests have drained) - checkpoint live attempts before the connection goes away
+    await stop_attempt_store()
+    await stop_cleanup_jobs()
+    await stop_retention()
+    await stop_loop_monitor()
+    await stop_metrics()
+    await close_llm_client()
     await close_mongo_connection()
 
 
@@ -20,13 +88,13 @@ app = FastAPI(
     title="PolicyPlay API",
     description="API for converting policy documents to structured JSON",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=TimedJSONResponse
 )
 
 # Configure CORS - Allow all origins for EC2 deployment
 # In production, you can restrict this to specific domains
-import os
-cors_origins = os.getenv("CORS_ORIGINS", "").split(",") if os.getenv("CORS_ORIGINS") else []
+cors_origins = settings.cors_origins
 # Add default origins
 default_origins = [
     "http://localhost:3000",
@@ -50,6 +118,13 @@ app.add_middleware(
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
+# gzip/brotli for complete bodies over COMPRESSION_MINIMUM_BYTES (streams pass through)
+app.add_middleware(CompressionMiddleware)
+
+# Per-route latency, phase breakdown and payload sizes (Server-Timing header and /metrics);
+# added last so it wraps compression and measures the bytes actually sent
+app.add_middleware(RequestMetricsMiddleware)
+
 # Include routers
 app.include_router(auth_routes.router, prefix="/api/auth", tags=["auth"])
 app.include_router(policy_routes.router, prefix="/api", tags=["policy"])
@@ -65,16 +140,67 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "llm_circuit": breaker.state}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request metrics in the Prometheus text format (summed over workers when METRICS_DIR is set)"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.post("/health")
 async def health_check_post():
     """Test POST endpoint to verify backend connectivity"""
     return {"status": "healthy", "method": "POST", "message": "Backend is accepting POST requests"}
 
+def run_production_server(host: str, port: int):
+    """
+    Multi-worker server for production
+
+    Each worker is a separate process with its own event loop, Mongo client and
+    Groq client (created in `lifespan`). On SIGTERM uvicorn stops accepting
+    connections, lets in-flight requests finish for up to
+    GRACEFUL_SHUTDOWN_SECONDS and then runs the lifespan shutdown.
+    """
+    import uvicorn
+    workers = settings.web_concurrency
+    loop = settings.server_loop or ("uvloop" if importlib.util.find_spec("uvloop") else "asyncio")
+    http = settings.server_http or ("httptools" if importlib.util.find_spec("httptools") else "h11")
+    
+    # Workers do not share memory, so live attempts must be written through to Mongo
+    if workers > 1 and settings.attempt_store_backend == "memory":
+        logger.warning("Multiple workers: using ATTEMPT_STORE_BACKEND=mongo (write-behind cache is per process)")
+        os.environ["ATTEMPT_STORE_BACKEND"] = "mongo"
+    
+    # Workers add up their request metrics through files in a shared directory
+    if workers > 1:
+        metrics_dir = settings.metrics_dir or tempfile.mkdtemp(prefix="policyplay-metrics-")
+        for stale_snapshot in glob.glob(os.path.join(metrics_dir, "worker-*.json")):
+            os.remove(stale_snapshot)
+        os.environ["METRICS_DIR"] = metrics_dir
+    
+    logger.info("Starting %d workers on %s:%s (loop=%s, http=%s)", workers, host, port, loop, http)
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=settings.graceful_shutdown_seconds,
+        timeout_keep_alive=settings.keep_alive_seconds,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.forwarded_allow_ips,
+        access_log=settings.access_log
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
-    # Disable reload in Docker/production
-    reload = os.getenv("ENVIRONMENT", "development") == "development"
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=reload)
+    host = settings.server_host
+    port = settings.server_port
+    if settings.environment == "development":
+        # Single process with auto-reload for local development
+        uvicorn.run("main:app", host=host, port=port, reload=True)
+    else:
+        run_production_server(host, port)
 